@@ -1,14 +1,85 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python
+
+from __future__ import print_function
 
 VERSION = 1.0
 
+import array
+import atexit
+import bisect
+import collections
 import copy
 import getopt
+import hashlib
+import heapq
+import itertools
+import marshal
+import math
+import multiprocessing
+import numbers
 import os
 import random
-import string
+import re
+import socket
+import struct
 import sys
-import types
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#WFTM runs on Python 2.7 and on Python 3. These are the names that
+#differ between them. Text read from the terminal or a socket comes in
+#as bytes on Python 3, and goes out as bytes; toText and toBytes
+#convert, one character per byte.
+if sys.version_info[0] < 3:
+    import cPickle
+    from cStringIO import StringIO
+    from itertools import imap, izip
+
+    def getNext(iterator):
+        "Returns iterator's next method, for calling without a lookup."
+        return iterator.next
+
+    def toText(data):
+        return data
+
+    def toBytes(text):
+        return text
+
+    def getArrayBytes(data):
+        "Returns an array.array's contents as a string of bytes."
+        return data.tostring()
+else:
+    import pickle as cPickle
+    from io import StringIO
+    imap, izip, xrange = map, zip, range
+
+    def getNext(iterator):
+        return iterator.__next__
+
+    def toText(data):
+        return data.decode('latin-1')
+
+    def toBytes(text):
+        return text.encode('latin-1')
+
+    def getArrayBytes(data):
+        return data.tobytes()
+
+def classicDivide(a, b):
+    """Divides the way Python 2's / does: integers give integers.
+    For the few values, like Player.maxHP, that may be either."""
+    if isinstance(a, float) or isinstance(b, float):
+        return a / b
+    return a // b
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None #Not in Python 2; see the game server
 
 ### Constants
 
@@ -22,6 +93,31 @@ MAX_DUNGEON_LEVEL = 65 #Level the player must descend to to win the game
 SCORE_MULTIPLIER = .5   #Monster point value = monster HP * dungeon level-dependent number * this
 HEALING_PER_TURN = 50.0/8
 
+#The constants above are only defaults: games read them from a Balance
+#(Game.balance), so that different games can be played with different
+#ones. These are the names they go by there.
+BALANCE_DEFAULTS = [ ('goldConstant', GOLD_CONSTANT),
+                     ('itemConstant', ITEM_CONSTANT),
+                     ('monsterToughnessConstant', MONSTER_TOUGHNESS_CONSTANT),
+                     ('maxDungeonLevel', MAX_DUNGEON_LEVEL),
+                     ('scoreMultiplier', SCORE_MULTIPLIER),
+                     ('healingPerTurn', HEALING_PER_TURN) ]
+
+class Balance:
+    """One setting of the constants that decide how hard the game is
+    and how it's scored. Any left out keep their defaults."""
+
+    def __init__(self, **values):
+        for (name, default) in BALANCE_DEFAULTS:
+            setattr(self, name, values.pop(name, default))
+        if values:
+            raise ValueError('no such constant as "%s"' % list(values)[0])
+
+    def getValues(self):
+        "Returns (name, value) for every constant, in a fixed order."
+        return [(name, getattr(self, name)) for (name, default)
+                in BALANCE_DEFAULTS]
+
 #Alignments
 LAWFUL = 0
 NEUTRAL = 1
@@ -58,6 +154,18 @@ GENERIC_SACRIFICE_PRAYERS = [ '"O %s, accept this humble sacrifice..."',
 GENERIC_BLESSING_PRAYERS = [ '"O great and powerful %s, I crave a boon."',
                              '"%s, I beseech thee, bestow upon me some sign of favor."' ]
 
+GENERIC_PRAYERS = { INTERCESSORY_PRAYER : GENERIC_HELP_PRAYERS,
+                    SACRIFICIAL_PRAYER : GENERIC_SACRIFICE_PRAYERS,
+                    BLESSING_PRAYER : GENERIC_BLESSING_PRAYERS }
+
+#Ways a game can end
+END_WON = 'sacrificing the Amulet'
+END_QUIT = 'quitting'
+END_DIED = 'dying'
+
+#How game results store the ways a game can end
+ENDS = (None, END_WON, END_QUIT, END_DIED)
+
 class Role:
     def __init__(self, key, name, pluralName, title,
                  alignmentRestrictions = None, raceRestrictions=None,
@@ -66,22 +174,22 @@ class Role:
 
         self.greeting = greeting
 
-        if type(name) == types.StringType:
+        if type(name) == str:
             self.names = (name, name)
         else:
             self.names = name
 
         self.pluralName = pluralName
 
-        if type(title) == types.StringType:
+        if type(title) == str:
             self.titles = (title, title)
         else:
             self.titles = title
 
-        if type(alignmentRestrictions) == types.StringType:
+        if type(alignmentRestrictions) == str:
             alignmentRestrictions = [alignmentRestrictions]
 
-        if type(raceRestrictions) == types.StringType:
+        if type(raceRestrictions) == str:
             raceRestrictions = [raceRestrictions]
 
         self.alignmentRestrictions = alignmentRestrictions
@@ -118,6 +226,30 @@ raceData = {
     'gnome' : [NEUTRAL],
     'orc' : [CHAOTIC]
     }
+RACES = ('orc', 'elf', 'dwarf', 'human', 'gnome') #Python 2's order for raceData
+
+def getRaceOptions(role, alignment):
+    """Returns the races a champion of the given role and alignment may
+    be, followed by the races open to them if they become a priest."""
+    possibleRacesModuloClass = list(RACES)
+    possibleRaces = list(RACES)
+    aRestrict = role.alignmentRestrictions
+    rRestrict = role.raceRestrictions
+
+    for race in copy.copy(possibleRaces):
+        try:
+            classOkay = 0
+            raceData[race].index(alignment)
+            classOkay = 1
+            if aRestrict:
+                aRestrict.index(alignment)
+            if rRestrict:
+                rRestrict.index(race)
+        except Exception:
+            possibleRaces.remove(race)
+            if not classOkay:
+                possibleRacesModuloClass.remove(race)
+    return possibleRaces, possibleRacesModuloClass
 
 genderData = {
     'male' : ('he', 'him', 'his'),
@@ -139,94 +271,696 @@ gods = {
     'w' : ('Ptah', 'Thoth', 'Anhur')
     }
 
-### Stuff copied from the Python Cookbook
+#Worked out once here, so that creating a champion comes down to a few
+#lookups: what getRaceOptions says for every role and alignment, each
+#gender's pronouns with their capitals, and the role keys a champion
+#draws from to decide whether to become a priest. (The races and role
+#keys are in the order Python 2 always listed them, which seeds have
+#always played by.)
+raceOptions = {}
+for role in roles:
+    for alignment in alignments:
+        raceOptions[(role.key, alignment)] = getRaceOptions(role, alignment)
+pronouns = {}
+for (gender, words) in genderData.items():
+    pronouns[gender] = words + tuple([word.capitalize() for word in words])
+ROLE_KEYS = ['a', 'c', 'b', 'h', 'k', 'm', 'p', 's', 'r', 't', 'w', 'v', 'R']
+
+### Keyboard input
 
-class _Getch:
-    """Gets a single character from standard input.  Does not echo to the
-    screen."""
-    def __init__(self):
+#Keys come from the game's keyboard (Game.keyboard), which has a read
+#method returning one key and raising EOFError when there are no more,
+#and a close method. Running out of keys is the same as quitting.
+
+SCRIPT_CHUNK = 4096 #Bytes ScriptedKeys reads from a file at a time
+
+class TerminalKeys:
+    """Reads keys from the terminal on standard input, without echoing
+    them or waiting for a whole line. The terminal is switched over
+    once, at the first key, and switched back by close or at exit; it
+    is left in cbreak rather than raw mode, so that what the game says
+    still gets its newlines. Keys typed ahead are read all at once."""
+
+    def __init__(self, file=None):
+        self.file = file or sys.stdin
+        self.settings = None
+        self.typed = ''
+
+    def read(self):
+        if not self.typed:
+            if os.name in ('nt', 'dos'):
+                import msvcrt
+                return toText(msvcrt.getch())
+            if self.settings == None:
+                self.start()
+            self.typed = toText(os.read(self.file.fileno(), SCRIPT_CHUNK))
+            if not self.typed:
+                raise EOFError
+        key = self.typed[0]
+        self.typed = self.typed[1:]
+        return key
+
+    def start(self):
+        import termios, tty
+        fd = self.file.fileno()
+        self.settings = termios.tcgetattr(fd)
+        tty.setcbreak(fd)
+        atexit.register(self.close)
+
+    def close(self):
+        if self.settings != None:
+            import termios
+            termios.tcsetattr(self.file.fileno(), termios.TCSADRAIN,
+                              self.settings)
+            self.settings = None
+
+class ScriptedKeys:
+    """Plays keys from a script, with no terminal: a string, a file or
+    pipe (read SCRIPT_CHUNK bytes at a time), or any iterable of
+    strings of keys."""
+
+    def __init__(self, script):
+        if isinstance(script, str):
+            script = [script]
+        elif hasattr(script, 'read'):
+            #Bytes, so that \r comes through as typed on Python 3 too.
+            read = getattr(script, 'buffer', script).read
+            script = iter(lambda: toText(read(SCRIPT_CHUNK)), '')
+        self.next = getNext(itertools.chain.from_iterable(script))
+
+    def read(self):
         try:
-            self.impl = _GetchWindows()
-        except ImportError: pass
-        self.impl = _GetchUnix()
+            return self.next()
+        except StopIteration:
+            raise EOFError
 
-    def __call__(self): return self.impl()
+    def close(self):
+        pass
 
-class _GetchUnix:
-    def __init__(self):
-        import tty, sys
+### God policies
+
+class Policy:
+    """Decides how a god answers prayers. Each method returns what the
+    player would have typed at the corresponding prompt. This base
+    policy ignores everything."""
+
+    def handlePrayerHelp(self, god, worshipper, troubleLevel, mood):
+        "Returns 'h' to help, 'i' to ignore or 's' to smite."
+        return 'i'
+
+    def handlePrayerBlessing(self, god, worshipper, mood):
+        "Returns 'g' to grant a boon, 'i' to ignore or 's' to smite."
+        return 'i'
+
+    def handlePrayerSacrifice(self, god, worshipper, value):
+        """Returns true to show some sign of favor. The value is 1, 0 or
+        -1 for great, decent or poor sacrifices."""
+        return 0
+
+    #The Population engine answers a whole batch of prayers at once.
+    #These take the population, an array of the praying champions'
+    #indices and arrays of the arguments above, and return an array
+    #of answers.
+
+    def handlePrayerHelpVector(self, population, who, troubleLevels, moods):
+        return numpy.repeat('i', len(who))
+
+    def handlePrayerBlessingVector(self, population, who, moods):
+        return numpy.repeat('i', len(who))
+
+    def handlePrayerSacrificeVector(self, population, who, values):
+        return numpy.zeros(len(who), bool)
+
+class InteractivePolicy(Policy):
+    "Asks the player sitting at the keyboard."
+
+    def __init__(self, game):
+        self.game = game
+
+    def handlePrayerHelp(self, god, worshipper, troubleLevel, mood):
+        return self.game.getCharacter('his', allowQuit=1)
+
+    def handlePrayerBlessing(self, god, worshipper, mood):
+        return self.game.getCharacter('gis', allowQuit=1)
+
+    def handlePrayerSacrifice(self, god, worshipper, value):
+        return self.game.getYesNo('Show some sign of favor?')
+
+class KindPolicy(Policy):
+    "Always helps, always grants boons."
+
+    def handlePrayerHelp(self, god, worshipper, troubleLevel, mood):
+        return 'h'
+
+    def handlePrayerBlessing(self, god, worshipper, mood):
+        return 'g'
+
+    def handlePrayerSacrifice(self, god, worshipper, value):
+        return 1
+
+    def handlePrayerHelpVector(self, population, who, troubleLevels, moods):
+        return numpy.repeat('h', len(who))
+
+    def handlePrayerBlessingVector(self, population, who, moods):
+        return numpy.repeat('g', len(who))
+
+    def handlePrayerSacrificeVector(self, population, who, values):
+        return numpy.ones(len(who), bool)
+
+class MoodPolicy(Policy):
+    """Does whatever the god's mood suggests; that is, always picks the
+    first option offered."""
+
+    def handlePrayerHelp(self, god, worshipper, troubleLevel, mood):
+        return 'sih'[mood+1]
+
+    def handlePrayerBlessing(self, god, worshipper, mood):
+        return 'sig'[mood+1]
+
+    def handlePrayerSacrifice(self, god, worshipper, value):
+        return 1
+
+    def handlePrayerHelpVector(self, population, who, troubleLevels, moods):
+        return numpy.array(list('sih'))[moods+1]
+
+    def handlePrayerBlessingVector(self, population, who, moods):
+        return numpy.array(list('sig'))[moods+1]
+
+    def handlePrayerSacrificeVector(self, population, who, values):
+        return numpy.ones(len(who), bool)
+
+class RandomPolicy(Policy):
+    "Picks any option at random."
+
+    def handlePrayerHelp(self, god, worshipper, troubleLevel, mood):
+        return god.rng.choice('his')
+
+    def handlePrayerBlessing(self, god, worshipper, mood):
+        return god.rng.choice('gis')
+
+    def handlePrayerSacrifice(self, god, worshipper, value):
+        return god.rng.randint(0, 1)
+
+    def handlePrayerHelpVector(self, population, who, troubleLevels, moods):
+        return numpy.array(list('his'))[population.randint(0, 2, len(who))]
+
+    def handlePrayerBlessingVector(self, population, who, moods):
+        return numpy.array(list('gis'))[population.randint(0, 2, len(who))]
+
+    def handlePrayerSacrificeVector(self, population, who, values):
+        return population.randint(0, 1, len(who)) == 1
+
+LEVEL_BANDS = [1, 17, 33, 49] #Dungeon levels where TablePolicy's bands start
+TABLE_ROWS = ['his'] * 3 + ['gis'] * 3 + ['yn'] * 2 #Answers for each row
+
+class TablePolicy(Policy):
+    """Looks the answer up in a table, by the god's mood (or, for
+    sacrifices, how good the sacrifice was) and which band of dungeon
+    levels the champion is in; see LEVEL_BANDS. The table is given as
+    a code with one answer per cell, row by row: help for hostile,
+    indifferent and pleased moods, blessings for the same, then
+    sacrifices for decent and great values. The default code does what
+    MoodPolicy does."""
+
+    def __init__(self, code=None):
+        bands = len(LEVEL_BANDS)
+        if code == None:
+            code = ''.join([answer * bands for answer in 'sihsigyy'])
+        if len(code) != len(TABLE_ROWS) * bands:
+            raise ValueError('policy tables have %d cells' % (len(TABLE_ROWS) * bands))
+        for i in range(len(code)):
+            if self.getAnswers(i).find(code[i]) == -1:
+                raise ValueError('bad answer "%s" in policy table' % code[i])
+        self.code = code
+
+    def getAnswers(self, cell):
+        "Returns the answers allowed in a cell."
+        return TABLE_ROWS[cell // len(LEVEL_BANDS)]
+
+    def getCell(self, row, level):
+        return row * len(LEVEL_BANDS) + bisect.bisect_right(LEVEL_BANDS, level) - 1
+
+    def handlePrayerHelp(self, god, worshipper, troubleLevel, mood):
+        return self.code[self.getCell(mood + 1, worshipper.dungeonLevel)]
+
+    def handlePrayerBlessing(self, god, worshipper, mood):
+        return self.code[self.getCell(mood + 4, worshipper.dungeonLevel)]
+
+    def handlePrayerSacrifice(self, god, worshipper, value):
+        return self.code[self.getCell(max(0, value) + 6,
+                                      worshipper.dungeonLevel)] == 'y'
+
+    def getCellsVector(self, population, who, rows):
+        bands = numpy.searchsorted(LEVEL_BANDS, population.dungeonLevel[who],
+                                   'right') - 1
+        return numpy.array(list(self.code))[rows * len(LEVEL_BANDS) + bands]
+
+    def handlePrayerHelpVector(self, population, who, troubleLevels, moods):
+        return self.getCellsVector(population, who, moods + 1)
+
+    def handlePrayerBlessingVector(self, population, who, moods):
+        return self.getCellsVector(population, who, moods + 4)
+
+    def handlePrayerSacrificeVector(self, population, who, values):
+        return self.getCellsVector(population, who,
+                                   numpy.maximum(0, values) + 6) == 'y'
+
+    def getTable(self):
+        "Returns the table as lines of text."
+        bands = len(LEVEL_BANDS)
+        header = '%-22s' % 'levels'
+        for i in range(bands):
+            if i + 1 < bands:
+                header = header + '%7s' % ('%d-%d' % (LEVEL_BANDS[i],
+                                                      LEVEL_BANDS[i+1] - 1))
+            else:
+                header = header + '%7s' % ('%d+' % LEVEL_BANDS[i])
+        lines = [header]
+        for (row, name) in enumerate(['help, hostile', 'help, indifferent',
+                                      'help, pleased', 'blessing, hostile',
+                                      'blessing, indifferent',
+                                      'blessing, pleased', 'sacrifice, decent',
+                                      'sacrifice, great']):
+            line = '%-22s' % name
+            for i in range(bands):
+                line = line + '%7s' % self.code[row * bands + i]
+            lines.append(line)
+        return lines
+
+class ForcedPolicy(Policy):
+    """Gives one set answer to the next prayer, for playing a game on
+    from a snapshot (see playFromSnapshot). Then it reseeds the random
+    number generator, if given a seed, and gives the god back the
+    policy it had."""
+
+    def __init__(self, god, key, seed=None):
+        self.god = god
+        self.policy = god.policy
+        self.key = key
+        self.seed = seed
+
+    def answer(self):
+        self.god.policy = self.policy
+        if self.seed != None:
+            self.god.rng.seed(self.seed)
+        return self.key
+
+    def handlePrayerHelp(self, god, worshipper, troubleLevel, mood):
+        return self.answer()
+
+    def handlePrayerBlessing(self, god, worshipper, mood):
+        return self.answer()
+
+    def handlePrayerSacrifice(self, god, worshipper, value):
+        return self.answer() == 'y'
+
+policies = { 'aloof' : Policy,
+             'kind' : KindPolicy,
+             'mood' : MoodPolicy,
+             'random' : RandomPolicy,
+             'table' : TablePolicy }
+
+### Output sinks
+
+#All game text goes through the game's sink (Game.out), never straight
+#to print. Sinks take a format string and its arguments separately, so
+#a sink that throws text away never pays for formatting it; callers
+#that have to work to build a message can check quiet first, as long
+#as that work draws no random numbers. A game must play the same with
+#every sink.
+
+WRAP_CACHE_SIZE = 1024 #Wrapped texts remembered by wrap
+
+_wrapped = collections.OrderedDict()
+
+def wrap(s, width=78):
+    """Breaks s into lines, replacing a space with a newline wherever
+    the next word would reach width. Based on a Python Cookbook recipe
+    by Mike Brown, but in one pass, and remembering the most recently
+    used WRAP_CACHE_SIZE results."""
+    key = (s, width)
+    wrapped = _wrapped.pop(key, None)
+    if wrapped == None:
+        words = s.split(' ')
+        pieces = [words[0]]
+        column = len(words[0]) - words[0].rfind('\n') - 1
+        for word in words[1:]:
+            if column + len(word) >= width:
+                pieces.append('\n')
+                column = 0
+            else:
+                pieces.append(' ')
+                column = column + 1
+            pieces.append(word)
+            newline = word.rfind('\n')
+            if newline == -1:
+                column = column + len(word)
+            else:
+                column = len(word) - newline - 1
+        wrapped = ''.join(pieces)
+        if len(_wrapped) >= WRAP_CACHE_SIZE:
+            _wrapped.popitem(0)
+    _wrapped[key] = wrapped
+    return wrapped
+
+class TerminalSink:
+    "Writes game text to standard output as soon as it's said."
+
+    quiet = 0
+
+    def __init__(self, file=None):
+        self.file = file
+
+    def say(self, format='', *args):
+        "Says one line."
+        if args:
+            format = format % args
+        self.write(format + '\n')
+
+    def sayWrapped(self, format, *args):
+        "Says a paragraph, word-wrapped."
+        if args:
+            format = format % args
+        self.write(wrap(format) + '\n')
 
-    def __call__(self):
-        import sys, tty, termios
-        if hasattr(termios, 'TCSADRAIN'):
-            iomod = termios
+    def write(self, text):
+        "Says text as it is, with no newline; for prompts."
+        (self.file or sys.stdout).write(text)
+
+    def flush(self):
+        (self.file or sys.stdout).flush()
+
+    def clear(self):
+        "Clears the screen."
+        if os.name in ('nt', 'dos'):
+            self.flush()
+            os.system('cls')
         else:
-            import TERMIOS
-            iomod = TERMIOS
+            self.write(ANSI_CLEAR)
 
-        fd = sys.stdin.fileno()
-        old_settings = termios.tcgetattr(fd)
-        try:
-            tty.setraw(sys.stdin.fileno())
-            ch = sys.stdin.read(1)
-        finally:
-            termios.tcsetattr(fd, iomod.TCSADRAIN, old_settings)
-            return ch
+    def status(self, fields):
+        "Shows the champion's status, given as strings; see AnsiSink."
+        pass
 
-class _GetchWindows:
-    def __init__(self):
-        import msvcrt
+    def close(self):
+        "Says anything still unsaid, at the end of the game."
+        self.flush()
+
+class BufferedSink(TerminalSink):
+    """Keeps game text until there's size of it, then writes it all at
+    once. Anything that waits for the user must flush first."""
+
+    def __init__(self, file=None, size=65536):
+        TerminalSink.__init__(self, file)
+        self.size = size
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered = self.buffered + len(text)
+        if self.buffered >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            TerminalSink.write(self, ''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        TerminalSink.flush(self)
+
+STATUS_FIELD_WIDTH = 16 #Columns given to each field of the status line
+
+class AnsiSink(BufferedSink):
+    """Draws on an ANSI terminal with escape sequences. The bottom line
+    of the screen is kept for the champion's status, and the rest
+    scrolls above it. Each field of the status line has a place of its
+    own, and only fields that have changed since they were last drawn
+    are drawn again. Everything waits in the buffer until the game
+    waits for the user, so each screen update is one write."""
+
+    def __init__(self, file=None, size=65536):
+        BufferedSink.__init__(self, file, size)
+        self.rows = getTerminalRows(self.file or sys.stdout)
+        self.shown = [] #The status fields on the screen
+        self.write('\x1b[1;%dr\x1b[%dH' % (self.rows - 1, self.rows - 1))
+
+    def clear(self):
+        self.write(ANSI_CLEAR)
+        self.shown = []
+
+    def status(self, fields):
+        pieces = ['\x1b7']
+        for (i, field) in enumerate(fields):
+            if i < len(self.shown) and self.shown[i] == field:
+                continue
+            pieces.append('\x1b[%d;%dH%-*s' % (self.rows,
+                                              i * STATUS_FIELD_WIDTH + 1,
+                                              STATUS_FIELD_WIDTH,
+                                              field[:STATUS_FIELD_WIDTH - 1]))
+        if len(pieces) > 1:
+            pieces.append('\x1b8')
+            self.write(''.join(pieces))
+        self.shown = list(fields)
+
+    def close(self):
+        #Give the whole screen back and leave the cursor at the bottom.
+        self.write('\x1b[r\x1b[%dH\n' % self.rows)
+        self.flush()
+
+ANSI_CLEAR = '\x1b[H\x1b[2J'
+
+def getTerminalRows(file, default=24):
+    "Returns how many lines a terminal has."
+    try:
+        import fcntl, termios
+        rows, columns = struct.unpack('hh', fcntl.ioctl(file.fileno(),
+                                                        termios.TIOCGWINSZ,
+                                                        b'    '))
+    except (ImportError, IOError, AttributeError):
+        return default
+    return rows or default
+
+class NullSink:
+    "Throws game text away without formatting it."
+
+    quiet = 1
+
+    def say(self, format='', *args):
+        pass
+
+    sayWrapped = say
+
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+    clear = close = flush
+
+    def status(self, fields):
+        pass
+
+### Random numbers
 
-        def __call__(self):
-            import msvcrt
-            return msvcrt.getch()
+#Games draw every random number from their own generator (Game.rng,
+#God.rng, Player.rng), so games in one process don't disturb each
+#other. Any random.Random will do. StandardRandom plays the same games
+#for a seed on Python 2 and 3; FastRandom is a quicker one.
 
-getch = _Getch()
+FAST_RANDOM_BUFFER = 8192 #Uniforms FastRandom makes at a time
+
+if sys.version_info[0] < 3:
+    StandardRandom = random.Random
+else:
+    class StandardRandom(random.Random):
+        """random.Random as it is on Python 2. Python 3 picks integers
+        and choices with getrandbits instead of scaling random(), so
+        the same seed would play different games; this picks them the
+        Python 2 way, from the same stream of uniforms."""
+
+        def randrange(self, start, stop=None, step=1, int=int):
+            istart = int(start)
+            if istart != start:
+                raise ValueError('non-integer arg 1 for randrange()')
+            if stop == None:
+                if istart > 0:
+                    return int(self.random() * istart)
+                raise ValueError('empty range for randrange()')
+            istop = int(stop)
+            if istop != stop:
+                raise ValueError('non-integer stop for randrange()')
+            if step != 1 or istop <= istart:
+                return random.Random.randrange(self, istart, istop, step)
+            return int(istart + int(self.random() * (istop - istart)))
+
+        def randint(self, a, b, int=int):
+            #Most of a game's time goes on picking integers, so the
+            #usual case skips randrange's checks.
+            if type(a) is int and type(b) is int and a <= b:
+                return a + int(self.random() * (b - a + 1))
+            return self.randrange(a, b + 1)
+
+        def choice(self, seq):
+            return seq[int(self.random() * len(seq))]
+
+        def shuffle(self, x):
+            for i in reversed(xrange(1, len(x))):
+                j = int(self.random() * (i + 1))
+                x[i], x[j] = x[j], x[i]
+
+class FastRandom(StandardRandom):
+    """A random.Random that gets its uniforms from NumPy a buffer at a
+    time, then hands them out one by one with no Python code in
+    between. randint and randrange come down to one multiplication,
+    which makes them more than twice as quick as random.Random's,
+    though no quicker than StandardRandom's, which take the same
+    shortcut; and seeding a NumPy generator for every game costs more
+    than the buffer saves in games as short as most are.
+
+    NumPy's generator is the same Mersenne Twister as random.Random's,
+    seeded the same way, and randint and randrange take int(random() *
+    n) for a range of n just as StandardRandom's do; so for the same
+    seed, FastRandom gives exactly the same numbers, only sooner. The
+    state is where the current buffer came from and how much of it has
+    been used, so getstate and setstate work as usual, though not with
+    random.Random's states."""
+
+    def __init__(self, seed=None):
+        if numpy == None:
+            raise ImportError('FastRandom needs NumPy')
+        self.buffer = iter(())
+        next = getNext(itertools.chain.from_iterable(iter(self.refill, None)))
+        #Plain functions, not methods, to save binding them on every call.
+        def randint(a, b, int=int):
+            return a + int(next() * (b - a + 1))
+        def randrange(start, stop=None, int=int):
+            if stop == None:
+                return int(next() * start)
+            return start + int(next() * (stop - start))
+        self.random = next
+        self.randint = randint
+        self.randrange = randrange
+        StandardRandom.__init__(self, seed)
+
+    def seed(self, a=None):
+        if a != None:
+            if not isinstance(a, numbers.Integral):
+                a = hash(a)
+            a = abs(a)
+            words = []
+            while a or not words:
+                words.append(a & 0xffffffff)
+                a = a >> 32
+            a = words
+        self.source = numpy.random.RandomState(a)
+        self.restart()
+
+    def restart(self):
+        """Throws away what's left of the buffer, so the next number
+        comes from source. The functions stay the same ones, for
+        callers that keep one (Player.fightRound keeps randint) across
+        a seed or setstate."""
+        self.bufferState = self.source.get_state()
+        collections.deque(self.buffer, 0)
+
+    def refill(self):
+        self.bufferState = self.source.get_state()
+        self.buffer = iter(self.source.random_sample(FAST_RANDOM_BUFFER).tolist())
+        return self.buffer
+
+    def getstate(self):
+        left = self.buffer.__length_hint__()
+        if not left:
+            return self.source.get_state(), 0
+        return self.bufferState, left
+
+    def setstate(self, state):
+        bufferState, left = state
+        self.source.set_state(bufferState)
+        self.restart()
+        if left:
+            for i in xrange(FAST_RANDOM_BUFFER - left):
+                self.random()
+
+rngs = { 'standard' : StandardRandom,
+         'fast' : FastRandom }
 
 ### The game proper
 
 class Game:
 
+    combatTables = None #See CombatTables, below
+    out = TerminalSink() #Where game text goes; see Output sinks, above
+    trace = None #A TraceWriter, if the game is being traced
+    rng = StandardRandom() #Random numbers for games not given their own
+    keyboard = None #Where keys come from; see Keyboard input, above
+    pc = None #The champion, once there is one
+    balance = Balance() #The constants games are played with
+
     def cls(self):
-        #NOTE: Nothing will happen on other systems
-        if os.name == 'posix':
-            os.system('clear')
-        elif os.name in ('nt', 'dos'):
-            os.system('cls')
+        self.out.clear()
 
     def wrap(self, s, width=78):
-        "Copied from the Python Cookbook. Written by Mike Brown."
-        return reduce(lambda line, word, width=width: "%s%s%s" %
-                      (line,
-                       ' \n'[(len(line[string.rfind(line, '\n')+1:]) +
-                              len(word) >= width)], word),
-                      string.split(s, ' ')
-                      )
+        return wrap(s, width)
 
     def usage(self, exit=1):
-        ask = alignmentSelection.keys()
-        ask.sort()
-        rs = roleMap.keys()
-        rs.sort()
-        print 'Usage: %s [-a%s] [-p%s] [-D]' % (sys.argv[0],
-                                                string.join(ask, ''),
-                                                string.join(rs, ''))
+        ask = sorted(alignmentSelection)
+        rs = sorted(roleMap)
+        ps = sorted(policies)
+        print('Usage: %s [-a%s] [-p%s] [-D]' % (sys.argv[0],
+                                                 ''.join(ask),
+                                                 ''.join(rs)), end=' ')
+        print('[--batch=GAMES [--policy=%s] [--seed=SEED]' % '|'.join(ps), end=' ')
+        print('[--engine=%s]' % '|'.join(engines), end=' ')
+        print('[--rng=%s]' % '|'.join(rngs.keys()), end=' ')
+        print('[--workers=PROCESSES] [--totals] [--table=CODE]', end=' ')
+        print('[--optimize=GENERATIONS]] [--fast-combat] [--trace=FILE]', end=' ')
+        print('[--instrument] [--serve=PORT] [--load=CLIENTS] [--keys=FILE]', end=' ')
+        print('[--check=%s]' % '|'.join(checks.keys()), end=' ')
+        print('[--bench=BASELINE [--tolerance=PERCENT]]', end=' ')
+        print('[--store=DB [--query=BY:MEASURE[,MEASURE...]]] [--stats=FILE]', end=' ')
+        print('[--sweep=NAME=LOW:HIGH[,...] [--design=grid|lhs] [--points=N]]', end=' ')
+        print('[--until=MEASURE:WIDTH [--against=NAME=VALUE[,...]]', end=' ')
+        print('[--budget=SECONDS]] [--rare=ERROR]', end=' ')
+        print('[--model=TURNS[,NAME=VALUE...]]', end=' ')
+        print('[--congregation=CHAMPIONS[:ANSWERS]]')
         sys.exit(exit)
 
     def getCharacter(self, validCharacters=None, prompt=None, allowQuit=0):
         "Stolen from Python cookbook."
         if prompt:
-            print prompt, ' ',
+            self.out.write(prompt + '  ')
+        if self.pc:
+            self.out.status(self.getStatus())
+        self.out.flush()
         if allowQuit:
             if validCharacters:
-                if string.find(validCharacters, 'q') == -1:
+                if validCharacters.find('q') == -1:
                     validCharacters = validCharacters + 'q'
             else:
                 validCharacters = 'q'
-        input = getch()
-        while validCharacters and string.find(validCharacters, input) == -1:
-            input = getch()
-        if allowQuit and string.lower(input) == 'q':
+        input = self.readKey(validCharacters)
+        if allowQuit and input.lower() == 'q':
+            sys.exit()
+        return input
+
+    def getStatus(self):
+        "Returns the fields of the status line."
+        return ('Dlvl:%d' % self.pc.dungeonLevel,
+                'HP:%d(%d)' % (max(0, self.pc.hp), self.pc.maxHP),
+                'Items:%d' % self.pc.itemPoints,
+                'Score:%d' % self.pc.score,
+                'T:%d' % self.pc.turns)
+
+    def readKey(self, validCharacters=None):
+        "Waits for one of validCharacters (or any key) to be typed."
+        try:
+            input = self.keyboard.read()
+            while validCharacters and validCharacters.find(input) == -1:
+                input = self.keyboard.read()
+        except EOFError:
             sys.exit()
         return input
 
@@ -241,52 +975,277 @@ class Game:
             return (result == 'y')
 
     def more(self, indent=0):
-        print ('' * indent) + '--More--',
+        self.out.write(('' * indent) + '--More--')
         self.getCharacter()
 
     def run(self, argv):
-        self.god = self.obtainGod(argv)
-        self.pc = self.god.getWorshipper()
-        self.cls()
-        self.printIntro()
-        self.cls()
-        self.play()
+        if not sys.stdout.isatty():
+            self.out = BufferedSink()
+        try:
+            self.god = self.obtainGod(argv)
+            if self.instrument:
+                instrument()
+            if self.check:
+                sys.exit(not self.check())
+            if self.benchPath:
+                sys.exit(not bench(self.benchPath, self.tolerance))
+            if self.load:
+                sys.exit(not loadTest(self.load, self.role, self.alignment,
+                                      self.discovery, self.seed,
+                                      self.rngClass, self.fastCombat))
+            if self.serve:
+                GameServer(self.serve, self.role, self.alignment,
+                           self.discovery, self.seed, self.rngClass,
+                           self.fastCombat).run()
+                return
+            if self.until:
+                Experiment(self.until[0], self.until[1], self.against,
+                           self.budget, self.role, self.alignment,
+                           self.discovery, self.policy, self.seed,
+                           self.engine, self.workers, self.rngClass,
+                           self.fastCombat).run()
+                return
+            if self.model:
+                started = time.time()
+                model = ProgressionModel(*self.model)
+                model.report()
+                print('Solved in %d ms' % ((time.time() - started) * 1000))
+                return
+            if self.rare:
+                Splitter(self.rare, self.batch or SPLIT_CHAMPIONS,
+                         self.budget, self.role, self.alignment,
+                         self.discovery, self.policy, self.seed,
+                         self.workers, self.rngClass, self.fastCombat).run()
+                return
+            if self.sweep:
+                Sweep(self.sweep, self.points, self.design, self.batch or 200,
+                      self.role, self.alignment, self.discovery, self.policy,
+                      self.seed, self.engine, self.workers, self.rngClass,
+                      self.fastCombat).run()
+                return
+            if self.optimize:
+                Optimizer(self.optimize, self.batch or 200, self.role,
+                          self.alignment, self.discovery, self.seed,
+                          self.engine, self.workers, self.rngClass).run()
+                return
+            if self.congregation:
+                Congregation(self.congregation[0], self.batch,
+                             self.congregation[1], self.role, self.alignment,
+                             self.discovery, self.policy, self.seed,
+                             self.rngClass, self.fastCombat).run()
+                return
+            if self.batch:
+                BatchGame(self.batch, self.role, self.alignment,
+                          self.discovery, self.policy, self.seed, self.engine,
+                          self.workers, self.totals, self.fastCombat,
+                          self.tracePath, self.rngClass, self.storePath,
+                          statsPath=self.statsPath).run()
+                return
+            if self.query:
+                if not self.storePath:
+                    self.usage()
+                printQuery(self.storePath, self.query)
+                return
+            if self.fastCombat:
+                self.combatTables = getCombatTables()
+            if self.tracePath:
+                self.trace = TraceWriter(open(self.tracePath, 'wb'))
+            self.playGame()
+        finally:
+            self.out.close()
+            if self.trace:
+                self.trace.close()
+            if self.keyboard:
+                self.keyboard.close()
 
     def splashScreen(self):
         self.cls()
-        print 'What Fools These Mortals, Copyright 2003'
-        print '                          By Leonard Richardson.'
-        print '                          See license for details.'
-        print
+        self.out.say('What Fools These Mortals, Copyright 2003')
+        self.out.say('                          By Leonard Richardson.')
+        self.out.say('                          See license for details.')
+        self.out.say()
 
     def obtainGod(self, argv):
         self.discovery = 0
         self.role = None
         self.alignment = None
+        self.batch = 0
+        self.policy = None
+        self.seed = None
+        self.engine = 'scalar'
+        self.workers = 1
+        self.totals = 0
+        self.check = None
+        self.fastCombat = 0
+        self.tracePath = None
+        self.optimize = 0
+        self.benchPath = None
+        self.tolerance = BENCH_TOLERANCE
+        self.instrument = 0
+        self.rngClass = StandardRandom
+        self.serve = 0
+        self.load = 0
+        self.keysPath = None
+        self.storePath = None
+        self.query = None
+        self.sweep = None
+        self.statsPath = None
+        self.until = None
+        self.against = None
+        self.budget = EXPERIMENT_BUDGET
+        self.rare = 0
+        self.model = None
+        self.congregation = None
+        self.design = 'grid'
+        self.points = 0
         self.collectInfoFromOptions(argv)
+        if self.against and not self.until:
+            self.usage()
+        if self.keysPath == '-':
+            self.keyboard = ScriptedKeys(sys.stdin)
+        elif self.keysPath:
+            self.keyboard = ScriptedKeys(open(self.keysPath, 'rb'))
+        elif self.keyboard == None:
+            if sys.stdin.isatty():
+                self.keyboard = TerminalKeys()
+            else:
+                self.keyboard = ScriptedKeys(sys.stdin)
+        if (self.batch or self.check or self.optimize or self.benchPath
+            or self.serve or self.load or self.query or self.sweep
+            or self.until or self.rare or self.model or self.congregation):
+            #Batch games pick a new deity for every game; served games
+            #pick their own.
+            return None
+        if sys.stdout.isatty() and os.name == 'posix':
+            self.out = AnsiSink()
+        return self.pickGod()
+
+    def pickGod(self):
+        "Asks for whatever the options didn't say, and creates the god."
+        self.rng = self.rngClass(self.seed)
         if self.role == None or self.alignment == None:
             self.splashScreen()
             self.collectInfoFromUser()
         return God(self, self.role, self.alignment)
 
+    def playGame(self):
+        "Creates the champion and plays the game with the user."
+        self.startGame()
+        self.sayEnd(self.simulate())
+
+    def startGame(self):
+        "Creates the champion and says everything before its first turn."
+        self.pc = self.god.getWorshipper()
+        self.cls()
+        self.printIntro()
+        self.cls()
+        self.out.say("%s, %s, %s protector of %s.", self.god.role.greeting, self.god.name, self.god.alignmentName, self.god.role.pluralName)
+        self.out.say("Your chosen one has just entered the dungeon.\n...\n")
+
     def collectInfoFromOptions(self, args):
         selectionMap = { 'p' : ('role', roleMap),
-                         'a' : ('alignment', alignmentSelection) }
+                         'a' : ('alignment', alignmentSelection),
+                         'policy' : ('policy', policies) }
         try:
-            optlist, args = getopt.getopt(args[1:], 'a:p:D')
+            optlist, args = getopt.getopt(args[1:], 'a:p:D',
+                                          ['batch=', 'policy=', 'seed=',
+                                           'engine=', 'workers=', 'totals',
+                                           'check=', 'fast-combat', 'trace=',
+                                           'optimize=', 'table=', 'bench=',
+                                           'tolerance=', 'instrument', 'rng=',
+                                           'serve=', 'load=', 'keys=',
+                                           'store=', 'query=', 'sweep=',
+                                           'design=', 'points=', 'stats=',
+                                           'until=', 'against=', 'budget=',
+                                           'rare=', 'model=',
+                                           'congregation='])
         except getopt.error:
             self.usage()
-        for (opt, val) in optlist:
-            opt = opt[1]
+        for (flag, val) in optlist:
+            opt = flag.lstrip('-')
             if opt == 'D':
                 self.discovery = 1
+            elif opt == 'totals':
+                self.totals = 1
+            elif opt == 'fast-combat':
+                self.fastCombat = 1
+            elif opt == 'instrument':
+                self.instrument = 1
+            elif opt == 'trace':
+                self.tracePath = val
+            elif opt == 'keys':
+                self.keysPath = val
+            elif opt == 'store':
+                self.storePath = val
+            elif opt == 'stats':
+                self.statsPath = val
+            elif opt == 'query':
+                self.query = val
+            elif opt == 'sweep':
+                self.sweep = parseRanges(val)
+            elif opt == 'until':
+                try:
+                    measure, width = val.split(':')
+                    self.until = (measure, float(width))
+                except ValueError:
+                    self.usage()
+                if measure not in EXPERIMENT_MEASURES:
+                    self.usage()
+            elif opt == 'model':
+                try:
+                    self.model = parseModel(val)
+                except ValueError:
+                    self.usage()
+            elif opt == 'congregation':
+                try:
+                    counts = [int(x) for x in val.split(':')]
+                except ValueError:
+                    self.usage()
+                if len(counts) > 2 or min(counts) < 1:
+                    self.usage()
+                self.congregation = (counts + [None])[:2]
+            elif opt == 'against':
+                self.against = parseBalance(val)
+            elif opt == 'design':
+                if val not in SWEEP_POINTS:
+                    self.usage()
+                self.design = val
+            elif opt == 'table':
+                self.policy = TablePolicy(val)
+            elif opt == 'bench':
+                self.benchPath = val
+            elif opt in ('tolerance', 'budget', 'rare'):
+                try:
+                    setattr(self, opt, float(val))
+                except ValueError:
+                    self.usage()
+            elif opt in ('batch', 'seed', 'workers', 'optimize', 'serve',
+                         'load', 'points'):
+                try:
+                    setattr(self, opt, int(val))
+                except ValueError:
+                    self.usage()
+            elif opt == 'engine':
+                if val not in engines:
+                    self.usage()
+                self.engine = val
+            elif opt == 'rng':
+                if val not in rngs:
+                    self.usage()
+                self.rngClass = rngs[val]
+            elif opt == 'check':
+                if val not in checks:
+                    self.usage()
+                self.check = checks[val]
             t = selectionMap.get(opt)
             if t:
                 name, map = t
-                if not map.has_key(val):
-                    values = map.keys()
-                    values.sort()
-                    raise ValueError, 'Invalid value "%s" for -%s; valid values are: %s' % (val, opt, string.join(values, ''))
+                if val not in map:
+                    values = sorted(map)
+                    separator = ''
+                    if len(opt) > 1:
+                        separator = ', '
+                    raise ValueError('Invalid value "%s" for %s; valid values are: %s' % (val, flag, separator.join(values)))
                 setattr(self, name, map[val])
 
     def collectInfoFromUser(self):
@@ -299,97 +1258,2157 @@ class Game:
         pick = self.getYesNo('Shall I pick %s?' % whatToPick, 1)
         if pick:
             if self.alignment == None:
-                self.alignment = random.choice(alignments)
+                self.alignment = self.rng.choice(alignments)
             if self.role == None:
                 while not self.role or not self.role.pluralName:
-                    self.role = random.choice(roles)
+                    self.role = self.rng.choice(roles)
         else:
             if self.role == None:
                 self.cls()
-                print 'Choose the profession from which you draw worshippers.'
+                self.out.say('Choose the profession from which you draw worshippers.')
                 acceptableRoles = []
                 for role in roles:
                     if role.pluralName:
-                        print indent, '%s - %s' % (role.key, role.pluralName)
+                        self.out.say('%s %s - %s', indent, role.key,
+                                     role.pluralName)
                         acceptableRoles.append(role.key)
-                print indent, '* - Random'
-                print indent, 'q - Quit'
-                acceptableChars = '*q' + string.join(acceptableRoles)
+                self.out.say('%s * - Random', indent)
+                self.out.say('%s q - Quit', indent)
+                acceptableChars = '*q' + ' '.join(acceptableRoles)
                 key = self.getCharacter(acceptableChars, indent+ ' (end)')
                 if key == 'q':
                     sys.exit()
                 if key == '*':
-                    key = random.choice(acceptableRoles)
+                    key = self.rng.choice(acceptableRoles)
                 self.role = roleMap[key]
 
             if self.alignment == None:
                 acceptableKeys = []
                 self.cls()
                 indent = ' ' * 9
-                print 'Choose an alignment.'
+                self.out.say('Choose an alignment.')
                 for i in alignments:
                     alignment = alignmentMap[i]
-                    key = string.lower(alignment[0])
+                    key = alignment[0].lower()
                     acceptableKeys.append(key)
-                    print indent, '%s - %s' % (key, alignment)
-                print indent, '* - Random'
-                print indent, 'q - Quit'
-                acceptableChars = '*q' + string.join(acceptableKeys)
+                    self.out.say('%s %s - %s', indent, key, alignment)
+                self.out.say('%s * - Random', indent)
+                self.out.say('%s q - Quit', indent)
+                acceptableChars = '*q' + ' '.join(acceptableKeys)
                 key = self.getCharacter(acceptableChars, indent+' (end)')
                 if key == 'q':
                     sys.exit()
                 if key == '*':
-                    key = random.choice(acceptableKeys)
+                    key = self.rng.choice(acceptableKeys)
                 for (align, name) in alignmentMap.items():
-                    if string.lower(name[0]) == key:
+                    if name[0].lower() == key:
                         self.alignment = align
                         break
 
-    def printIntro(self):
-        print """It is written in your most sacred book:
+    def printIntro(self):
+        self.out.say("""It is written in your most sacred book:
+
+   After the Creation, the cruel god Moloch rebelled against the
+   authority of Marduk the Creator.  Moloch stole from Marduk the most
+   powerful of all the artifacts of the gods, the Amulet of Yendor,
+   and he hid it in the dark cavities of Gehennom, the Under World,
+   where he now lurks, and bides his time.""")
+
+        self.out.say()
+        self.out.sayWrapped("You seek to possess the Amulet, and with it to gain deserved ascendance over the other gods.")
+        self.out.say()
+
+        self.out.sayWrapped("One young %s, now a newly trained %s, has been heralded from birth as your instrument.  %s is destined to recover the Amulet for you, or die in the attempt.  %s hour of destiny has come.  May %s go bravely with you!", self.pc.race, self.pc.title, self.pc.He, self.pc.His, self.pc.he)
+        self.out.say()
+        self.more()
+
+    def sayEnd(self, end):
+        "Says how the game ended and what it was worth."
+        if end == END_QUIT:
+            self.out.say("What the?!? Your chosen one just quit %s quest!", self.pc.his)
+            self.out.say("All the other gods laugh at you.")
+        elif end == END_DIED:
+            self.out.say("Argh! Your chosen one just died!")
+            self.out.say("All the other gods laugh at you.")
+        self.out.say()
+        self.more()
+        self.out.say()
+        self.out.say()
+        pluralScore = 's'
+        if self.pc.score == 1:
+            pluralScore = ''
+        self.out.say("Your chosen one scored %s point%s before %s.", self.pc.score, pluralScore, end)
+        if (self.pc.quit):
+            self.out.say('Because %s quit, you get none of that.', self.pc.he)
+        else:
+            self.out.say("Your tithe of that is %s points.", self.getTithe())
+
+    def simulate(self):
+        "Runs the champion's career to its end and says how it ended."
+        while self.pc.alive():
+            self.pc.playUntilEvent()
+        return self.finish()
+
+    def finish(self):
+        "Says how the champion's career ended, docking a dead one's score."
+        if self.pc.won:
+            end = END_WON
+        elif self.pc.quit:
+            end = END_QUIT
+        else:
+            self.pc.score = int(self.pc.score * .9)
+            end = END_DIED
+        if self.trace:
+            self.trace.record(self.pc, 'end', ENDS.index(end))
+        return end
+
+    def getTithe(self):
+        if self.pc.quit:
+            return 0
+        return int(self.pc.score * .1)
+
+    def getResult(self, end):
+        """Returns the result of a finished game, in the compact form
+        described under getSummary, below."""
+        return (self.god.role.key, self.pc.role.key, self.pc.alignment,
+                self.pc.race, self.pc.gender, ENDS.index(end), self.pc.score,
+                self.pc.deepestLevel, self.pc.turns)
+
+def getSummary(result):
+    """Turns a game result into a one-line record for people. Results
+    are tuples of the deity's role key, the champion's role key,
+    alignment, race, gender, how the game ended (an index into ENDS),
+    score, deepest level reached and turns played. The summary has
+    the deity's name, the champion's role key, the alignment's name,
+    race, gender, how the game ended, score, tithe, deepest level and
+    turns."""
+    (godRole, role, alignment, race, gender, end, score, deepestLevel,
+     turns) = result
+    end = ENDS[end]
+    tithe = int(score * .1)
+    if end == END_QUIT:
+        tithe = 0
+    return (gods[godRole][alignment], role, alignmentMap[alignment], race,
+            gender, end, score, tithe, deepestLevel, turns)
+
+class Tally:
+    """Totals over a set of game results. Everything is kept as whole
+    numbers, so tallies come out exactly the same whatever order the
+    results are added and merged in."""
+
+    def __init__(self):
+        self.games = 0
+        self.ends = [0] * len(ENDS)
+        self.score = 0
+        self.tithe = 0
+        self.deepestLevel = 0
+        self.turns = 0
+
+    def add(self, result):
+        summary = getSummary(result)
+        self.games = self.games + 1
+        self.ends[result[5]] = self.ends[result[5]] + 1
+        self.score = self.score + summary[6]
+        self.tithe = self.tithe + summary[7]
+        self.deepestLevel = self.deepestLevel + summary[8]
+        self.turns = self.turns + summary[9]
+
+    def merge(self, other):
+        self.games = self.games + other.games
+        for i in range(len(ENDS)):
+            self.ends[i] = self.ends[i] + other.ends[i]
+        self.score = self.score + other.score
+        self.tithe = self.tithe + other.tithe
+        self.deepestLevel = self.deepestLevel + other.deepestLevel
+        self.turns = self.turns + other.turns
+
+    def getFields(self):
+        "Returns games, win, quit and death rates and mean values."
+        games = float(max(1, self.games))
+        return ((self.games,) +
+                tuple(['%.4f' % (self.ends[i] / games) for i in (1, 2, 3)]) +
+                tuple(['%.2f' % (x / games) for x in (self.score, self.tithe,
+                                                      self.deepestLevel,
+                                                      self.turns)]))
+
+TALLY_FIELDS = ('deity', 'games', 'won', 'quit', 'died', 'score', 'tithe',
+                'deepest', 'turns')
+
+class BatchGame(Game):
+    """Plays many complete games without a terminal. Every decision a
+    deity would make is handed to a policy (see policies, above) and
+    the only output is one tab-separated summary line per game."""
+
+    out = NullSink()
+
+    def __init__(self, games, role=None, alignment=None, discovery=0,
+                 policy=None, seed=None, engine='scalar', workers=1,
+                 totals=0, fastCombat=0, tracePath=None, rng=None,
+                 storePath=None, balance=None, statsPath=None):
+        self.games = games
+        self.statsPath = statsPath
+        self.balance = balance or Game.balance
+        self.role = role
+        self.alignment = alignment
+        self.discovery = discovery
+        if not isinstance(policy, Policy):
+            policy = (policy or MoodPolicy)()
+        self.policy = policy
+        if seed == None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.engine = engine
+        self.workers = workers
+        self.totals = totals
+        self.fastCombat = fastCombat
+        if fastCombat:
+            self.combatTables = getCombatTables(balance=self.balance)
+        if tracePath and engine == 'vector':
+            raise ValueError("the vector engine can't be traced")
+        self.tracePath = tracePath
+        self.rngClass = rng or StandardRandom
+        self.storePath = storePath
+
+    def cls(self):
+        pass
+
+    def getCharacter(self, validCharacters=None, prompt=None, allowQuit=0):
+        #Anything that still asks has no policy behind it; just
+        #pick the first option.
+        if validCharacters:
+            return validCharacters[0]
+        return ' '
+
+    def getYesNo(self, message, allowQuit=0):
+        return 1
+
+    def more(self, indent=0):
+        pass
+
+    def run(self, argv=None):
+        if self.statsPath:
+            self.gatherStatistics().report()
+            return
+        results = self.playAll()
+        store = None
+        if self.storePath:
+            store = ResultStore(self.storePath)
+        try:
+            if self.totals:
+                if store:
+                    results = store.keep(results)
+                self.printTotals(results)
+            elif store:
+                store.addAll(results)
+            else:
+                for result in results:
+                    self.printRow(getSummary(result))
+        finally:
+            if store:
+                store.close()
+
+    def printRow(self, fields):
+        sys.stdout.write('\t'.join(map(str, fields)) + '\n')
+
+    def printTotals(self, results):
+        "Prints a tally for each deity, then one for all of them."
+        tallies = {}
+        total = Tally()
+        for result in results:
+            name = getSummary(result)[0]
+            if name not in tallies:
+                tallies[name] = Tally()
+            tallies[name].add(result)
+        self.printRow(TALLY_FIELDS)
+        names = sorted(tallies)
+        for name in names:
+            self.printRow((name,) + tallies[name].getFields())
+            total.merge(tallies[name])
+        if len(names) > 1:
+            self.printRow(('all',) + total.getFields())
+
+    def playAll(self):
+        """Generates the result of every game, in order. Games are
+        played in blocks of BLOCK_GAMES, each with its own seed derived
+        from the master seed, so a seed always gives the same games
+        however many worker processes play them."""
+        blocks = self.getBlocks()
+        trace = None
+        if self.tracePath:
+            trace = TraceWriter(open(self.tracePath, 'wb'))
+        pool = None
+        if self.workers > 1 and len(blocks) > 1:
+            pool = multiprocessing.Pool(self.workers)
+            blockResults = pool.imap(playBlock, blocks)
+        else:
+            blockResults = imap(playBlock, blocks)
+        for (results, records) in blockResults:
+            if trace:
+                trace.write(records)
+            for result in results:
+                yield result
+        if trace:
+            trace.close()
+        if pool:
+            pool.close()
+            pool.join()
+
+    def getBlocks(self):
+        "Returns playBlock's arguments for each block, in order."
+        size = BLOCK_GAMES[self.engine]
+        blocks = []
+        for start in xrange(0, self.games, size):
+            blocks.append((min(size, self.games - start),
+                           self.role and self.role.key, self.alignment,
+                           self.discovery, self.policy,
+                           getBlockSeed(self.seed, start // size), self.engine,
+                           self.fastCombat, self.tracePath and start,
+                           self.rngClass, self.balance))
+        return blocks
+
+    def gatherStatistics(self):
+        """Plays the games into a Statistics a block at a time, saving
+        it in statsPath after every block, along with how many blocks it
+        holds. Given a statsPath saved by the same run (the same options
+        and seed), it carries on from where that left off."""
+        blocks = self.getBlocks()
+        signature = hashlib.sha1(cPickle.dumps(
+            (ENGINE_VERSION, [block[:-1] + (block[-1].getValues(),)
+                              for block in blocks]), 2)).hexdigest()
+        done = 0
+        statistics = Statistics()
+        if os.path.exists(self.statsPath):
+            f = open(self.statsPath, 'rb')
+            try:
+                saved, done, statistics = cPickle.load(f)
+            finally:
+                f.close()
+            if saved != signature:
+                raise ValueError('%s was saved by a different run' % self.statsPath)
+        pool = None
+        if self.workers > 1 and len(blocks) - done > 1:
+            pool = multiprocessing.Pool(self.workers)
+            blockStatistics = pool.imap(statisticsBlock, blocks[done:])
+        else:
+            blockStatistics = imap(statisticsBlock, blocks[done:])
+        try:
+            for block in blockStatistics:
+                statistics.merge(block)
+                done = done + 1
+                f = open(self.statsPath + '.new', 'wb')
+                try:
+                    cPickle.dump((signature, done, statistics), f, 2)
+                finally:
+                    f.close()
+                os.rename(self.statsPath + '.new', self.statsPath)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        return statistics
+
+    def playBlock(self, first=None):
+        """Plays all the games right here. Returns a list of results and
+        the packed trace records, if first (the number of the block's
+        first game) isn't None. Every scalar game gets its own random
+        number generator, seeded from the block's seed and the game's
+        place in the block, so any one game can be played again by
+        itself."""
+        if self.engine == 'vector':
+            self.rng = StandardRandom(self.seed)
+            return list(self.playVectorized()), ''
+        if first != None:
+            self.trace = TraceWriter()
+        results = []
+        for i in xrange(self.games):
+            if self.trace:
+                self.trace.game = first + i
+            self.rng = self.rngClass(getBlockSeed(self.seed, i))
+            results.append(self.getResult(self.playOne()))
+        return results, self.trace and self.trace.getvalue() or ''
+
+    def pickDeity(self):
+        role = self.role
+        while not role or not role.pluralName:
+            role = self.rng.choice(roles)
+        alignment = self.alignment
+        if alignment == None:
+            alignment = self.rng.choice(alignments)
+        return role, alignment
+
+    def playOne(self):
+        "Creates a deity and a champion and plays the game out."
+        role, alignment = self.pickDeity()
+        self.god = God(self, role, alignment, self.policy)
+        self.pc = self.god.getWorshipper()
+        return self.simulate()
+
+    def playVectorized(self):
+        """Generates game results from the Population engine, grouped
+        by deity."""
+        if numpy == None:
+            raise ImportError('the vector engine needs NumPy')
+        counts = {}
+        for i in xrange(self.games):
+            deity = self.pickDeity()
+            counts[deity] = counts.get(deity, 0) + 1
+        deities = sorted(counts, key=lambda deity: (deity[0].key, deity[1]))
+        rng = numpy.random.Generator(numpy.random.PCG64(self.rng.randint(0, 2**31-1)))
+        for (role, alignment) in deities:
+            population = Population(counts[(role, alignment)], role, alignment,
+                                    self.policy, self.discovery, rng,
+                                    balance=self.balance)
+            population.run()
+            for result in population.getResults():
+                yield result
+
+def getBlockSeed(seed, block):
+    "Derives the seed for one block of a batch from the master seed."
+    return int(hashlib.sha1(('%s:%s' % (seed, block)).encode('ascii'))
+               .hexdigest()[:8], 16)
+
+def playBlock(args):
+    """Plays a block of batch games; see BatchGame.playAll. This runs in
+    worker processes, so everything it takes and returns must pickle."""
+    (games, roleKey, alignment, discovery, policy, seed, engine,
+     fastCombat, first, rng, balance) = args
+    role = roleKey and roleMap[roleKey]
+    return BatchGame(games, role, alignment, discovery, policy, seed,
+                     engine, fastCombat=fastCombat, rng=rng,
+                     balance=balance).playBlock(first)
+
+### Results store
+
+#Batch results can be kept in an SQLite database (--store). Every game
+#goes into the games table. The totals table adds them up for each
+#combination of deity, champion and how and where the game ended; there
+#are only some thousands of those however many games are kept, so
+#queries are answered from it, not from the games.
+
+STORE_BATCH = 20000 #Games inserted per transaction
+STORE_DIMENSIONS = { 'deity' : 'deity', 'god' : 'deity', 'role' : 'role',
+                     'alignment' : 'alignment', 'race' : 'race',
+                     'gender' : 'gender', 'end' : 'end',
+                     'level' : 'deepest' }
+STORE_MEASURES = { 'games' : 'sum(games)',
+                   'won' : 'sum((end = 1) * games) * 1.0 / sum(games)',
+                   'quit' : 'sum((end = 2) * games) * 1.0 / sum(games)',
+                   'died' : 'sum((end = 3) * games) * 1.0 / sum(games)',
+                   'score' : 'sum(score) * 1.0 / sum(games)',
+                   'tithe' : 'sum(tithe) * 1.0 / sum(games)',
+                   'deepest' : 'sum(deepest * games) * 1.0 / sum(games)',
+                   'turns' : 'sum(turns) * 1.0 / sum(games)' }
+_TOTALS_KEY = ('deity', 'godRole', 'role', 'alignment', 'race', 'gender',
+               'end', 'deepest')
+
+class ResultStore:
+    """Keeps game results in an SQLite database, in write-ahead-log
+    mode, so it can be queried while games are being added."""
+
+    def __init__(self, path):
+        import sqlite3
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS games (
+                id INTEGER PRIMARY KEY, deity TEXT, godRole TEXT, role TEXT,
+                alignment INTEGER, race TEXT, gender TEXT, end INTEGER,
+                score INTEGER, tithe INTEGER, deepest INTEGER,
+                turns INTEGER);
+            CREATE INDEX IF NOT EXISTS gamesByRole ON games (role);
+            CREATE INDEX IF NOT EXISTS gamesByAlignment ON games (alignment);
+            CREATE INDEX IF NOT EXISTS gamesByEnd ON games (end);
+            CREATE TABLE IF NOT EXISTS totals (
+                deity TEXT, godRole TEXT, role TEXT, alignment INTEGER,
+                race TEXT, gender TEXT, end INTEGER, deepest INTEGER,
+                games INTEGER, score INTEGER, tithe INTEGER, turns INTEGER,
+                PRIMARY KEY (deity, godRole, role, alignment, race, gender,
+                             end, deepest));""")
+
+    def add(self, results):
+        "Adds game results (see getSummary) in a single transaction."
+        rows = []
+        totals = {}
+        for result in results:
+            (godRole, role, alignment, race, gender, end, score, deepest,
+             turns) = result
+            tithe = getSummary(result)[7]
+            deity = gods[godRole][alignment]
+            rows.append((deity, godRole, role, alignment, race, gender, end,
+                         score, tithe, deepest, turns))
+            key = (deity, godRole, role, alignment, race, gender, end,
+                   deepest)
+            total = totals.get(key)
+            if total == None:
+                total = totals[key] = [0, 0, 0, 0]
+            total[0] = total[0] + 1
+            total[1] = total[1] + score
+            total[2] = total[2] + tithe
+            total[3] = total[3] + turns
+        where = ' AND '.join(['%s = ?' % name for name in _TOTALS_KEY])
+        db = self.db
+        db.executemany('INSERT INTO games VALUES (NULL, %s)' %
+                       ', '.join(['?'] * 11), rows)
+        db.executemany('INSERT OR IGNORE INTO totals VALUES (%s, 0, 0, 0, 0)' %
+                       ', '.join(['?'] * len(_TOTALS_KEY)),
+                       totals.keys())
+        db.executemany('UPDATE totals SET games = games + ?, '
+                       'score = score + ?, tithe = tithe + ?, '
+                       'turns = turns + ? WHERE ' + where,
+                       [tuple(total) + key
+                        for (key, total) in totals.items()])
+        db.commit()
+
+    def addAll(self, results):
+        "Adds game results STORE_BATCH at a time until they run out."
+        results = iter(results)
+        while 1:
+            batch = list(itertools.islice(results, STORE_BATCH))
+            if not batch:
+                break
+            self.add(batch)
+
+    def keep(self, results):
+        """Generates results, adding them to the store STORE_BATCH at
+        a time as they go by."""
+        batch = []
+        for result in results:
+            batch.append(result)
+            if len(batch) >= STORE_BATCH:
+                self.add(batch)
+                batch = []
+            yield result
+        if batch:
+            self.add(batch)
+
+    def query(self, by, measures):
+        """Returns a row for each value of the dimension by (a key of
+        STORE_DIMENSIONS), with the value and each of the measures (keys
+        of STORE_MEASURES)."""
+        column = STORE_DIMENSIONS[by]
+        return self.db.execute('SELECT %s, %s FROM totals GROUP BY %s '
+                               'ORDER BY %s' % (
+            column, ', '.join([STORE_MEASURES[m] for m in measures]),
+            column, column)).fetchall()
+
+    def close(self):
+        self.db.close()
+
+def printQuery(path, spec):
+    """Prints the answer to a query given as BY:MEASURE[,MEASURE...],
+    such as deity:tithe or level:quit,died."""
+    by, measures = spec.split(':', 1)
+    measures = measures.split(',')
+    if by not in STORE_DIMENSIONS:
+        raise ValueError('can\'t group by "%s"' % by)
+    for measure in measures:
+        if measure not in STORE_MEASURES:
+            raise ValueError('no such measure as "%s"' % measure)
+    store = ResultStore(path)
+    try:
+        sys.stdout.write('\t'.join([by] + measures) + '\n')
+        for row in store.query(by, measures):
+            fields = [str(row[0])]
+            for value in row[1:]:
+                if type(value) == float:
+                    value = '%.4f' % value
+                fields.append(str(value))
+            sys.stdout.write('\t'.join(fields) + '\n')
+    finally:
+        store.close()
+
+### Streaming statistics
+
+class Moments:
+    """Keeps the count, mean and variance of a stream of numbers by
+    Welford's method, in constant memory. Two merge exactly as if one
+    had seen both streams (Chan et al.'s pairwise update)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.squares = 0.0 #Sum of squared differences from the mean
+
+    def add(self, value):
+        self.count = self.count + 1
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self.squares = self.squares + delta * (value - self.mean)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if not count:
+            return
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.squares = (self.squares + other.squares +
+                        delta * delta * self.count * other.count / count)
+        self.count = count
+
+    def getVariance(self):
+        if self.count < 2:
+            return 0.0
+        return self.squares / (self.count - 1)
+
+    def getStdDev(self):
+        return math.sqrt(self.getVariance())
+
+STATISTICS_MEASURES = ('score', 'tithe', 'deepest', 'turns')
+STATISTICS_PERCENTILES = (10, 50, 90, 99)
+
+class Statistics:
+    """Everything worth knowing about a set of game results, in memory
+    that doesn't grow with the number of games: the mean and variance
+    of each of STATISTICS_MEASURES, a Histogram of scores and of turns
+    for their percentiles, and how many games ended each way on each
+    deepest level. Statistics merge, so each worker can keep its own."""
+
+    def __init__(self):
+        self.moments = {}
+        for name in STATISTICS_MEASURES:
+            self.moments[name] = Moments()
+        self.scores = Histogram()
+        self.turns = Histogram()
+        self.ends = {} #(end, deepest level) -> games
+
+    def add(self, result):
+        "Adds a game result (see getSummary)."
+        summary = getSummary(result)
+        score, tithe, deepest, turns = summary[6:10]
+        end = result[5]
+        moments = self.moments
+        moments['score'].add(score)
+        moments['tithe'].add(tithe)
+        moments['deepest'].add(deepest)
+        moments['turns'].add(turns)
+        self.scores.add(score)
+        self.turns.add(turns)
+        self.ends[(end, deepest)] = self.ends.get((end, deepest), 0) + 1
+
+    def merge(self, other):
+        for name in STATISTICS_MEASURES:
+            self.moments[name].merge(other.moments[name])
+        self.scores.merge(other.scores)
+        self.turns.merge(other.turns)
+        for (key, games) in other.ends.items():
+            self.ends[key] = self.ends.get(key, 0) + games
+
+    def getGames(self):
+        return self.moments['score'].count
+
+    def getEnds(self, deepest=None):
+        "Returns games ended each way (indexed like ENDS), on one level or all."
+        ends = [0] * len(ENDS)
+        for ((end, level), games) in self.ends.items():
+            if deepest == None or level == deepest:
+                ends[end] = ends[end] + games
+        return ends
+
+    def report(self, out=None):
+        out = out or sys.stdout
+        games = self.getGames()
+        ends = self.getEnds()
+        out.write('%d games: %s\n' % (games, ', '.join(
+            ['%.4f %s' % (float(ends[i]) / max(1, games), name)
+             for (i, name) in ((1, 'won'), (2, 'quit'), (3, 'died'))])))
+        out.write('\n%-10s %12s %12s' % ('', 'mean', 'std dev'))
+        for percent in STATISTICS_PERCENTILES:
+            out.write(' %8s' % ('%d%%' % percent))
+        out.write(' %8s\n' % 'most')
+        for name in STATISTICS_MEASURES:
+            moments = self.moments[name]
+            out.write('%-10s %12.2f %12.2f' % (name, moments.mean,
+                                               moments.getStdDev()))
+            histogram = {'score' : self.scores, 'turns' : self.turns}.get(name)
+            if histogram:
+                for percent in STATISTICS_PERCENTILES:
+                    out.write(' %8d' % histogram.getPercentile(percent))
+                out.write(' %8d' % histogram.max)
+            out.write('\n')
+        out.write('\n%-10s %8s %8s %8s %8s\n' % ('deepest', 'games', 'won',
+                                                 'quit', 'died'))
+        levels = sorted(dict([(level, 1) for (end, level) in self.ends.keys()]))
+        for level in levels:
+            ends = self.getEnds(level)
+            total = float(sum(ends))
+            out.write('%-10d %8d %8.4f %8.4f %8.4f\n' % (
+                level, total, ends[1] / total, ends[2] / total,
+                ends[3] / total))
+
+def statisticsBlock(args):
+    "Plays a block of batch games and returns their Statistics."
+    statistics = Statistics()
+    for result in playBlock(args)[0]:
+        statistics.add(result)
+    return statistics
+
+### Snapshots
+
+def takeSnapshots(role, alignment, discovery=0, policy=None, seed=None,
+                  fastCombat=0, rng=None):
+    """Plays a game, snapshotting every prayer. Returns the game's
+    result and a (snapshot, prayer type, answer) tuple for each
+    prayer; answer is None if the god had nothing to decide."""
+    game = BatchGame(1, role, alignment, discovery, policy, seed,
+                     fastCombat=fastCombat, rng=rng)
+    game.rng = game.rngClass(game.seed)
+    game.god = God(game, role, alignment, game.policy)
+    game.pc = game.god.getWorshipper()
+    game.pc.snapshotting = 1
+    game.pc.prayerPoints = []
+    return game.getResult(game.simulate()), game.pc.prayerPoints
+
+def playFromSnapshot(snapshot, key, seed=None, fastCombat=0):
+    """Plays a game on from a prayer snapshotted by takeSnapshots, with
+    the god answering key. If seed is given, the random number
+    generator is reseeded with it just after the answer, so the same
+    snapshot can be played out many ways. Returns the game's result.
+
+    Only the prayer's own turn is played again to get back to it, so
+    playing on from late in a game costs only as much as what's left
+    of it."""
+    (roleKey, alignment, policy, state, rngClass, randomState, turn,
+     prayer) = cPickle.loads(snapshot)
+    game = BatchGame(1, roleMap[roleKey], alignment, state['discovery'],
+                     policy, fastCombat=fastCombat)
+    game.rng = rngClass()
+    game.god = God(game, game.role, alignment, game.policy)
+    game.pc = game.god.getWorshipper()
+    game.pc.setState(state)
+    game.rng.setstate(randomState)
+    game.pc.fork = (turn, prayer, key, seed)
+    return game.getResult(game.simulate())
+
+### Game server
+
+#Many people can play at once over telnet, all in one process, on
+#asyncio. Between keys a game is kept as data, not as a thread or a
+#call stack: it plays in stretches of at most SERVER_CHECKPOINT turns,
+#each starting from the champion's state and random state, pickled.
+#When the game wants a key nobody has typed yet, readKey gives up the
+#stretch and the game waits; when the key comes, the stretch is played
+#again from its start with the keys typed during it, and what the game
+#says that it hadn't said before is sent. The god and champion are made
+#again from the saved state too, so a waiting game keeps only that and
+#its keys: a few KB. A key costs at most SERVER_CHECKPOINT turns.
+
+SERVER_BACKLOG = 4096 #Connections waiting to be accepted
+SERVER_CHECKPOINT = 20 #Most turns a served game plays again for a key
+
+TELNET_SETUP = '\xff\xfb\x01\xff\xfb\x03' #IAC WILL ECHO, IAC WILL SGA
+TELNET_GA = '\xff\xf9' #IAC GA, sent whenever the game waits for a key
+TELNET_COMMAND = re.compile('\xff(?:[\xfb-\xfe].|\xfa.*?\xff\xf0|[^\xfa-\xfe])',
+                            re.S)
+#Without asyncio (on Python 2) the server classes still need a base to
+#be defined with; GameServer refuses to start.
+if asyncio:
+    Protocol = asyncio.Protocol
+else:
+    Protocol = object
+
+class WaitingForKey(Exception):
+    "Raised by ServerGame when it wants a key that hasn't been typed yet."
+
+class ServerGame(Game):
+    """A served game, played a stretch at a time. send hands it a key
+    and plays on until it wants another or is over; it returns what
+    the game said meanwhile and whether it's over."""
+
+    def __init__(self, server, seed):
+        self.server = server
+        self.discovery = server.discovery
+        self.rngClass = server.rngClass
+        self.combatTables = server.combatTables
+        self.seed = seed
+        self.keys = '' #Typed during this stretch
+        self.typed = 0 #How many of them this try has read
+        self.said = 0 #How much of what this stretch says has been sent
+        self.outbox = ''
+        self.valid = None #What the game will take next, once it stops
+        self.over = 0
+        self.out = TerminalSink(StringIO())
+        self.waits = self.playStretches()
+
+    def readKey(self, validCharacters=None):
+        if self.typed == len(self.keys):
+            self.valid = validCharacters or ''
+            raise WaitingForKey
+        self.typed = self.typed + 1
+        return self.keys[self.typed - 1]
+
+    def send(self, key=None):
+        "Plays on with key typed, or from the start if it's None."
+        if key != None:
+            self.keys = self.keys + key
+        try:
+            next(self.waits)
+        except (StopIteration, SystemExit):
+            #Over, or the player quit.
+            self.over = 1
+        text, self.outbox = self.outbox, ''
+        return text, self.over
+
+    def playStretches(self):
+        "Plays the whole game, generating whenever it waits for a key."
+        for wait in self.stretch(self.setUp):
+            yield wait
+        while self.pc.alive():
+            for wait in self.stretch(self.playTurns, self.save()):
+                yield wait
+        end = self.finish()
+        for wait in self.stretch(lambda: self.sayEnd(end), self.save()):
+            yield wait
+
+    def stretch(self, play, saved=None):
+        """Calls play, and generates whenever it stops for a key; then
+        it's called again from the state saved with the keys typed so
+        far, until it gets through. While it waits, the game keeps
+        nothing but the saved state and the keys."""
+        self.keys = ''
+        self.said = 0
+        while 1:
+            if saved:
+                self.restore(saved)
+            self.typed = 0
+            self.out.file = StringIO()
+            try:
+                try:
+                    play()
+                    return
+                except WaitingForKey:
+                    pass
+            finally:
+                text = self.out.file.getvalue()
+                self.outbox = self.outbox + text[self.said:]
+                self.said = len(text)
+            self.out.file = StringIO()
+            self.rng = self.god = self.pc = None
+            yield None
+
+    def setUp(self):
+        #pickGod seeds the random number generator, so all this needs
+        #to start again is the deity the server was told to serve.
+        self.role = self.server.role
+        self.alignment = self.server.alignment
+        self.god = self.pickGod()
+        self.startGame()
+
+    def playTurns(self):
+        for i in xrange(SERVER_CHECKPOINT):
+            if not self.pc.alive():
+                return
+            self.pc.turn()
+
+    def save(self):
+        return cPickle.dumps((self.pc.getState(), self.rng.getstate()), 2)
+
+    def restore(self, saved):
+        "Makes the god and the champion again from a saved state."
+        state, randomState = cPickle.loads(saved)
+        self.rng = self.rngClass(self.seed)
+        self.god = God(self, self.role, self.alignment)
+        self.pc = self.god.getWorshipper()
+        self.pc.setState(state)
+        self.rng.setstate(randomState)
+
+class Session(Protocol):
+    """One player's connection to a GameServer. Keys the game isn't
+    waiting for are ignored."""
+
+    def __init__(self, server, seed):
+        self.server = server
+        self.seed = seed
+        self.transport = None
+        self.game = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.write(toBytes(TELNET_SETUP))
+        self.game = ServerGame(self.server, self.seed)
+        self.say(*self.game.send())
+
+    def say(self, text, over):
+        "Sends what the game said, then a prompt or the end of the game."
+        text = text.replace('\n', '\r\n')
+        if not over:
+            text = text + TELNET_GA
+        self.transport.write(toBytes(text))
+        if over:
+            self.transport.close()
+
+    def data_received(self, data):
+        game = self.game
+        for key in TELNET_COMMAND.sub('', toText(data)):
+            if game.over:
+                break
+            #Telnet ends lines with \r\n or \r\0; \r alone is the key.
+            if key not in '\n\0' and (not game.valid or
+                                      game.valid.find(key) != -1):
+                self.say(*game.send(key))
+
+class GameServer:
+    """Serves interactive games over telnet on localhost, every game with
+    its own connection and its own random number generator, seeded from
+    the server's seed and the connection's number."""
+
+    combatTables = None
+
+    def __init__(self, port, role=None, alignment=None, discovery=0,
+                 seed=None, rng=None, fastCombat=0, host='localhost'):
+        if asyncio == None:
+            raise ImportError('serving games needs asyncio (Python 3)')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.socket.listen(SERVER_BACKLOG)
+        self.port = self.socket.getsockname()[1]
+        self.role = role
+        self.alignment = alignment
+        self.discovery = discovery
+        if seed == None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.rngClass = rng or StandardRandom
+        if fastCombat:
+            self.combatTables = getCombatTables()
+        self.sessions = 0
+
+    def connect(self):
+        "Makes the Session for a new connection."
+        session = Session(self, getBlockSeed(self.seed, self.sessions))
+        self.sessions = self.sessions + 1
+        return session
+
+    def serve(self):
+        "Serves games until killed."
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(loop.create_server(
+            self.connect, sock=self.socket, backlog=SERVER_BACKLOG))
+        loop.run_forever()
+
+    def run(self):
+        raiseFileLimit()
+        sys.stdout.write('Serving on localhost:%d\n' % self.port)
+        sys.stdout.flush()
+        self.serve()
+
+def raiseFileLimit():
+    "Allows as many open files (and so connections) as the system will."
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:
+        hard = max(soft, 65536)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+LOAD_TIMEOUT = 600 #Seconds loadTest waits for its games to finish
+LOAD_POLL = .05 #Seconds loadTest runs its event loop between checks
+
+class LoadClient(Protocol):
+    """A simulated player for loadTest. Answers each prompt with one of
+    the keys it offers, picked at random, unless the test is holding
+    answers back."""
+
+    def __init__(self, test, rng):
+        self.test = test
+        self.rng = rng
+        self.transport = None
+        self.heard = ''
+        self.prompted = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.heard = self.heard + toText(data)
+        if self.heard[-2:] == TELNET_GA:
+            if not self.prompted:
+                self.prompted = 1
+                self.test.prompted = self.test.prompted + 1
+            if not self.test.holding:
+                self.answer()
+
+    def answer(self):
+        if self.heard[-2:] != TELNET_GA:
+            return
+        text = TELNET_COMMAND.sub('', self.heard)
+        self.heard = ''
+        if text[-8:] == '--More--':
+            keys = ' '
+        elif text[-7:] == '(end)  ':
+            keys = '*'
+        else:
+            keys = ''.join(re.findall(r'\[([a-z]+)\]', text[-200:]))
+            keys = keys.replace('q', '') or ' '
+        self.transport.write(toBytes(self.rng.choice(keys)))
+        self.test.keys = self.test.keys + 1
+
+    def connection_lost(self, exc):
+        #Finished games end with the last of what the game said, with
+        #no prompt after it.
+        if self.prompted and self.heard and self.heard[-2:] != TELNET_GA:
+            self.test.finished = self.test.finished + 1
+        else:
+            self.test.failed = self.test.failed + 1
+
+def getResidentKB(pid):
+    "Returns a process's resident memory in KB, or None if unknown."
+    try:
+        for line in open('/proc/%d/status' % pid):
+            if line[:6] == 'VmRSS:':
+                return int(line.split()[1])
+    except IOError:
+        return None
+
+def loadTest(clients, role=None, alignment=None, discovery=0, seed=None,
+             rng=None, fastCombat=0, out=None):
+    """Starts a GameServer in another process and plays clients games on
+    it at once. First every client connects and waits at its first
+    prompt, which shows what an idle session costs the server; then
+    they all play their games out. Returns true if every game ended."""
+    out = out or sys.stdout
+    raiseFileLimit()
+    server = GameServer(0, role, alignment, discovery, seed, rng, fastCombat)
+    process = multiprocessing.Process(target=server.serve)
+    process.start()
+    server.socket.close()
+    loop = asyncio.new_event_loop()
+    try:
+        time.sleep(.5)
+        before = getResidentKB(process.pid)
+        test = _LoadTest()
+        clientRNG = StandardRandom(seed)
+        started = time.time()
+        clientList = []
+        for i in xrange(clients):
+            client = LoadClient(test, clientRNG)
+            clientList.append(client)
+            connecting = loop.create_task(loop.create_connection(
+                lambda client=client: client, 'localhost', server.port))
+            connecting.add_done_callback(test.connected)
+        test.runUntil(loop, lambda: test.prompted + test.failed >= clients)
+        connected = time.time() - started
+        idle = getResidentKB(process.pid)
+        out.write('%d of %d clients connected and waiting in %.1f s\n' % (
+            test.prompted, clients, connected))
+        if before and idle:
+            out.write('Server memory: %d KB, then %d KB (%.1f KB per idle session)\n' % (
+                before, idle, float(idle - before) / max(1, test.prompted)))
+        test.holding = 0
+        for client in clientList:
+            if client.transport:
+                client.answer()
+        started = time.time()
+        test.runUntil(loop, lambda: test.finished + test.failed >= clients)
+        elapsed = time.time() - started
+        out.write('%d games finished, %d failed, in %.1f s (%.0f keys/s)\n' % (
+            test.finished, test.failed, elapsed, test.keys / max(elapsed, 1e-9)))
+    finally:
+        process.terminate()
+        process.join()
+        loop.close()
+    return test.finished == clients
+
+class _LoadTest:
+    "Counts for loadTest, shared by its clients."
+
+    def __init__(self):
+        self.holding = 1
+        self.prompted = 0
+        self.finished = 0
+        self.failed = 0
+        self.keys = 0
+
+    def connected(self, connecting):
+        "Counts a client that couldn't connect as failed."
+        if connecting.exception():
+            self.failed = self.failed + 1
+
+    def runUntil(self, loop, done):
+        "Runs loop until done() is true or LOAD_TIMEOUT runs out."
+        started = time.time()
+        while not done() and time.time() - started < LOAD_TIMEOUT:
+            loop.run_until_complete(asyncio.sleep(LOAD_POLL))
+
+### Policy optimizer
+
+OPTIMIZER_CANDIDATES = 24 #Policy tables tried in each generation
+OPTIMIZER_ELITE = 6 #How many of the best ones the next generation follows
+OPTIMIZER_SMOOTHING = .7 #How far it follows them
+
+class Optimizer:
+    """Searches for the TablePolicy with the highest expected tithe by
+    the cross-entropy method. Each cell of the table has a probability
+    for each answer. Every generation draws candidate tables from those
+    probabilities, plays the same games with each, and moves the
+    probabilities toward the answers in the best tables.
+
+    Within a generation every candidate plays with the same seeds
+    (common random numbers), so the games differ only where the
+    candidates' answers do. That makes the comparison between
+    candidates much less noisy than playing independent games."""
+
+    def __init__(self, generations, games, role=None, alignment=None,
+                 discovery=0, seed=None, engine='scalar', workers=1,
+                 rng=None):
+        self.generations = generations
+        self.games = games
+        self.role = role
+        self.alignment = alignment
+        self.discovery = discovery
+        if seed == None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.engine = engine
+        self.workers = workers
+        self.rng = rng
+        cells = len(TABLE_ROWS) * len(LEVEL_BANDS)
+        self.odds = []
+        for cell in range(cells):
+            answers = TablePolicy().getAnswers(cell)
+            self.odds.append([1.0 / len(answers)] * len(answers))
+
+    def run(self, out=None):
+        out = out or sys.stdout
+        self.pool = None
+        if self.workers > 1:
+            self.pool = multiprocessing.Pool(self.workers)
+        try:
+            for generation in range(self.generations):
+                self.step(generation, out)
+            self.report(out)
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+
+    def getBest(self):
+        "Returns the most likely table."
+        code = ''
+        for cell in range(len(self.odds)):
+            odds = self.odds[cell]
+            code = code + TablePolicy().getAnswers(cell)[odds.index(max(odds))]
+        return TablePolicy(code)
+
+    def draw(self, rng):
+        """Returns a table drawn from the current probabilities with the
+        random number generator rng."""
+        code = ''
+        for cell in range(len(self.odds)):
+            pick = rng.random()
+            answers = TablePolicy().getAnswers(cell)
+            for i in range(len(answers)):
+                pick = pick - self.odds[cell][i]
+                if pick < 0:
+                    break
+            code = code + answers[i]
+        return TablePolicy(code)
+
+    def evaluate(self, candidates, seed, games):
+        """Plays games with each candidate, all with the same seeds.
+        Returns a list of each candidate's tithes, game by game."""
+        role = self.role and self.role.key
+        jobs = [(policy, games, role, self.alignment, self.discovery, seed,
+                 self.engine, self.rng) for policy in candidates]
+        if self.pool:
+            return self.pool.map(playPolicy, jobs)
+        return list(map(playPolicy, jobs))
+
+    def step(self, generation, out):
+        rng = StandardRandom(getBlockSeed(self.seed,
+                                          'generation %d' % generation))
+        candidates = [self.getBest()]
+        while len(candidates) < OPTIMIZER_CANDIDATES:
+            candidates.append(self.draw(rng))
+        tithes = self.evaluate(candidates, rng.getrandbits(32), self.games)
+        ranked = [(_mean(tithes[i]), i) for i in range(len(candidates))]
+        ranked.sort()
+        ranked.reverse()
+        elite = [candidates[i].code for (mean, i) in ranked[:OPTIMIZER_ELITE]]
+        for cell in range(len(self.odds)):
+            answers = TablePolicy().getAnswers(cell)
+            for i in range(len(answers)):
+                share = float(len([x for x in elite if x[cell] == answers[i]]))
+                self.odds[cell][i] = (
+                    (1 - OPTIMIZER_SMOOTHING) * self.odds[cell][i] +
+                    OPTIMIZER_SMOOTHING * share / len(elite))
+        out.write('Generation %d: best tithe %.1f (%s), median %.1f\n' % (
+            generation + 1, ranked[0][0], candidates[ranked[0][1]].code,
+            ranked[len(ranked) // 2][0]))
+        out.flush()
+
+    def report(self, out):
+        """Plays fresh games with the best table and with MoodPolicy's,
+        and prints the table and its expected tithe."""
+        best = self.getBest()
+        games = self.games * 4
+        seed = getBlockSeed(self.seed, 'report')
+        tithes, moodTithes = self.evaluate([best, TablePolicy()], seed, games)
+        differences = [tithes[i] - moodTithes[i] for i in range(games)]
+        out.write('\nBest policy (--table=%s):\n\n' % best.code)
+        for line in best.getTable():
+            out.write('  %s\n' % line)
+        out.write('\nExpected tithe: %.1f +/- %.1f\n' % (
+            _mean(tithes), 1.96 * _stdErr(tithes)))
+        out.write('Against the mood policy: %+.1f +/- %.1f on the same games'
+                  ' (+/- %.1f on different ones)\n' % (
+            _mean(differences), 1.96 * _stdErr(differences),
+            1.96 * math.sqrt(_stdErr(tithes) ** 2 + _stdErr(moodTithes) ** 2)))
+
+def _mean(values):
+    return float(sum(values)) / len(values)
+
+def _stdErr(values):
+    "Returns the standard error of the mean of values."
+    mean = _mean(values)
+    variance = sum([(x - mean) ** 2 for x in values]) / (len(values) - 1.0)
+    return math.sqrt(variance / len(values))
+
+def playPolicy(args):
+    """Plays games for the Optimizer with one policy; returns each
+    game's tithe. Each scalar game gets its own seed, so other policies
+    given the same arguments meet the same dungeon for as long as
+    their answers agree. The vector engine's games share a random
+    number stream, which keeps them in step less closely."""
+    (policy, games, roleKey, alignment, discovery, seed, engine, rng) = args
+    role = roleKey and roleMap[roleKey]
+    batch = BatchGame(games, role, alignment, discovery, policy, seed, engine,
+                      rng=rng)
+    if engine == 'vector':
+        return [getSummary(result)[7] for result in batch.playAll()]
+    tithes = []
+    for i in xrange(games):
+        batch.rng = batch.rngClass(getBlockSeed(seed, i))
+        batch.playOne()
+        tithes.append(batch.getTithe())
+    return tithes
+
+### Balance sweeps
+
+SWEEP_CACHE = os.path.join(os.path.expanduser('~'), '.wftm-sweep')
+ENGINE_VERSION = 1 #Bump when a change to the game changes what a seed plays
+SWEEP_POINTS = { 'grid' : 3, 'lhs' : 10 } #Default --points for each design
+
+class Sweep:
+    """Plays a batch of games at each of many settings of the balance
+    constants, and totals them. The settings come from ranges, a list
+    of (name, low, high), in one of two designs: 'grid' takes points
+    evenly spaced values of each constant and plays every combination;
+    'lhs' takes points settings in a Latin hypercube, cutting each
+    constant's range into points equal parts and using each part
+    exactly once, paired up at random. Constants whose defaults are
+    whole numbers stay whole.
+
+    Games are played in the same seeded blocks as batch games, and the
+    tally of each block is cached in a file named for a hash of all
+    that decides it: the constants, the block's seed and size, the
+    deity, policy, engine and ENGINE_VERSION. Running a sweep again
+    with more points or more games only plays what's new."""
+
+    def __init__(self, ranges, points=None, design='grid', games=200,
+                 role=None, alignment=None, discovery=0, policy=None,
+                 seed=None, engine='scalar', workers=1, rng=None,
+                 fastCombat=0, cache=SWEEP_CACHE):
+        self.ranges = ranges
+        self.design = design
+        self.points = points or SWEEP_POINTS[design]
+        self.games = games
+        self.role = role
+        self.alignment = alignment
+        self.discovery = discovery
+        if not isinstance(policy, Policy):
+            policy = (policy or MoodPolicy)()
+        self.policy = policy
+        if seed == None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.engine = engine
+        self.workers = workers
+        self.rngClass = rng or StandardRandom
+        self.fastCombat = fastCombat
+        self.cache = cache
+
+    def getSettings(self):
+        "Returns the Balance for each point of the sweep."
+        defaults = dict(BALANCE_DEFAULTS)
+        columns = []
+        if self.design == 'grid':
+            for (name, low, high) in self.ranges:
+                steps = max(1, self.points - 1)
+                columns.append([low + (high - low) * i / float(steps)
+                                for i in range(min(self.points, steps + 1))])
+            settings = list(itertools.product(*columns))
+        else:
+            rng = StandardRandom(getBlockSeed(self.seed, 'design'))
+            for (name, low, high) in self.ranges:
+                parts = list(range(self.points))
+                rng.shuffle(parts)
+                columns.append([low + (high - low) * (part + rng.random()) /
+                                self.points for part in parts])
+            settings = list(zip(*columns))
+        balances = []
+        for values in settings:
+            constants = {}
+            for ((name, low, high), value) in zip(self.ranges, values):
+                if type(defaults[name]) == int:
+                    value = int(round(value))
+                constants[name] = value
+            balances.append(Balance(**constants))
+        return balances
+
+    def getBlocks(self, balance):
+        "Returns playBlock's arguments for each block of a point's games."
+        size = BLOCK_GAMES[self.engine]
+        return [(min(size, self.games - start), self.role and self.role.key,
+                 self.alignment, self.discovery, self.policy,
+                 getBlockSeed(self.seed, start // size), self.engine,
+                 self.fastCombat, None, self.rngClass, balance)
+                for start in xrange(0, self.games, size)]
+
+    def getCachePath(self, block):
+        key = cPickle.dumps((ENGINE_VERSION, VERSION, block[:-1],
+                             block[-1].getValues()), 2)
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.cache, digest[:2], digest)
+
+    def run(self, out=None):
+        "Prints the constants and totals for each point."
+        out = out or sys.stdout
+        balances = self.getSettings()
+        tallies = {}
+        missing = []
+        for balance in balances:
+            for block in self.getBlocks(balance):
+                path = self.getCachePath(block)
+                try:
+                    f = open(path, 'rb')
+                    try:
+                        tallies[path] = cPickle.load(f)
+                    finally:
+                        f.close()
+                except (IOError, EOFError, cPickle.UnpicklingError):
+                    missing.append((path, block))
+        out.write('%d points, %d of %d blocks cached\n' % (
+            len(balances), len(tallies), len(tallies) + len(missing)))
+        pool = None
+        if self.workers > 1 and len(missing) > 1:
+            pool = multiprocessing.Pool(self.workers)
+            blockTallies = pool.imap(tallyBlock, [x[1] for x in missing])
+        else:
+            blockTallies = imap(tallyBlock, [x[1] for x in missing])
+        try:
+            for ((path, block), tally) in izip(missing,
+                                                         blockTallies):
+                self.keep(path, tally)
+                tallies[path] = tally
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        names = [name for (name, low, high) in self.ranges]
+        out.write('\t'.join(names + list(TALLY_FIELDS[1:])) + '\n')
+        for balance in balances:
+            total = Tally()
+            for block in self.getBlocks(balance):
+                total.merge(tallies[self.getCachePath(block)])
+            values = ['%g' % getattr(balance, name) for name in names]
+            out.write('\t'.join(values + list(map(str, total.getFields()))) +
+                      '\n')
+
+    def keep(self, path, tally):
+        "Caches a block's tally; the rename keeps readers from half a file."
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        f = open(path + '.new', 'wb')
+        try:
+            cPickle.dump(tally, f, 2)
+        finally:
+            f.close()
+        os.rename(path + '.new', path)
+
+def tallyBlock(args):
+    "Plays a block of games for a Sweep and returns their Tally."
+    tally = Tally()
+    for result in playBlock(args)[0]:
+        tally.add(result)
+    return tally
+
+def parseRanges(spec):
+    """Turns NAME=LOW:HIGH[,NAME=LOW:HIGH...] into a list of (name, low,
+    high) for Sweep, checking the names against BALANCE_DEFAULTS."""
+    defaults = dict(BALANCE_DEFAULTS)
+    ranges = []
+    for part in spec.split(','):
+        try:
+            name, bounds = part.split('=')
+            low, high = map(float, bounds.split(':'))
+        except ValueError:
+            raise ValueError('bad range "%s"; ranges look like NAME=LOW:HIGH' % part)
+        if name not in defaults:
+            names = sorted(defaults)
+            raise ValueError('no such constant as "%s"; constants are: %s' % (
+                name, ', '.join(names)))
+        ranges.append((name, low, high))
+    return ranges
+
+def parseBalance(spec):
+    """Turns NAME=VALUE[,NAME=VALUE...] into a Balance, checking the
+    names against BALANCE_DEFAULTS."""
+    defaults = dict(BALANCE_DEFAULTS)
+    values = {}
+    for part in spec.split(','):
+        try:
+            name, value = part.split('=')
+            value = float(value)
+        except ValueError:
+            raise ValueError('bad setting "%s"; settings look like NAME=VALUE' % part)
+        if name not in defaults:
+            names = sorted(defaults)
+            raise ValueError('no such constant as "%s"; constants are: %s' % (
+                name, ', '.join(names)))
+        if type(defaults[name]) == int:
+            value = int(round(value))
+        values[name] = value
+    return Balance(**values)
+
+### Sequential experiments
+
+#An experiment plays games until it knows one measure well enough:
+#until the confidence interval of the measure is narrower than asked
+#for, or, comparing two settings of the balance constants, until the
+#difference between them is significant. Rates are 0 or 1 a game;
+#the rest are the getSummary fields of the same name.
+EXPERIMENT_RATES = ('won', 'quit', 'died')
+EXPERIMENT_MEASURES = EXPERIMENT_RATES + STATISTICS_MEASURES
+EXPERIMENT_Z = 1.96 #Normal quantile for 95% confidence intervals
+EXPERIMENT_ALPHA = 0.05 #Chance of finding a difference that isn't there
+EXPERIMENT_BUDGET = 3600.0 #Seconds an experiment plays for if not told
+
+def playAhead(function, getArgs, workers=1):
+    """Generates function(getArgs(0)), function(getArgs(1)) and so on
+    without end. With more than one worker, that many calls are always
+    being made ahead in worker processes, but the results still come
+    in order. Close the generator when done with it."""
+    numbers = itertools.count()
+    if workers < 2:
+        for number in numbers:
+            yield function(getArgs(number))
+    pool = multiprocessing.Pool(workers)
+    pending = []
+    try:
+        while 1:
+            while len(pending) < workers:
+                pending.append(pool.apply_async(
+                    function, (getArgs(next(numbers)),)))
+            yield pending.pop(0).get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def getMeasure(result, name):
+    "Returns one of EXPERIMENT_MEASURES for a game result."
+    if name in EXPERIMENT_RATES:
+        return int(result[5] == EXPERIMENT_RATES.index(name) + 1)
+    return getSummary(result)[6 + list(STATISTICS_MEASURES).index(name)]
+
+class Experiment:
+    """Plays blocks of batch games until the 95% confidence interval
+    of a measure is at most width wide, or budget seconds have gone
+    by. Rates get Wilson intervals, which stay honest when nothing (or
+    everything) has happened yet; means get normal ones.
+
+    Given another Balance to compare, both settings play the same
+    seeds, and the measure is compared game by game. The difference
+    is tested after every block with a mixture sequential probability
+    ratio test (Johari, Pekelis and Walsh's mSPRT, with a normal
+    mixture whose spread is width), which may be stopped whenever it
+    likes without finding differences that aren't there more than
+    EXPERIMENT_ALPHA of the time. The experiment stops as soon as the
+    difference is significant, or its interval is narrower than width.
+
+    Blocks are handed out to workers ahead of time, but are taken in
+    order, so a seed gives the same answer however many workers play."""
+
+    def __init__(self, measure, width, against=None,
+                 budget=EXPERIMENT_BUDGET, role=None, alignment=None,
+                 discovery=0, policy=None, seed=None, engine='scalar',
+                 workers=1, rng=None, fastCombat=0):
+        self.measure = measure
+        self.width = width
+        self.balances = [Game.balance]
+        if against:
+            self.balances.append(against)
+        self.budget = budget
+        self.role = role
+        self.alignment = alignment
+        self.discovery = discovery
+        if not isinstance(policy, Policy):
+            policy = (policy or MoodPolicy)()
+        self.policy = policy
+        if seed == None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.engine = engine
+        self.workers = workers
+        self.rngClass = rng or StandardRandom
+        self.fastCombat = fastCombat
+
+    def getBlock(self, number):
+        "Returns experimentBlock's arguments for a block."
+        return (self.measure,
+                [(BLOCK_GAMES[self.engine], self.role and self.role.key,
+                  self.alignment, self.discovery, self.policy,
+                  getBlockSeed(self.seed, number), self.engine,
+                  self.fastCombat, None, self.rngClass, balance)
+                 for balance in self.balances])
+
+    def getInterval(self, moments, rate=0):
+        "Returns the 95% confidence interval of a mean, as (low, high)."
+        n = float(max(1, moments.count))
+        z = EXPERIMENT_Z
+        if rate:
+            p = moments.mean
+            centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+            spread = (z / (1 + z * z / n) *
+                      math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)))
+        else:
+            centre = moments.mean
+            spread = z * moments.getStdDev() / math.sqrt(n)
+        return (centre - spread, centre + spread)
+
+    def getEvidence(self, moments):
+        """Returns the log of the mSPRT's likelihood ratio that the
+        differences in moments don't have a mean of zero."""
+        n = moments.count
+        variance = moments.getVariance()
+        if not variance:
+            if moments.mean:
+                return float('inf')
+            return 0.0
+        spread = float(self.width) ** 2
+        return (0.5 * math.log(variance / (variance + n * spread)) +
+                n * n * spread * moments.mean ** 2 /
+                (2 * variance * (variance + n * spread)))
+
+    def run(self, out=None):
+        "Plays until the experiment is done, and prints what it found."
+        out = out or sys.stdout
+        start = time.time()
+        totals = [Moments() for i in range(len(self.balances) * 2 - 1)]
+        rate = self.measure in EXPERIMENT_RATES
+        reason = None
+        blocks = playAhead(experimentBlock, self.getBlock, self.workers)
+        try:
+            while not reason:
+                block = next(blocks)
+                for (total, moments) in zip(totals, block):
+                    total.merge(moments)
+                low, high = self.getInterval(totals[-1], rate and
+                                             len(totals) == 1)
+                if (len(totals) > 1 and
+                    self.getEvidence(totals[-1]) >= -math.log(EXPERIMENT_ALPHA)):
+                    reason = 'the difference is significant'
+                elif high - low <= self.width:
+                    reason = 'the interval is narrower than %g' % self.width
+                elif time.time() - start >= self.budget:
+                    reason = 'time ran out'
+        finally:
+            blocks.close()
+        out.write('%s: %d games in %d seconds; stopped because %s\n' % (
+            self.measure, totals[0].count, time.time() - start, reason))
+        out.write('%-30s %12s %12s %12s\n' % ('', 'estimate', '95% low',
+                                              'high'))
+        labels = [self.getLabel(balance) for balance in self.balances]
+        for (label, moments) in zip(labels, totals):
+            out.write('%-30s %12.4f %12.4f %12.4f\n' % (
+                (label, moments.mean) + self.getInterval(moments, rate)))
+        if len(totals) > 1:
+            moments = totals[-1]
+            out.write('%-30s %12.4f %12.4f %12.4f\n' % (
+                ('difference', moments.mean) + self.getInterval(moments)))
+            out.write('log likelihood ratio %.2f (%.2f needed)\n' % (
+                self.getEvidence(moments), -math.log(EXPERIMENT_ALPHA)))
+
+    def getLabel(self, balance):
+        "Names a Balance by the constants it changes."
+        changes = ['%s=%g' % (name, value) for (name, value)
+                   in balance.getValues() if value != dict(BALANCE_DEFAULTS)[name]]
+        return ','.join(changes) or 'defaults'
+
+def experimentBlock(args):
+    """Plays a block of games at each of an Experiment's settings and
+    returns the Moments of its measure at each, and if there are two,
+    of the difference between them game by game."""
+    measure, blocks = args
+    columns = [[getMeasure(result, measure) for result in playBlock(block)[0]]
+               for block in blocks]
+    if len(columns) == 2:
+        columns.append([a - b for (a, b) in zip(*columns)])
+    moments = []
+    for column in columns:
+        total = Moments()
+        for value in column:
+            total.add(value)
+        moments.append(total)
+    return moments
+
+### Rare events
+
+#Winning is far too rare to count by playing games: most champions
+#never see level 50. Splitting counts it in stages instead. Champions
+#are played until they reach the first milestone (a deepest dungeon
+#level) or their games end; as many champions as started are then
+#cloned from those that made it, picked at random, and each clone is
+#played on with random numbers of its own to the next milestone, and
+#so on until the game is won. The chance of winning is the product
+#of the fractions that made it at every stage, which is an unbiased
+#estimate however the stages are placed; each champion in a stage
+#stands for that product so far, divided by how many there are.
+SPLIT_STEP = 5 #Dungeon levels between milestones
+SPLIT_CHAMPIONS = 1000 #Champions played at each stage if not told
+SPLIT_RUNS = 10 #Fewest splitting runs to judge the error by
+
+class Splitter:
+    """Estimates the chance of reaching each milestone, and of winning,
+    by splitting. Independent splitting runs of champions champions a
+    stage are played until the relative standard error of the chance
+    of winning is at most error, or budget seconds have gone by.
+
+    Milestones are every SPLIT_STEP levels, the Amulet's level and the
+    Astral Plane's. A champion's clones share everything about it
+    (getState), even when its next event comes, which is all right,
+    since that was drawn from the right odds and is part of where the
+    game stands; they differ from then on."""
+
+    def __init__(self, error, champions=SPLIT_CHAMPIONS,
+                 budget=EXPERIMENT_BUDGET, role=None, alignment=None,
+                 discovery=0, policy=None, seed=None, workers=1, rng=None,
+                 fastCombat=0, balance=None):
+        self.error = error
+        self.champions = champions
+        self.budget = budget
+        self.role = role
+        self.alignment = alignment
+        self.discovery = discovery
+        if not isinstance(policy, Policy):
+            policy = (policy or MoodPolicy)()
+        self.policy = policy
+        if seed == None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.workers = workers
+        self.rngClass = rng or StandardRandom
+        self.fastCombat = fastCombat
+        self.balance = balance or Game.balance
+        top = self.balance.maxDungeonLevel
+        levels = list(range(SPLIT_STEP, top - 1, SPLIT_STEP)) + [top - 1]
+        if 50 < top:
+            levels.append(50)
+        levels = sorted(dict([(level, 1) for level in levels]))
+        self.levels = levels
+
+    def getRun(self, number):
+        "Returns splitRun's arguments for a run."
+        return (self.champions, self.levels, self.role and self.role.key,
+                self.alignment, self.discovery, self.policy,
+                getBlockSeed(self.seed, number), self.rngClass,
+                self.fastCombat, self.balance)
+
+    def run(self, out=None):
+        "Splits until the error is small enough, and prints the chances."
+        out = out or sys.stdout
+        start = time.time()
+        chances = [Moments() for level in self.levels + [None]]
+        segments = 0
+        reason = None
+        runs = playAhead(splitRun, self.getRun, self.workers)
+        try:
+            while not reason:
+                fractions, played = next(runs)
+                segments = segments + played
+                chance = 1.0
+                for (moments, fraction) in zip(chances, fractions):
+                    chance = chance * fraction
+                    moments.add(chance)
+                won = chances[-1]
+                if (won.count >= SPLIT_RUNS and won.mean and
+                    self.getError(won) <= self.error):
+                    reason = 'the error is small enough'
+                elif time.time() - start >= self.budget:
+                    reason = 'time ran out'
+        finally:
+            runs.close()
+        out.write('%d splitting runs of %d champions in %d seconds; '
+                  'stopped because %s\n' % (chances[-1].count, self.champions,
+                                            time.time() - start, reason))
+        out.write('%-24s %12s %12s\n' % ('reached', 'chance', 'rel. error'))
+        names = { 50 : ' (Amulet)',
+                  self.balance.maxDungeonLevel - 1 : ' (Astral Plane)' }
+        for (level, moments) in zip(self.levels + [None], chances):
+            if level == None:
+                label = 'won'
+            else:
+                label = 'level %d%s' % (level, names.get(level, ''))
+            out.write('%-24s %12.4g %12.4f\n' % (label, moments.mean,
+                                                 self.getError(moments)))
+        won = chances[-1]
+        if won.mean:
+            #A plain estimate needs (1 - p) / (p * error^2) games.
+            games = ((1 - won.mean) /
+                     (won.mean * max(self.getError(won), 1e-9) ** 2))
+            out.write('%d champions played; plain sampling would need '
+                      'about %.3g games for the same error\n' % (segments,
+                                                                 games))
+
+    def getError(self, moments):
+        "Returns the relative standard error of a mean over runs."
+        if not moments.mean or moments.count < 2:
+            return float('inf')
+        return moments.getStdDev() / math.sqrt(moments.count) / moments.mean
+
+def splitRun(args):
+    """Plays one splitting run for a Splitter, returning the fraction
+    of champions that made it through each stage and how many
+    champions (each at most a game long) were played."""
+    (champions, levels, roleKey, alignment, discovery, policy, seed, rng,
+     fastCombat, balance) = args
+    role = roleKey and roleMap[roleKey]
+    game = BatchGame(1, role, alignment, discovery, policy, seed,
+                     fastCombat=fastCombat, rng=rng, balance=balance)
+    picker = StandardRandom(seed) #Picks clones and their seeds
+    entrants = None
+    fractions = []
+    played = 0
+    for level in levels + [None]:
+        reached = []
+        for i in xrange(champions):
+            game.rng = game.rngClass(picker.getrandbits(32))
+            if entrants == None:
+                godRole, alignment = game.pickDeity()
+            else:
+                godRole, alignment, state = picker.choice(entrants)
+            game.god = God(game, godRole, alignment, game.policy)
+            pc = game.pc = game.god.getWorshipper()
+            if entrants != None:
+                pc.setState(state)
+            while pc.alive() and (level == None or pc.deepestLevel < level):
+                pc.turn()
+            if level == None:
+                if pc.won:
+                    reached.append(None)
+            elif pc.deepestLevel >= level:
+                reached.append((godRole, alignment, pc.getState()))
+        played = played + champions
+        fractions.append(len(reached) / float(champions))
+        if not reached:
+            break
+        entrants = reached
+    return fractions + [0.0] * (len(levels) + 1 - len(fractions)), played
+
+### Progression model
+
+#Where a champion goes in the dungeon depends on nothing but its
+#dungeon level, whether it has an altar near and the turn: the event
+#chances read turnsOnLevel, which setLevel hands on from level to level
+#rather than starting again, so it counts turns since the game began.
+#That makes where a champion who keeps going will be, turn by turn,
+#and what goodies it will find, something to work out exactly rather
+#than sample. Fights are taken to be won at no cost: one comes on
+#every turn without an event and leaves the champion where it was, and
+#one in five ends in a goodie, which the model counts. Dying, quitting,
+#the score for monsters and punishments (which hold events off) are
+#left out.
+#
+#The model also keeps the deepest level reached, which only ever goes
+#up, so the first turn on each level is a first passage through the
+#chain and its whole distribution comes out of the same pass.
+MODEL_TURNS = 300 #Turns the model looks ahead if not told
+MODEL_SHARES = (.1, .5, .9) #Shares of champions reported reaching a level
+
+class ProgressionModel:
+    """The exact chance of a champion being on each dungeon level, with
+    or without an altar near, on each of its first turns turns, worked
+    out from Player's own event chances. From that come the expected
+    turns spent on each level (levelTurns), the chance of being on each
+    level after the last turn (levelEnds), the chance of first reaching
+    each level on each turn (arrivals), the chance of having won by
+    then (won) and the expected gold score, item points and goodies
+    found (gold, items and goodies, fightGoodies of them after fights).
+
+    The time spent on a level is only an expectation: its distribution
+    would need a count of turns on that level in every state, for every
+    level, where the first turn on each level needs only the deepest
+    level reached."""
+
+    def __init__(self, turns=MODEL_TURNS, balance=None):
+        self.turns = turns
+        self.balance = balance or Game.balance
+        if self.balance.maxDungeonLevel < 50:
+            raise ValueError('the model needs the Amulet above the Astral Plane')
+        self.solve()
+
+    def solve(self):
+        top = self.balance.maxDungeonLevel
+        game = BatchGame(1, balance=self.balance)
+        game.rng = StandardRandom(0)
+        probe = God(game, roleMap['v'], LAWFUL, Policy()).getWorshipper()
+        self.itemValues = {} #Most goodie values -> expected item points
+        self.levelTurns = [0.0] * (top + 1)
+        self.arrivals = [[0.0] * (self.turns + 1) for level in range(top + 1)]
+        self.arrivals[1][0] = 1.0
+        self.won = self.gold = self.items = self.goodies = 0.0
+        self.fightGoodies = 0.0
+        #(level, altar) -> {deepest level : chance}, this turn
+        chances = {(1, 0) : {1 : 1.0}}
+        for turn in xrange(1, self.turns + 1):
+            probe.turnsOnLevel = turn
+            next = {}
+            for ((level, altar), deepests) in chances.items():
+                chance = sum(deepests.values())
+                self.levelTurns[level] = self.levelTurns[level] + chance
+                probe.dungeonLevel = level
+                probe.nearAltar = altar
+                moves = {} #(level, altar) -> share of the chance going there
+                share = 1.0 #Share with no event yet
+                #See pickEvent: each event's chance of coming up first.
+                for (eventChance, event) in Player.eventTable:
+                    odds = eventChance(probe)
+                    if odds <= 0:
+                        continue
+                    happens = share / (odds + 1)
+                    share = share * odds / (odds + 1)
+                    name = event.__name__
+                    if name == 'getGoodie':
+                        self.addGoodies(level, turn, chance * happens)
+                        targets = (((level, altar), happens),)
+                    elif name == 'descendLevel':
+                        if level + 1 == top:
+                            self.won = self.won + chance * happens
+                            continue
+                        targets = (((level + 1, altar), happens * .75),
+                                   ((level + 1, 0), happens * .25))
+                    elif name == 'findAltar':
+                        targets = (((level, 1), happens),)
+                    elif name == 'ascendLevel':
+                        targets = (((level - 1, altar), happens),)
+                    elif name == 'loseAltar':
+                        targets = (((level, 0), happens),)
+                    else:
+                        raise ValueError('the model has no moves for %s' % name)
+                    for (state, happens) in targets:
+                        moves[state] = moves.get(state, 0.0) + happens
+                #No event; a fight, and maybe a goodie after it
+                self.addGoodies(level, turn, chance * share * .2)
+                self.fightGoodies = self.fightGoodies + chance * share * .2
+                moves[(level, altar)] = moves.get((level, altar), 0.0) + share
+                for (state, share) in moves.items():
+                    going = next.setdefault(state, {})
+                    for (deepest, happens) in deepests.items():
+                        happens = happens * share
+                        if state[0] > deepest:
+                            deepest = state[0]
+                            self.arrivals[deepest][turn] += happens
+                        going[deepest] = going.get(deepest, 0.0) + happens
+            chances = next
+        self.levelEnds = [0.0] * (top + 1)
+        for ((level, altar), deepests) in chances.items():
+            self.levelEnds[level] = self.levelEnds[level] + sum(deepests.values())
+
+    def addGoodies(self, level, turn, chance):
+        "Counts what a goodie found with chance on level on turn is worth."
+        most = max(level, int(1.5 * level) - turn)
+        if most not in self.itemValues:
+            itemConstant = self.balance.itemConstant
+            self.itemValues[most] = sum(
+                [int(value * itemConstant)
+                 for value in range(most + 1)]) / (most + 1.0)
+        self.goodies = self.goodies + chance
+        self.gold = self.gold + chance * .25 * self.balance.goldConstant * most / 2.0
+        self.items = self.items + chance * .625 * self.itemValues[most]
+
+    def getReached(self, level, turn=None):
+        "The chance of having reached level by turn (or the last turn)."
+        if turn == None:
+            turn = self.turns
+        return sum(self.arrivals[level][:turn + 1])
+
+    def getArrivalTurn(self, level, share):
+        """The turn by which share of all champions have reached level,
+        or None if fewer have by the last turn."""
+        reached = 0.0
+        for turn in xrange(self.turns + 1):
+            reached = reached + self.arrivals[level][turn]
+            if reached >= share:
+                return turn
+
+    def report(self, out=None):
+        out = out or sys.stdout
+        out.write('Over %d turns, winning every fight: %.6f won, %.2f gold '
+                  'score, %.2f item points from %.2f goodies (%.2f after '
+                  'fights)\n' % (self.turns, self.won, self.gold, self.items,
+                                 self.goodies, self.fightGoodies))
+        out.write('%-8s %10s %10s %10s   first reached by turn, for\n' % (
+            'level', 'turns', 'at end', 'reached'))
+        out.write('%-41s%s\n' % ('', ' '.join(['%5d%%' % (share * 100)
+                                              for share in MODEL_SHARES])))
+        for level in range(1, len(self.levelTurns)):
+            reached = self.getReached(level)
+            if self.levelTurns[level] or self.levelEnds[level] or reached:
+                arrivals = []
+                for share in MODEL_SHARES:
+                    turn = self.getArrivalTurn(level, share)
+                    if turn == None:
+                        arrivals.append('%6s' % '-')
+                    else:
+                        arrivals.append('%6d' % turn)
+                out.write('%-8d %10.4f %10.6f %10.6f   %s\n' % (
+                    level, self.levelTurns[level], self.levelEnds[level],
+                    reached, ' '.join(arrivals)))
+
+def parseModel(spec):
+    """Turns TURNS[,NAME=VALUE...] into the turns and Balance for a
+    ProgressionModel."""
+    parts = spec.split(',', 1)
+    balance = None
+    if len(parts) > 1:
+        balance = parseBalance(parts[1])
+    return int(parts[0]), balance
+
+### Congregations
+
+#A god can have many champions at once. Every tick, each champion that
+#isn't waiting on a prayer plays a turn; a prayer that needs the god to
+#decide something goes into a queue instead of being answered there and
+#then, and the champion stops to wait. After the tick the god answers
+#the most urgent prayers in the queue, as many as it has time for. An
+#answered champion goes back to where it last saved its state and plays
+#on from there: it has a random number generator of its own, so it
+#plays just as it did up to the prayer, where the answer is waiting. So
+#waiting changes when a game ends but never how, and a congregation
+#plays the same games as --batch does with the same deity and seed.
+#Saving the state every turn would cost more than the few turns played
+#again, hence CONGREGATION_CHECKPOINT; it's kept pickled, which takes a
+#random number generator's state from some 20 KB to 3.
+CONGREGATION_CHECKPOINT = 20 #Turns between a champion's saved states
+
+#A prayer for help comes before any other, and the worse the trouble
+#(1 is major trouble; see God.getMood) the sooner. Then come
+#sacrifices and then blessings. Among prayers as urgent, the one with
+#the lowest prayer timeout is answered first, and then the oldest.
+PRAYER_URGENCY = { INTERCESSORY_PRAYER : 0, SACRIFICIAL_PRAYER : 1,
+                   BLESSING_PRAYER : 2 }
+
+class WaitingForAnswer(Exception):
+    "Raised by PrayerQueue when it has queued a champion's prayer."
+
+class Congregant(object):
+    "A champion in a Congregation, and where it can play again from."
+
+    __slots__ = ('pc', 'saved', 'answers', 'waiting', 'stopped')
+
+    def __init__(self, pc):
+        self.pc = pc
+        self.saved = None #(turns, pickled state and random state)
+        self.answers = None #The god's answers since; see PrayerQueue
+        self.waiting = 0 #Set while its prayer is in the queue
+        self.stopped = None #The turn it stopped on to pray
+
+class PrayerQueue(Policy):
+    """Stands in for a Congregation's policy: queues the prayers of the
+    current champion for the real policy to answer later, and gives
+    back the answer when the champion plays its turn again."""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.heap = []
+        self.current = None #The Congregant playing a turn
+        self.tick = 0
+        self.queued = 0
+        self.most = 0 #Most prayers waiting at once
+        self.waits = Moments() #Ticks each answered prayer waited
+        self.longest = 0
+
+    def ask(self, method, urgency, worshipper, args):
+        congregant = self.current
+        prayer = (worshipper.turns, worshipper.turnPrayers)
+        if congregant.answers and prayer in congregant.answers:
+            key, randomState = congregant.answers[prayer]
+            worshipper.rng.setstate(randomState)
+            return key
+        heapq.heappush(self.heap, (urgency, worshipper.prayerTimeout,
+                                   self.queued, self.tick, congregant,
+                                   method, args))
+        self.queued = self.queued + 1
+        self.most = max(self.most, len(self.heap))
+        congregant.waiting = 1
+        raise WaitingForAnswer
+
+    def handlePrayerHelp(self, god, worshipper, troubleLevel, mood):
+        return self.ask('handlePrayerHelp',
+                        (PRAYER_URGENCY[INTERCESSORY_PRAYER], troubleLevel),
+                        worshipper, (troubleLevel, mood))
+
+    def handlePrayerBlessing(self, god, worshipper, mood):
+        return self.ask('handlePrayerBlessing',
+                        (PRAYER_URGENCY[BLESSING_PRAYER], 0), worshipper,
+                        (mood,))
+
+    def handlePrayerSacrifice(self, god, worshipper, value):
+        return self.ask('handlePrayerSacrifice',
+                        (PRAYER_URGENCY[SACRIFICIAL_PRAYER], 0), worshipper,
+                        (value,))
 
-   After the Creation, the cruel god Moloch rebelled against the
-   authority of Marduk the Creator.  Moloch stole from Marduk the most
-   powerful of all the artifacts of the gods, the Amulet of Yendor,
-   and he hid it in the dark cavities of Gehennom, the Under World,
-   where he now lurks, and bides his time."""
+    def answer(self, god, most=None):
+        """Has the real policy answer the most urgent prayers, up to
+        most of them (all of them if most is None). The champions are
+        still where they stopped to pray, random numbers and all, so
+        the policy sees just what it would have then. Returns how many
+        prayers were answered."""
+        answered = 0
+        while self.heap and (most == None or answered < most):
+            (urgency, prayerTimeout, number, tick, congregant, method,
+             args) = heapq.heappop(self.heap)
+            pc = congregant.pc
+            god.rng = pc.rng
+            key = getattr(self.policy, method)(god, pc, *args)
+            if congregant.answers == None:
+                congregant.answers = {}
+            congregant.answers[(pc.turns, pc.turnPrayers)] = (
+                key, pc.rng.getstate())
+            congregant.waiting = 0
+            self.waits.add(self.tick - tick)
+            self.longest = max(self.longest, self.tick - tick)
+            answered = answered + 1
+        return answered
 
-        print
-        print self.wrap("You seek to possess the Amulet, and with it to gain deserved ascendance over the other gods.")
-        print
+class Congregation(BatchGame):
+    """Plays games for one god with champions champions at a time,
+    starting a new game whenever one ends until games games have been
+    played, and answers at most answers prayers a tick (all of them if
+    answers is None). Without a role and alignment, the god is picked
+    once from the seed."""
 
-        print self.wrap("One young %s, now a newly trained %s, has been heralded from birth as your instrument.  %s is destined to recover the Amulet for you, or die in the attempt.  %s hour of destiny has come.  May %s go bravely with you!" % (self.pc.race, self.pc.title, self.pc.He, self.pc.His, self.pc.he))
-        print
-        self.more()
+    def __init__(self, champions, games=None, answers=None, role=None,
+                 alignment=None, discovery=0, policy=None, seed=None,
+                 rng=None, fastCombat=0, balance=None):
+        BatchGame.__init__(self, games or champions, role, alignment,
+                           discovery, policy, seed, fastCombat=fastCombat,
+                           rng=rng, balance=balance)
+        self.champions = champions
+        self.answers = answers
+        self.queue = PrayerQueue(self.policy)
+        self.rng = self.rngClass(self.seed)
+        role, alignment = self.pickDeity()
+        self.god = God(self, role, alignment, self.queue)
+        self.ticks = 0
+        self.tickSeconds = 0.0
+        self.seatTicks = 0 #Champions summed over ticks
+        self.replays = 0 #Turns played again after a prayer was answered
+        self.memory = None #Resident KB per champion, if known
 
-    def play(self):
-        sys.stdout.write("%s, %s, %s protector of %s.\n" % (self.god.role.greeting, self.god.name, self.god.alignmentName, self.god.role.pluralName))
-        print "Your chosen one has just entered the dungeon.\n...\n"
-        while self.pc.alive():
-            self.pc.turn()
-        if self.pc.won:
-            end = "sacrificing the Amulet"
-        elif self.pc.quit:
-            print "What the?!? Your chosen one just quit %s quest!" % self.pc.his
-            print "All the other gods laugh at you."
-            end = "quitting"
-        else:
-            end = "dying"
-            self.pc.score = int(self.pc.score * .9)
-            print "Argh! Your chosen one just died!"
-            print "All the other gods laugh at you."
-        print
-        self.more()
-        print
-        print
-        pluralScore = 's'
-        if self.pc.score == 1:
-            pluralScore = ''
-        print "Your chosen one scored %s point%s before %s." % (self.pc.score, pluralScore, end)
-        if (self.pc.quit):
-            print 'Because %s quit, you get none of that.' % self.pc.he
-        else:
-            print "Your tithe of that is %s points." % int(self.pc.score * .1)
+    def getGameRandom(self, number):
+        """Returns the random number generator for a game, seeded the
+        way BatchGame seeds the game with that number."""
+        size = BLOCK_GAMES['scalar']
+        return self.rngClass(getBlockSeed(getBlockSeed(self.seed,
+                                                       number // size),
+                                          number % size))
+
+    def admit(self, number):
+        rng = self.getGameRandom(number)
+        return Congregant(Player(self, self.god.role, self.god.alignment,
+                                 self.god, self.discovery, rng))
+
+    def playTurn(self, congregant):
+        """Plays a champion's next turn or, if it stopped to pray, plays
+        again from its saved state through the turn it stopped on."""
+        pc = congregant.pc
+        self.god.rng = pc.rng
+        self.queue.current = congregant
+        try:
+            if congregant.stopped != None:
+                stopped = congregant.stopped
+                congregant.stopped = None
+                state, randomState = cPickle.loads(congregant.saved[1])
+                pc.setState(state)
+                pc.rng.setstate(randomState)
+                while pc.turns < stopped:
+                    pc.turn()
+                    self.replays = self.replays + 1
+                return
+            if (congregant.saved == None or
+                pc.turns - congregant.saved[0] >= CONGREGATION_CHECKPOINT):
+                congregant.saved = (pc.turns, cPickle.dumps(
+                    (pc.getState(), pc.rng.getstate()), 2))
+                congregant.answers = None
+            pc.turn()
+        except WaitingForAnswer:
+            congregant.stopped = pc.turns
+
+    def playAll(self):
+        "Generates the result of every game, in the order they end."
+        before = getResidentKB(os.getpid())
+        seats = [self.admit(i) for i in xrange(min(self.champions,
+                                                   self.games))]
+        admitted = len(seats)
+        while seats:
+            started = time.time()
+            self.queue.tick = self.ticks
+            results = []
+            for i in xrange(len(seats)):
+                congregant = seats[i]
+                if not congregant.waiting:
+                    self.playTurn(congregant)
+                if not congregant.pc.alive():
+                    self.pc = congregant.pc
+                    results.append(self.getResult(self.finish()))
+                    seats[i] = None
+                    if admitted < self.games:
+                        seats[i] = self.admit(admitted)
+                        admitted = admitted + 1
+            self.seatTicks = self.seatTicks + len(seats)
+            seats = [x for x in seats if x]
+            self.queue.answer(self.god, self.answers)
+            self.tickSeconds = self.tickSeconds + time.time() - started
+            self.ticks = self.ticks + 1
+            if self.ticks == 1 and before:
+                #By now every champion has saved its state.
+                after = getResidentKB(os.getpid())
+                self.memory = float(after - before) / self.champions
+            for result in results:
+                yield result
+
+    def run(self, out=None):
+        "Prints the totals for the god's games and what they cost."
+        out = out or sys.stdout
+        tally = Tally()
+        for result in self.playAll():
+            tally.add(result)
+        out.write('\t'.join(TALLY_FIELDS) + '\n')
+        out.write('\t'.join(map(str, (self.god.name,) + tally.getFields()))
+                  + '\n')
+        self.report(out)
+
+    def report(self, out):
+        queue = self.queue
+        out.write('%d champions at once played %d games in %d ticks (%.1fs)\n'
+                  % (self.champions, self.games, self.ticks,
+                     self.tickSeconds))
+        out.write('%.2f ms a tick, %.1f us a champion a tick; '
+                  '%d turns played again\n' % (
+                      self.tickSeconds / max(1, self.ticks) * 1e3,
+                      self.tickSeconds / max(1, self.seatTicks) * 1e6,
+                      self.replays))
+        out.write('%d prayers, at most %d waiting, answered after %.2f '
+                  'ticks on average (at most %d)\n' % (
+                      queue.queued, queue.most, queue.waits.mean,
+                      queue.longest))
+        if self.memory != None:
+            out.write('%.1f KB a champion\n' % self.memory)
 
 class God:
 
@@ -399,26 +3418,34 @@ class God:
               (Heuristic 3.2)
     """
 
-    def __init__(self, game, role, alignment):
-        print role, alignment
+    def __init__(self, game, role, alignment, policy=None, rng=None):
         self.game = game
+        self.rng = rng or game.rng
+        if not policy:
+            policy = InteractivePolicy(game)
+        self.policy = policy
         self.role = role
         self.alignment = alignment
         self.alignmentName = alignmentMap[alignment]
         self.name = gods[role.key][alignment]
+        self.prayers = {} #See getPrayers
+        self.questions = {} #See getQuestion
 
     def getWorshipper(self):
         return Player(self.game, self.role, self.alignment, self,
-                      self.game.discovery)
+                      self.game.discovery, self.rng)
 
     def handlePrayer(self, worshipper, type, arg=None):
+        """Answers a prayer. Returns the key for what the god decided,
+        or None if there was nothing to decide."""
         if type == INTERCESSORY_PRAYER:
-            self.handlePrayerHelp(worshipper, arg)
+            key = self.handlePrayerHelp(worshipper, arg)
         elif type == SACRIFICIAL_PRAYER:
-            self.handlePrayerSacrifice(worshipper, arg)
+            key = self.handlePrayerSacrifice(worshipper, arg)
         elif type == BLESSING_PRAYER:
-            self.handlePrayerBlessing(worshipper)
-        print
+            key = self.handlePrayerBlessing(worshipper)
+        self.game.out.say()
+        return key
 
     def getMood(self, worshipper, troubleLevel):
         """Translates the prayer timout into 1 for pleased, 0 for indifferent,
@@ -436,18 +3463,69 @@ class God:
         return mood
 
     def handlePrayerHelp(self, worshipper, troubleLevel):
-        options = ['[h]elp', '[i]gnore', '[s]mite']
+        out = self.game.out
         order = (0,1,2)
         mood = self.getMood(worshipper, troubleLevel)
         if mood > 0:
-            print 'Oh no! Your chosen one is praying for help!'
+            out.say('Oh no! Your chosen one is praying for help!')
         elif mood == 0:
-            print 'Sounds like %s needs some help.' % worshipper.he
+            out.say('Sounds like %s needs some help.', worshipper.he)
             order = (1,0,2)
         else:
-            print 'That %s is praying for help!' % worshipper.getEpithet()
+            out.say('That %s is praying for help!', worshipper.getEpithet())
             order = (2,1,0)
-        what = 'Do you want to '
+        out.say(self.getQuestion(worshipper, INTERCESSORY_PRAYER, order))
+        key = self.policy.handlePrayerHelp(self, worshipper, troubleLevel, mood)
+        if key == 'h':
+            out.say('Okay, you send a generic healing blessing %s way.', worshipper.his)
+            worshipper.hp = worshipper.maxHP
+            worshipper.resetPrayerTimeout()
+            if not self.rng.randint(0,30):
+                out.say("Hm, %s died anyway; I guess the healing wasn't what %s needed.", worshipper.he, worshipper.he)
+                worshipper.hp = 0
+        elif key == 'i':
+            out.say("Yeah, let 'em deal with it.")
+            worshipper.hp = classicDivide(worshipper.maxHP, 2)
+        elif key == 's':
+            self.punish(worshipper)
+        return key
+
+    def getPrayers(self, type):
+        """Returns the prayers a worshipper might offer of the given
+        type, addressed to this god and wrapped ready to print."""
+        prayers = self.prayers.get(type)
+        if prayers == None:
+            prayers = []
+            for prayer in GENERIC_PRAYERS[type]:
+                if prayer.find('%s') != -1:
+                    prayer = prayer % self.name
+                prayers.append(wrap(prayer))
+            self.prayers[type] = prayers
+        return prayers
+
+    def getQuestion(self, worshipper, type, order):
+        """Returns the wrapped question asking what to do about a
+        prayer, with its options in the given order. Each is worked out
+        once per gender."""
+        key = (type, worshipper.gender, order)
+        question = self.questions.get(key)
+        if question == None:
+            if type == INTERCESSORY_PRAYER:
+                options = ['[h]elp', '[i]gnore', '[s]mite']
+                question = 'Do you want to %s %s?' % (
+                    self.getMenu(options, order), worshipper.him)
+            else:
+                options = ['[g]rant %s a boon' % worshipper.him,
+                           '[i]gnore %s' % worshipper.him,
+                           '[s]mite %s for %s impudence' % (worshipper.him,
+                                                            worshipper.his)]
+                question = 'Do you want to %s?' % self.getMenu(options, order)
+            question = self.questions[key] = wrap(question)
+        return question
+
+    def getMenu(self, options, order):
+        "Lists options in the given order, as in 'a, b, or c'."
+        what = ''
         a = 0
         for i in order:
             what = what + options[i]
@@ -456,116 +3534,97 @@ class God:
                 what = what + ', or '
             elif a < len(options):
                 what = what + ', '
-        what = what + ' ' + worshipper.him + '?'
-        print self.game.wrap(what)
-        key = self.game.getCharacter('his', allowQuit=1)
-        if key == 'h':
-            print 'Okay, you send a generic healing blessing %s way.' % worshipper.his
-            worshipper.hp = worshipper.maxHP
-            worshipper.resetPrayerTimeout()
-            if not random.randint(0,30):
-                print "Hm, %s died anyway; I guess the healing wasn't what %s needed." % (worshipper.he, worshipper.he)
-                worshipper.hp = 0
-        elif key == 'i':
-            print "Yeah, let 'em deal with it."
-            worshipper.hp = worshipper.maxHP / 2
-        elif key == 's':
-            self.punish(worshipper)
+        return what
 
     def handlePrayerSacrifice(self, player, sacValue):
+        out = self.game.out
         value = -1
         if sacValue >= player.maxHP * .40:
             value = 1
-            print " (Wow, what a great sacrifice! The other gods will be jealous!)"
+            out.say(" (Wow, what a great sacrifice! The other gods will be jealous!)")
         elif sacValue >= player.maxHP * .20:
             value = 0
-            print " (A pretty decent sacrifice.)"
+            out.say(" (A pretty decent sacrifice.)")
         else:
-            print " (Not that great a sacrifice.)"
+            out.say(" (Not that great a sacrifice.)")
         if player.alignment == CHAOTIC:
             multiplier = 500
         else:
             multiplier = 300
         multuplier = float(multiplier)/24
         player.prayerTimeout = max(0, player.prayerTimeout - (sacValue * multiplier))
-        if player.prayerTimeout == 0 and (value == 1 or (value == 0 and not random.randint(0, 10))):
-            val = self.game.getYesNo('Show some sign of favor?')
-            print
+        if player.prayerTimeout == 0 and (value == 1 or (value == 0 and not self.rng.randint(0, 10))):
+            val = self.policy.handlePrayerSacrifice(self, player, value)
+            out.say()
             if val:
                 self.grantBoon(player)
+                return 'y'
+            return 'n'
 
     def handlePrayerBlessing(self, worshipper):
-        options = ['[g]rant %s a boon' % worshipper.him,
-                   '[i]gnore %s' % worshipper.him,
-                   '[s]mite %s for %s impudence' % (worshipper.him,
-                                                    worshipper.his)]
+        out = self.game.out
         order = (0,1,2)
         mood = self.getMood(worshipper, 0)
         if mood == 0:
-            print 'Hm, pretty presumptuous of %s to ask for help.' % worshipper.him
+            out.say('Hm, pretty presumptuous of %s to ask for help.', worshipper.him)
             order = (1,0,2)
         elif mood < 0:
-            print 'That %s has the audacity to ask for your help?' % worshipper.getEpithet()
+            out.say('That %s has the audacity to ask for your help?', worshipper.getEpithet())
             order = (2,1,0)
-        what = 'Do you want to '
-        a = 0
-        for i in order:
-            what = what + options[i]
-            a = a + 1
-            if a == len(options)-1:
-                what = what + ', or '
-            elif a < len(options):
-                what = what + ', '
-        what = what + '?'
-        print self.game.wrap(what)
-        key = self.game.getCharacter('gis', allowQuit=1)
+        out.say(self.getQuestion(worshipper, BLESSING_PRAYER, order))
+        key = self.policy.handlePrayerBlessing(self, worshipper, mood)
         if key == 'g':
             self.grantBoon(worshipper)
             worshipper.resetPrayerTimeout()
         elif key == 'i':
-            print "Makes sense; %s should have to do better!" % worshipper.he
+            out.say("Makes sense; %s should have to do better!", worshipper.he)
         elif key == 's':
             self.punish(worshipper)
+        return key
 
     def grantBoon(self, worshipper):
-        if worshipper.prayerTimeout < 50 and not random.randint(0, 3):
-            print 'Okay, you send some magical junk %s way.' % worshipper.his
-            points = random.randint(100, 500)
+        if worshipper.prayerTimeout < 50 and not self.rng.randint(0, 3):
+            self.game.out.say('Okay, you send some magical junk %s way.', worshipper.his)
+            points = self.rng.randint(100, 500)
         else:
-            print 'Okay, you bless some of %s junk.' % worshipper.his
-            points = random.randint(10, 100)
+            self.game.out.say('Okay, you bless some of %s junk.', worshipper.his)
+            points = self.rng.randint(10, 100)
         worshipper.itemPoints = worshipper.itemPoints + points
 
     def punish(self, worshipper):
-        punishment = random.choice(['zap', 'drain', 'ball', 'curse', 'minion'])
+        self.inflict(worshipper,
+                     self.rng.choice(['zap', 'drain', 'ball', 'curse', 'minion']))
+
+    def inflict(self, worshipper, punishment):
+        out = self.game.out
         if punishment == 'zap':
-            print 'Hells yeah! Make with the lightning!'
-            print '*CRAK*'
-            worshipper.costItemPoints(random.expovariate(50))
-            worshipper.costHitPoints(random.expovariate(100))
+            out.say('Hells yeah! Make with the lightning!')
+            out.say('*CRAK*')
+            worshipper.costItemPoints(self.rng.expovariate(50))
+            worshipper.costHitPoints(self.rng.expovariate(100))
             if worshipper.itemPoints > 0 and worshipper.alive():
-                print "Damn! %s didn't even feel it!" % worshipper.He
-                print 'Musta had one of those godproof silver dragon scale mails!'
-                print 'Perhaps summoning some minions will do the trick...'
-                print '*SHAZAM*'
+                out.say("Damn! %s didn't even feel it!", worshipper.He)
+                out.say('Musta had one of those godproof silver dragon scale mails!')
+                out.say('Perhaps summoning some minions will do the trick...')
+                out.say('*SHAZAM*')
                 worshipper.stackedMonsters = 5
         elif punishment == 'drain':
-            print 'All right! Time for some level drain action!'
-            print '*WOMP*'
+            out.say('All right! Time for some level drain action!')
+            out.say('*WOMP*')
             worshipper.maxHP = worshipper.maxHP * .9
             if worshipper.hp > worshipper.maxHP:
                 worshipper.hp = worshipper.maxHP
         elif punishment == 'ball':
-            print 'This iron ball and chain should teach %s a lesson!' % worshipper.him
-            print '*THRUD*'
-            worshipper.costItemPoints(random.randint(10,15))
+            out.say('This iron ball and chain should teach %s a lesson!', worshipper.him)
+            out.say('*THRUD*')
+            worshipper.costItemPoints(self.rng.randint(10,15))
         elif punishment == 'curse':
-            print 'Let %s equipment be blackened with a foul curse!' % worshipper.his
-            print '*SHUM*'
-            worshipper.costItemPoints(random.randint(20, 50))
+            out.say('Let %s equipment be blackened with a foul curse!', worshipper.his)
+            out.say('*SHUM*')
+            worshipper.costItemPoints(self.rng.randint(20, 50))
         elif punishment == 'minion':
-            print 'Your minions will make short work of %s!' % worshipper.him
-            print '*SHAZAM*'
+            out.say('Your minions will make short work of %s!', worshipper.him)
+            out.say('*SHAZAM*')
             worshipper.stackedMonsters = 5
 
     def endgame(self, whoGotAmulet=None):
@@ -581,41 +3640,63 @@ class God:
                        'Monsters are less likely to be generated asleep.',
                        '...']
         if whoGotAmulet == self:
-            sys.stdout.write(self.game.wrap("You feel a rush of power as your chosen one places the Amulet of Yendor on your altar. At last, the Amulet is yours!\n\n"))
+            out = self.game.out
+            out.sayWrapped("You feel a rush of power as your chosen one places the Amulet of Yendor on your altar. At last, the Amulet is yours!\n")
             otherGods = list(gods[self.role.key])
             otherGods.remove(self.name)
-            print self.game.wrap("You rush to the Hall of Spoilers to review the Amulet's capabilities, already dreaming of primacy over %s and %s." % tuple(otherGods))
-            print
-            print '| Amulet of Yendor'
-            print '|'
-            print '| When carried, you get all of the following (mostly bad):'
+            out.sayWrapped("You rush to the Hall of Spoilers to review the Amulet's capabilities, already dreaming of primacy over %s and %s.", *otherGods)
+            out.say()
+            out.say('| Amulet of Yendor')
+            out.say('|')
+            out.say('| When carried, you get all of the following (mostly bad):')
             for prop in amuletProps:
-                print '|  *', prop
-            print
-            print 'Hmm...'
-            print
-            print self.game.wrap('Perhaps Moloch would be amenable to taking the Amulet back. You begin casting about for another chosen one to carry out this important task...')
+                out.say('|  * %s', prop)
+            out.say()
+            out.say('Hmm...')
+            out.say()
+            out.sayWrapped('Perhaps Moloch would be amenable to taking the Amulet back. You begin casting about for another chosen one to carry out this important task...')
+
+class Player(object):
 
-class Player:
+    __slots__ = ('game', 'balance', 'discovery', 'rng', 'amulet', 'won',
+                 'quit', 'stackedMonsters', 'nextEvent', 'nextEventKey',
+                 'prayerTurn', 'turnPrayers', 'hp', 'maxHP', 'itemPoints',
+                 'hitPoints', 'score', 'turns', 'turnsOnLevels',
+                 'turnsOnLevel', 'deepestLevel', 'dungeonLevel',
+                 'experienceLevel', 'nearAltar', 'prayerTimeout', 'role',
+                 'alignment', 'god', 'gender', 'he', 'him', 'his', 'He', 'Him',
+                 'His', 'race', 'title', 'snapshotting', 'fork', 'turnStart',
+                 'prayerPoints')
 
-    def __init__(self, game, role, alignment, god, discovery=0):
+    def __init__(self, game, role, alignment, god, discovery=0, rng=None):
         self.game = game
+        self.balance = (game or Game).balance
         self.discovery = discovery
+        self.rng = rng or god.rng #Every random number comes from here
 
         self.amulet = 0
         self.won = 0
         self.quit = 0
 
+        self.snapshotting = 0 #Set to keep a snapshot of every prayer in prayerPoints
+        self.fork = None #(turn, prayer, key, seed) to force an answer; see ForcedPolicy
+
         self.stackedMonsters = 0 #Monsters sent as part of a punishment.
+        self.nextEvent = None #Turn of the next event; see scheduleEvent.
+        self.nextEventKey = None
+        self.prayerTurn = 0 #Turn of the last prayer...
+        self.turnPrayers = 0 #...and how many prayers there were on it.
 
         self.hp = 15
         self.maxHP = 15
         self.itemPoints = 50
 
         self.score = 0
+        self.turns = 0
 
-        self.turnsOnLevels = {}
+        self.turnsOnLevels = array.array('i', [0]) * (self.balance.maxDungeonLevel + 1)
         self.turnsOnLevel = 0
+        self.deepestLevel = 1
         self.setLevel(1)
 
         self.experienceLevel = 1
@@ -630,37 +3711,19 @@ class Player:
         if self.role.key == 'v':
             self.gender = 'female'
         else:
-            self.gender = random.choice(('male', 'female'))
-        (self.he, self.him, self.his) = genderData[self.gender]
-        self.He = string.capitalize(self.he)
-        self.Him = string.capitalize(self.him)
-        self.His = string.capitalize(self.his)
-
-        possibleRacesModuloClass = raceData.keys()
-        possibleRaces = raceData.keys()
-        aRestrict = role.alignmentRestrictions
-        rRestrict = role.raceRestrictions
-
-        for race in copy.copy(possibleRaces):
-            try:
-                classOkay = 0
-                raceData[race].index(self.alignment)
-                classOkay = 1
-                if aRestrict:
-                    aRestrict.index(self.alignment)
-                if rRestrict:
-                    rRestrict.index(race)
-            except Exception, val:
-                possibleRaces.remove(race)
-                if not classOkay:
-                    possibleRacesModuloClass.remove(race)
+            self.gender = self.rng.choice(('male', 'female'))
+        (self.he, self.him, self.his,
+         self.He, self.Him, self.His) = pronouns[self.gender]
+
+        (possibleRaces,
+         possibleRacesModuloClass) = raceOptions[(role.key, self.alignment)]
         #If there's only one possible alignment and the player isn't
         #of this alignment, they've got to be a priest.
-        if possibleRaces and random.choice(roleMap.keys()) != 'p':
-            self.race = random.choice(possibleRaces)
+        if possibleRaces and self.rng.choice(ROLE_KEYS) != 'p':
+            self.race = self.rng.choice(possibleRaces)
         else:
             self.role = roleMap['p']
-            self.race = random.choice(possibleRacesModuloClass)
+            self.race = self.rng.choice(possibleRacesModuloClass)
 
         if self.gender == 'male':
             self.title = self.role.titles[0]
@@ -668,68 +3731,165 @@ class Player:
             self.title = self.role.titles[1]
 
     def turn(self):
+        if self.snapshotting:
+            self.turnStart = (self.getState(), self.rng.getstate())
+        self.passTurn()
+        self.handleEvent()
+
+    def passTurn(self):
+        self.turns = self.turns + 1
         self.turnsOnLevel = self.turnsOnLevel + 1
         if self.prayerTimeout > 0:
             self.prayerTimeout = max(0, self.prayerTimeout - 1)
-        self.hp = self.hp + int(HEALING_PER_TURN)
+        self.hp = self.hp + int(self.balance.healingPerTurn)
         if self.hp > self.maxHP:
             self.hp = self.maxHP
-        self.handleEvent()
+
+    def playUntilEvent(self):
+        """Plays the next turn, then every turn before the next
+        scheduled event, which can only be a fight. Those go straight
+        to fightMonster, without turn and handleEvent working out each
+        time that nothing else happens. Anything that would change the
+        schedule (a new level or altar, stacked monsters) ends the run,
+        as does the champion's end."""
+        self.turn()
+        if not self.fightRuns or self.snapshotting or not self.scheduleEvents:
+            return
+        while (self.nextEvent != None and self.turnsOnLevel + 1 < self.nextEvent
+               and not self.stackedMonsters and self.alive()
+               and self.nextEventKey == (self.dungeonLevel, self.nearAltar)):
+            self.passTurn()
+            self.fightMonster()
 
     def getEpithet(self):
         choices = ['so-and-so', 'pathetic mortal', 'weakling']
         if self.gender == 'male':
             choices.append('S.O.B')
-        return random.choice(choices)
+        return self.rng.choice(choices)
 
     def getPrayerDescription(self, type):
-        if type == INTERCESSORY_PRAYER:
-            a = random.choice(GENERIC_HELP_PRAYERS)
-        elif type == SACRIFICIAL_PRAYER:
-            a = random.choice(GENERIC_SACRIFICE_PRAYERS)
-        elif type == BLESSING_PRAYER:
-            a = random.choice(GENERIC_BLESSING_PRAYERS)
-        if string.find(a, '%s') != -1:
-            a = a % self.god.name
-        return a
+        "Returns a prayer of the given type, wrapped."
+        return self.rng.choice(self.god.getPrayers(type))
 
     def resetPrayerTimeout(self):
         reset = 350
         #TODO: crowning
         if self.amulet:
             reset = reset + 100
-        self.prayerTimeout = random.expovariate(reset)
+        self.prayerTimeout = self.rng.expovariate(reset)
 
     def setLevel(self, level):
+        if level >= len(self.turnsOnLevels):
+            #Only with no amulet to end the game at maxDungeonLevel.
+            self.turnsOnLevels.extend([0] * (level + 1 - len(self.turnsOnLevels)))
         self.turnsOnLevels[level] = self.turnsOnLevel
         self.dungeonLevel = level
-        self.turnsOnLevel = self.turnsOnLevels.get(level, 0)
+        self.turnsOnLevel = self.turnsOnLevels[level]
+        if level > self.deepestLevel:
+            self.deepestLevel = level
 
     def alive(self):
         return self.hp > 0 and not self.quit and not self.won
 
     def handleEvent(self):
-        happened = 0
         if self.stackedMonsters:
+            #No events this turn, which the schedule didn't allow for.
             self.stackedMonsters = self.stackedMonsters - 1
+            self.nextEvent = None
+        elif not self.scheduleEvents:
+            for (chance, event) in self.eventTable:
+                chance = chance(self)
+                if chance > 0 and not self.rng.randint(0, chance):
+                    if not event(self):
+                        if self.game.trace:
+                            self.game.trace.record(self, event.__name__)
+                        return
         else:
-            for event in self.EVENTS:
-                chance = self.__class__.__dict__[event+'Chance'](self)
-                if chance > 0 and not random.randint(0, chance):
-                    happened = not self.__class__.__dict__[event](self)
-                    if happened:
-                        break
-        if not happened:
-            self.fightMonster()
+            if (self.nextEvent == None or self.nextEvent < self.turnsOnLevel
+                or self.nextEventKey != (self.dungeonLevel, self.nearAltar)):
+                self.scheduleEvent()
+            if self.nextEvent == self.turnsOnLevel:
+                self.nextEvent = None
+                event = self.pickEvent()
+                event(self)
+                if self.game.trace:
+                    self.game.trace.record(self, event.__name__)
+                return
+        self.fightMonster()
 
+    #Event chances are one in chance+1 each turn, tried in this order
+    #until one happens; a chance of 0 means the event can't happen. The
+    #chances may depend only on dungeonLevel, nearAltar and
+    #turnsOnLevel, which is what lets scheduleEvent work out in advance
+    #when the next event will come.
     EVENTS = [ 'getGoodie', 'descendLevel', 'findAltar', 'ascendLevel',
                'loseAltar' ]
 
+    scheduleEvents = 1 #Zero rolls for every event every turn instead
+    fightRuns = 1 #Zero makes playUntilEvent play a single turn
+
+    eventSurvival = {} #(class, maxDungeonLevel, level, nearAltar) -> list; see scheduleEvent
+
+    def scheduleEvent(self):
+        """Picks the turn of the next event all at once, instead of
+        rolling for every event every turn.
+
+        For the current level and altar, the list in eventSurvival holds
+        the sum, for each turnsOnLevel up to that index, of minus the log
+        of the chance of no event on that turn. A turn's events are
+        independent of every other turn's, so the next event comes on
+        the first turn whose sum from now exceeds minus the log of a
+        uniform number. Anything that changes the chances (a new level,
+        an altar, monsters with no events) means a new schedule."""
+        key = (self.__class__, self.balance.maxDungeonLevel, self.dungeonLevel,
+               self.nearAltar)
+        survival = self.eventSurvival.get(key)
+        if survival == None:
+            survival = self.eventSurvival[key] = [0.0]
+        while len(survival) <= self.turnsOnLevel:
+            self.extendSurvival(survival)
+        target = survival[self.turnsOnLevel] - math.log(1 - self.rng.random())
+        while survival[-1] <= target:
+            self.extendSurvival(survival)
+        self.nextEvent = bisect.bisect_right(survival, target) - 1
+        self.nextEventKey = (self.dungeonLevel, self.nearAltar)
+
+    def extendSurvival(self, survival):
+        "Doubles the number of turns in an eventSurvival list."
+        probe = copy.copy(self)
+        for turn in xrange(len(survival) - 1, 2 * len(survival)):
+            probe.turnsOnLevel = turn
+            hazard = 0
+            for (chance, event) in self.eventTable:
+                chance = chance(probe)
+                if chance > 0:
+                    hazard = hazard + math.log((chance + 1.0) / chance)
+            survival.append(survival[-1] + hazard)
+
+    def pickEvent(self):
+        """Picks which event happens on a turn known to have one, in
+        proportion to the chance that it's the first to come up."""
+        odds = []
+        none = 1.0
+        for (chance, event) in self.eventTable:
+            chance = chance(self)
+            if chance > 0:
+                odds.append((none / (chance + 1), event))
+                none = none * chance / (chance + 1)
+        pick = self.rng.random() * (1 - none)
+        for (odds, event) in odds:
+            if pick < odds:
+                break
+            pick = pick - odds
+        return event
+
     def ascendLevelChance(self):
+        if self.dungeonLevel == 1 or self.dungeonLevel >= self.balance.maxDungeonLevel - 1:
+            return 0
         return 100
 
     def ascendLevel(self):
-        if self.dungeonLevel == 1 or self.dungeonLevel >= MAX_DUNGEON_LEVEL - 1:
+        if self.dungeonLevel == 1 or self.dungeonLevel >= self.balance.maxDungeonLevel - 1:
             return 1
         self.setLevel(self.dungeonLevel-1)
 
@@ -738,14 +3898,14 @@ class Player:
 
     def descendLevel(self):
         self.setLevel(self.dungeonLevel+1)
-        if random.randint(1,4) == 1:
+        if self.rng.randint(1,4) == 1:
             self.nearAltar = 0
         if self.dungeonLevel == 50:
             self.getAmulet()
-        if self.dungeonLevel == MAX_DUNGEON_LEVEL - 1:
-            print "You sense your chosen one's presence on the Astral Plane..."
-            print
-        if self.dungeonLevel == MAX_DUNGEON_LEVEL and self.amulet:
+        if self.dungeonLevel == self.balance.maxDungeonLevel - 1:
+            self.game.out.say("You sense your chosen one's presence on the Astral Plane...")
+            self.game.out.say()
+        if self.dungeonLevel == self.balance.maxDungeonLevel and self.amulet:
             self.endgame()
 
     def findAltarChance(self):
@@ -753,10 +3913,12 @@ class Player:
 
     def findAltar(self):
         self.nearAltar = 1
-        if not random.randint(0, 3):
+        if not self.rng.randint(0, 3):
             self.pray(BLESSING_PRAYER)
 
     def loseAltarChance(self):
+        if not self.nearAltar:
+            return 0
         return 100
 
     def loseAltar(self):
@@ -766,98 +3928,110 @@ class Player:
         return 1
 
     def getGoodieChance(self):
-        return 20 + (self.turnsOnLevel/5)
+        return 20 + (self.turnsOnLevel//5)
 
     def getAmulet(self):
         if not self.amulet:
             self.amulet = 1
-            print '%s got the Amulet! Awesome!\n' % self.He
+            self.game.out.say('%s got the Amulet! Awesome!\n', self.He)
 
     def endgame(self):
         self.won = 1
-        print self.game.wrap('"Oh %s, your humble servant offers to your glory the object of this sacred quest..."' % self.god.name)
+        self.game.out.sayWrapped('"Oh %s, your humble servant offers to your glory the object of this sacred quest..."', self.god.name)
         self.god.endgame()
 
     def getGoodie(self):
-        value = random.randint(0, max(self.dungeonLevel, int(1.5*self.dungeonLevel)-self.turnsOnLevel))
-        if not random.randint(0, 3):
+        value = self.rng.randint(0, max(self.dungeonLevel, int(1.5*self.dungeonLevel)-self.turnsOnLevel))
+        if not self.rng.randint(0, 3):
             #Gold; includes amortized value of gold from items sold at shops
-            self.score = self.score + value * GOLD_CONSTANT
-        elif random.randint(0, 5): #Something useful
-            self.itemPoints = self.itemPoints + int(value * ITEM_CONSTANT)
-            if self.nearAltar and not random.randint(0, 20):
+            self.score = self.score + value * self.balance.goldConstant
+        elif self.rng.randint(0, 5): #Something useful
+            self.itemPoints = self.itemPoints + int(value * self.balance.itemConstant)
+            if self.nearAltar and not self.rng.randint(0, 20):
                 self.pray(BLESSING_PRAYER)
 
         #Otherwise, it's useless junk
 
     def fightMonster(self):
-        toughness = (random.randint(0,6)-3) + self.dungeonLevel/2
+        toughness = (self.rng.randint(0,6)-3) + self.dungeonLevel//2
         if toughness < 0:
             toughness = 1
-        monsterHP = random.randint(toughness,
-                                   toughness*MONSTER_TOUGHNESS_CONSTANT)
-        maxMonsterHP = monsterHP
-        value = monsterHP
-        if monsterHP < 1:
-            monsterHP = 1
+        if (self.game and self.game.combatTables and self.hp >= 5
+            and not 0 < self.itemPoints <= MAX_ROUND_COST):
+            value, monsterHP = self.game.combatTables.fight(self, toughness)
+        else:
+            monsterHP = self.rng.randint(toughness,
+                                       toughness*self.balance.monsterToughnessConstant)
+            value = monsterHP
+            if monsterHP < 1:
+                monsterHP = 1
+        maxMonsterHP = value
         while monsterHP > 0 and self.alive():
-            #You attack
-            done = 0
-            if self.hp < 5:
-                if self.discovery:
-                    quitChance = 20
-                else:
-                    quitChance = 4
-                if random.randint(0, quitChance):
-                    self.pray('help', random.randint(1,3))
-                    done = 1
-                else:
-                    self.quit = 1
-                    done = 1
-            if not done:
-                multiplier = 1
-                if not random.randint(0, 3):
-                    #Miss
-                    multiplier = 0
-                elif self.itemPoints > 0 and random.randint(0, 3):
-                    #More damage, but also some loss of item points
-                    multiplier = int(random.random() * 10)
-                else:
-                    multiplier = 1
-                if multiplier > 1:
-                    if not self.costItemPoints(multiplier * random.randint(1,4)):
-                        multiplier = 1
-                damage = random.randint(3,self.dungeonLevel+3) * multiplier
-                monsterHP = monsterHP - damage
-
-            #Monster attacks
-            if monsterHP > 0:
-                damage = 0
-                if not random.randint(0, 3):
-                    #Miss
-                    pass
-                else:
-                  damage = random.randint(0, toughness)
-                #Chance of you giving up item points to absorb damage.
-                if not random.randint(0, 2):
-                    multiplier = random.randint(2,10)
-                    #a = self.itemPoints
-                    if self.costItemPoints(multiplier / random.randint(1,4)):
-                        #print "%s->%s" % (a, self.itemPoints)
-                        damage = int(damage * (float(multiplier)/multiplier+1))
-                self.hp = self.hp - damage
-                if self.discovery and self.hp <= 0:
-                    self.hp = self.maxHP
+            monsterHP = self.fightRound(toughness, monsterHP)
 
         if self.alive():
             #Pet logic, bleah
-            self.score = self.score + int(value * (self.dungeonLevel * (self.dungeonLevel * .04) * SCORE_MULTIPLIER))
+            self.score = self.score + int(value * (self.dungeonLevel * (self.dungeonLevel * .04) * self.balance.scoreMultiplier))
             self.hp = self.hp + 1
             self.maxHP = self.maxHP + 1
-            if self.nearAltar and not random.randint(0,3):
+            if self.nearAltar and not self.rng.randint(0,3):
                 self.pray('sacrifice', maxMonsterHP)
-            if not random.randint(0, 4):
+            if not self.rng.randint(0, 4):
                 self.getGoodie() #Woohoo
+        if self.game.trace:
+            self.game.trace.record(self, 'fightMonster')
+
+    def fightRound(self, toughness, monsterHP):
+        "Plays one round of a fight; returns the monster's hit points."
+        randint = self.rng.randint
+        #You attack
+        done = 0
+        if self.hp < 5:
+            if self.discovery:
+                quitChance = 20
+            else:
+                quitChance = 4
+            if randint(0, quitChance):
+                self.pray('help', randint(1,3))
+                done = 1
+            else:
+                self.quit = 1
+                done = 1
+        if not done:
+            multiplier = 1
+            if not randint(0, 3):
+                #Miss
+                multiplier = 0
+            elif self.itemPoints > 0 and randint(0, 3):
+                #More damage, but also some loss of item points
+                multiplier = int(self.rng.random() * 10)
+            else:
+                multiplier = 1
+            if multiplier > 1:
+                if not self.costItemPoints(multiplier * randint(1,4)):
+                    multiplier = 1
+            damage = randint(3,self.dungeonLevel+3) * multiplier
+            monsterHP = monsterHP - damage
+
+        #Monster attacks
+        if monsterHP > 0:
+            damage = 0
+            if not randint(0, 3):
+                #Miss
+                pass
+            else:
+              damage = randint(0, toughness)
+            #Chance of you giving up item points to absorb damage.
+            if not randint(0, 2):
+                multiplier = randint(2,10)
+                #a = self.itemPoints
+                if self.costItemPoints(multiplier // randint(1,4)):
+                    #print "%s->%s" % (a, self.itemPoints)
+                    damage = int(damage * (float(multiplier)/multiplier+1))
+            self.hp = self.hp - damage
+            if self.discovery and self.hp <= 0:
+                self.hp = self.maxHP
+        return monsterHP
 
     def costItemPoints(self, cost):
         if self.itemPoints > 0:
@@ -872,8 +4046,1538 @@ class Player:
         self.hp = 0
 
     def pray(self, type, arg=None):
-        print self.game.wrap(self.getPrayerDescription(type))
-        self.god.handlePrayer(self, type, arg)
+        self.game.out.say(self.getPrayerDescription(type))
+        if self.prayerTurn != self.turns:
+            self.prayerTurn = self.turns
+            self.turnPrayers = 0
+        self.turnPrayers = self.turnPrayers + 1
+        if self.snapshotting:
+            snapshot = self.getSnapshot()
+        forced = None
+        if self.fork and self.fork[:2] == (self.turns, self.turnPrayers):
+            forced = self.god.policy = ForcedPolicy(self.god, *self.fork[2:])
+            self.fork = None
+        key = self.god.handlePrayer(self, type, arg)
+        if forced and self.god.policy == forced:
+            #Nothing to decide after all; just reseed.
+            forced.answer()
+        if self.game.trace:
+            self.game.trace.record(self, type, key)
+        if self.snapshotting:
+            self.prayerPoints.append((snapshot, type, key))
+
+    UNSAVED = ('game', 'god', 'rng', 'snapshotting', 'turnStart',
+               'prayerPoints', 'fork') #Left out of getState
+
+    def getState(self):
+        "Returns the champion's state as a dictionary of plain values."
+        state = {}
+        for name in self.SAVED:
+            try:
+                state[name] = getattr(self, name)
+            except AttributeError:
+                #Never set, like hitPoints until costHitPoints.
+                pass
+        state['role'] = self.role.key
+        state['turnsOnLevels'] = self.turnsOnLevels[:]
+        return state
+
+    def setState(self, state):
+        for (name, value) in state.items():
+            setattr(self, name, value)
+        self.role = roleMap[state['role']]
+        self.turnsOnLevels = state['turnsOnLevels'][:]
+
+    def getSnapshot(self):
+        """Returns the current prayer as a string, for playFromSnapshot:
+        the god, the champion's state and the random number generator's
+        class and state at the start of the turn, and which of the
+        turn's prayers this is. Only works when snapshotting."""
+        state, randomState = self.turnStart
+        policy = self.god.policy
+        if isinstance(policy, ForcedPolicy):
+            policy = policy.policy
+        if isinstance(policy, InteractivePolicy):
+            policy = None
+        return cPickle.dumps((self.god.role.key, self.god.alignment,
+                              policy, state, self.rng.__class__,
+                              randomState, self.turns, self.turnPrayers), 2)
+
+Player.eventTable = [(Player.__dict__[event+'Chance'], Player.__dict__[event])
+                     for event in Player.EVENTS]
+Player.SAVED = [name for name in Player.__slots__
+                if name not in Player.UNSAVED] #What getState saves
+
+### Traces
+
+#One record per fight, event, prayer and game end, with the champion's
+#state just after it. The event field indexes TRACE_EVENTS. For
+#prayers, decision is the character code of the god's answer ('h',
+#'i', 's', 'g', or 'y' or 'n' for a sacrifice), or 0 if there was
+#nothing to decide; for game ends it is an index into ENDS.
+TRACE_FIELDS = [ ('game', 'I'), ('turn', 'I'), ('level', 'H'), ('hp', 'f'),
+                 ('maxHP', 'f'), ('itemPoints', 'f'), ('prayerTimeout', 'f'),
+                 ('event', 'B'), ('decision', 'B') ]
+TRACE_RECORD = struct.Struct('<' + ''.join([x[1] for x in TRACE_FIELDS]))
+TRACE_VERSION = 1
+TRACE_HEADER = struct.pack('<8sII', b'WFTMTRC\n', TRACE_VERSION, TRACE_RECORD.size)
+TRACE_EVENTS = (['fightMonster'] + Player.EVENTS +
+                [INTERCESSORY_PRAYER, SACRIFICIAL_PRAYER, BLESSING_PRAYER, 'end'])
+TRACE_CODES = dict([(event, TRACE_EVENTS.index(event)) for event in TRACE_EVENTS])
+TRACE_BUFFER = 4096 #Records held before writing
+
+class TraceWriter:
+    """Records what happens in games (see TRACE_FIELDS, above). Records
+    are written to file in batches, or kept until taken with getvalue
+    if there's no file. Set game to number the games."""
+
+    def __init__(self, file=None):
+        self.file = file
+        self.game = 0
+        self.records = []
+        if file:
+            file.write(TRACE_HEADER)
+
+    def record(self, pc, event, decision=None):
+        if decision == None:
+            decision = 0
+        elif type(decision) == str:
+            decision = ord(decision)
+        self.records.append(TRACE_RECORD.pack(
+            self.game, pc.turns, pc.dungeonLevel, pc.hp, pc.maxHP,
+            pc.itemPoints, pc.prayerTimeout, TRACE_CODES[event], decision))
+        if self.file and len(self.records) >= TRACE_BUFFER:
+            self.flush()
+
+    def getvalue(self):
+        "Returns the records so far, packed, and forgets them."
+        records = b''.join(self.records)
+        self.records = []
+        return records
+
+    def write(self, records):
+        "Writes out packed records from another TraceWriter."
+        self.flush()
+        self.file.write(records)
+
+    def flush(self):
+        if self.file:
+            self.file.write(self.getvalue())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def readTrace(path):
+    """Maps a trace file into memory as a NumPy structured array with
+    the fields in TRACE_FIELDS. Pages are only read as they're used, so
+    a trace needn't fit in memory."""
+    if numpy == None:
+        raise ImportError('reading traces needs NumPy')
+    recordType = numpy.dtype([(name, '<' + code)
+                              for (name, code) in TRACE_FIELDS])
+    f = open(path, 'rb')
+    try:
+        header = f.read(len(TRACE_HEADER))
+    finally:
+        f.close()
+    if header != TRACE_HEADER:
+        raise ValueError('%s is not a version %s trace' % (path, TRACE_VERSION))
+    if os.path.getsize(path) == len(TRACE_HEADER):
+        return numpy.zeros(0, recordType)
+    return numpy.memmap(path, recordType, 'r', len(TRACE_HEADER))
+
+### Instrumentation
+
+#Instruments count and time calls to the scalar engine's hot paths,
+#by dungeon level, without a profiler. They work by replacing methods
+#of Player and God with timing wrappers, so until install is called
+#they cost nothing at all. Times are inclusive: a prayer during a
+#fight counts towards both.
+
+HISTOGRAM_BITS = 5 #Significant bits kept by a Histogram
+
+class Histogram:
+    """Counts non-negative integers in log-linear buckets: exactly up to
+    2**HISTOGRAM_BITS, then HISTOGRAM_BITS significant bits, so any
+    value is off by at most about 1 part in 2**(HISTOGRAM_BITS-1). Two
+    histograms merge by adding their buckets."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        value = int(value)
+        shift = value.bit_length() - HISTOGRAM_BITS
+        if shift > 0:
+            bucket = value >> shift << shift
+        else:
+            bucket = value
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count = self.count + 1
+        self.total = self.total + value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for (bucket, count) in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count = self.count + other.count
+        self.total = self.total + other.total
+        self.max = max(self.max, other.max)
+
+    def getMean(self):
+        return float(self.total) / max(1, self.count)
+
+    def getPercentile(self, percent):
+        "Returns the highest value in the bucket holding the percentile."
+        rank = percent / 100.0 * self.count
+        seen = 0
+        buckets = sorted(self.buckets)
+        for bucket in buckets:
+            seen = seen + self.buckets[bucket]
+            if seen >= rank:
+                break
+        else:
+            return 0
+        shift = bucket.bit_length() - HISTOGRAM_BITS
+        if shift > 0:
+            bucket = bucket + (1 << shift) - 1
+        return min(bucket, self.max)
+
+class Instruments:
+    """Keeps, for every (name, dungeon level), the number of calls and
+    the seconds they took; for every name, a Histogram of how many
+    microseconds calls took; and a Histogram of rounds per fight (the
+    rounds actually played; see CombatTables)."""
+
+    def __init__(self):
+        self.calls = {} #(name, level) -> [calls, seconds]
+        self.times = {} #name -> Histogram of microseconds
+        self.rounds = Histogram()
+        self.roundsPlayed = 0
+        self.originals = []
+
+    def install(self):
+        "Starts timing by wrapping Player's and God's methods."
+        getLevel = lambda pc, *args: pc.dungeonLevel
+        fightMonster = Player.__dict__['fightMonster']
+        fightRound = Player.__dict__['fightRound']
+        def countRounds(pc):
+            played = self.roundsPlayed
+            fightMonster(pc)
+            self.rounds.add(self.roundsPlayed - played)
+        def countRound(pc, toughness, monsterHP):
+            self.roundsPlayed = self.roundsPlayed + 1
+            return fightRound(pc, toughness, monsterHP)
+        self.replace(Player, 'handleEvent', getLevel)
+        for event in Player.EVENTS:
+            self.replace(Player, event, getLevel)
+        self.replace(Player, 'fightMonster', getLevel, countRounds)
+        self.replace(Player, 'fightRound', getLevel, countRound)
+        self.replace(Player, 'pray', lambda pc, type, arg=None: (
+            pc.dungeonLevel, 'pray ' + type))
+        self.replace(God, 'inflict', lambda god, pc, punishment: (
+            pc.dungeonLevel, 'punish ' + punishment))
+        self.resetEventTable()
+        #Every turn goes through handleEvent, so that it counts them.
+        Player.fightRuns = 0
+
+    def uninstall(self):
+        "Puts back the methods install replaced."
+        for (cls, name, function) in self.originals:
+            setattr(cls, name, function)
+        self.originals = []
+        self.resetEventTable()
+        Player.fightRuns = 1
+
+    def resetEventTable(self):
+        Player.eventTable = [(chance, Player.__dict__[event.__name__])
+                             for (chance, event) in Player.eventTable]
+
+    def replace(self, cls, name, getKey, function=None):
+        """Replaces a method with one that times function (by default,
+        the method itself). getKey takes the method's arguments and
+        returns the dungeon level, or the level and a more specific
+        name to file the call under."""
+        original = cls.__dict__[name]
+        function = function or original
+        calls = self.calls
+        times = self.times
+        clock = time.time
+        def timed(*args):
+            key = getKey(*args)
+            if type(key) == tuple:
+                level, key = key
+            else:
+                level, key = key, name
+            started = clock()
+            result = function(*args)
+            elapsed = clock() - started
+            counts = calls.get((key, level))
+            if counts == None:
+                counts = calls[(key, level)] = [0, 0.0]
+            counts[0] = counts[0] + 1
+            counts[1] = counts[1] + elapsed
+            histogram = times.get(key)
+            if histogram == None:
+                histogram = times[key] = Histogram()
+            histogram.add(elapsed * 1e6)
+            return result
+        timed.__name__ = name
+        timed.__doc__ = original.__doc__
+        self.originals.append((cls, name, original))
+        setattr(cls, name, timed)
+
+    def getTotals(self, name=None, level=None):
+        "Returns calls and seconds for a name, a level or both."
+        calls, seconds = 0, 0.0
+        for ((key, keyLevel), counts) in self.calls.items():
+            if name in (None, key) and level in (None, keyLevel):
+                calls = calls + counts[0]
+                seconds = seconds + counts[1]
+        return calls, seconds
+
+    def getDump(self):
+        """Returns everything recorded as plain values: calls maps each
+        name to a dictionary of dungeon level -> (calls, seconds);
+        times maps each name to percentiles of microseconds per call;
+        rounds has the same for rounds per fight."""
+        calls = {}
+        for ((name, level), counts) in self.calls.items():
+            calls.setdefault(name, {})[level] = tuple(counts)
+        times = {}
+        for (name, histogram) in self.times.items():
+            times[name] = getHistogramSummary(histogram)
+        return { 'calls' : calls, 'times' : times,
+                 'rounds' : getHistogramSummary(self.rounds) }
+
+    def report(self, out=None):
+        "Prints where the time went, by name and by dungeon level."
+        out = out or sys.stderr
+        turns, turnSeconds = self.getTotals('handleEvent')
+        if not turns:
+            return
+        out.write('%-24s %10s %9s %6s %9s %9s %9s\n' % (
+            '', 'calls', 'seconds', 'share', 'us/call', 'median', '99%'))
+        names = sorted(self.times, key=lambda name: self.getTotals(name)[1],
+                       reverse=True)
+        for name in names:
+            calls, seconds = self.getTotals(name)
+            histogram = self.times[name]
+            out.write('%-24s %10d %9.2f %5.1f%% %9.1f %9d %9d\n' % (
+                name, calls, seconds, seconds / turnSeconds * 100,
+                seconds / calls * 1e6, histogram.getPercentile(50),
+                histogram.getPercentile(99)))
+        out.write('\n%-6s %10s %9s %6s %9s %9s %9s %9s\n' % (
+            'level', 'turns', 'seconds', 'share', 'us/turn', 'fights',
+            'rounds', 'prayers'))
+        levels = {}
+        for (name, level) in self.calls.keys():
+            levels[level] = 1
+        levels = sorted(levels)
+        for level in levels:
+            calls, seconds = self.getTotals('handleEvent', level)
+            fights = self.getTotals('fightMonster', level)[0]
+            rounds = self.getTotals('fightRound', level)[0]
+            prayers = 0
+            for type in GENERIC_PRAYERS.keys():
+                prayers = prayers + self.getTotals('pray ' + type, level)[0]
+            out.write('%-6d %10d %9.2f %5.1f%% %9.1f %9d %9.1f %9d\n' % (
+                level, calls, seconds, seconds / turnSeconds * 100,
+                seconds / max(1, calls) * 1e6, fights,
+                float(rounds) / max(1, fights), prayers))
+        rounds = self.rounds
+        out.write('\nRounds per fight: mean %.2f, median %d, 90%% %d, 99%% %d, most %d\n' % (
+            rounds.getMean(), rounds.getPercentile(50),
+            rounds.getPercentile(90), rounds.getPercentile(99), rounds.max))
+
+def getHistogramSummary(histogram):
+    summary = { 'count' : histogram.count, 'mean' : histogram.getMean(),
+                'max' : histogram.max }
+    for percent in (50, 90, 99, 99.9):
+        summary[percent] = histogram.getPercentile(percent)
+    return summary
+
+instruments = None #The Instruments installed by instrument, if any
+
+def instrument(report=1):
+    """Installs Instruments, if that hasn't been done already, and
+    returns them. If report is true, they print a report to standard
+    error when the program exits."""
+    global instruments
+    if not instruments:
+        instruments = Instruments()
+        instruments.install()
+        if report:
+            atexit.register(instruments.report)
+    return instruments
+
+### Combat tables
+
+COMBAT_TABLE_VERSION = 3 #Bump when the table format or fightRound changes
+COMBAT_TABLE_SAMPLES = 4096 #Fights played out ahead of time for each case
+COMBAT_TABLE_SEED = 0 #Seed the sample fights are drawn from
+COMBAT_TABLE_FILE = os.path.join(os.path.expanduser('~'), '.wftm-combat')
+MAX_ROUND_COST = 9*4 + 10 #Most item points one round of a fight can take
+
+class CombatTables:
+    """Fights played out ahead of time, so Player.fightMonster can skip
+    most of its round-by-round loop.
+
+    Apart from the champion's hit points and item points, a fight
+    depends only on the dungeon level, the monster's toughness and
+    whether the champion has any item points. For each such case the
+    tables hold about COMBAT_TABLE_SAMPLES fights fought by a champion
+    with endless hit points, and endless item points or none, recording
+    after every round the damage taken, the item points spent and the
+    monster's hit points. There are as many fights against each of the
+    monster's starting hit points. A real fight picks its monster just
+    as the exact loop would, so the monster's value (and the score for
+    it) is exact; it then draws one of the fights against that monster
+    and follows it for as long as the champion's own hit points and item points cannot
+    make a difference: until the champion starts a round with under 5
+    hit points (and so prays or quits) or with too few item points to
+    be sure of paying for it. From there the exact loop takes over, so
+    hit points and item points need no bucketing and the only error is
+    in the sampling.
+
+    The same sample fights serve every game, so their error does not
+    average out over a batch; there are enough of them to keep it
+    below what --check=combat can see. A champion under 5 hit points,
+    or with some item points but too few for even one round, would
+    skip nothing, so Player.fightMonster does not consult the tables
+    for them.
+
+    Each case's fights are drawn from its own generator, seeded from
+    COMBAT_TABLE_SEED and the case, so the tables (and the games played
+    with them) are the same whichever of them were built when. They
+    are kept in a file and rebuilt whenever the seed or the monster
+    toughness constant they were built with changes."""
+
+    def __init__(self, path=None, samples=COMBAT_TABLE_SAMPLES,
+                 balance=None):
+        self.path = path
+        self.samples = samples
+        self.balance = balance or Game.balance
+        self.tables = {}
+        if path:
+            self.load()
+
+    def getSignature(self):
+        return (COMBAT_TABLE_VERSION, VERSION, COMBAT_TABLE_SEED,
+                self.balance.monsterToughnessConstant, self.samples)
+
+    def load(self):
+        try:
+            f = open(self.path, 'rb')
+            try:
+                signature, tables = marshal.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            return
+        if signature != self.getSignature():
+            return
+        #Arrays are stored by item size, as typecodes would come back
+        #as bytes on Python 3 from a file written by Python 2.
+        codes = { 2 : 'h', 4 : 'i' }
+        for (key, strings) in tables.items():
+            self.tables[key] = tuple([array.array(codes[size], x)
+                                      for (size, x) in strings])
+
+    def save(self):
+        "Writes the tables out; the rename keeps readers from a half-written file."
+        tables = {}
+        for (key, table) in self.tables.items():
+            tables[key] = tuple([(x.itemsize, getArrayBytes(x)) for x in table])
+        f = open(self.path + '.new', 'wb')
+        try:
+            marshal.dump((self.getSignature(), tables), f)
+        finally:
+            f.close()
+        os.rename(self.path + '.new', self.path)
+
+    def getToughnesses(self, level):
+        "Every toughness Player.fightMonster can pick on a level."
+        toughnesses = {}
+        for roll in range(7):
+            toughness = roll - 3 + level//2
+            if toughness < 0:
+                toughness = 1
+            toughnesses[toughness] = 1
+        return toughnesses.keys()
+
+    def prepare(self):
+        """Builds every table a game can need and saves them if anything
+        was missing. Levels past the bottom are built on demand."""
+        built = 0
+        for level in range(1, self.balance.maxDungeonLevel + 1):
+            for toughness in self.getToughnesses(level):
+                for armed in (0, 1):
+                    if (level, toughness, armed) not in self.tables:
+                        self.get(level, toughness, armed)
+                        built = 1
+        if built and self.path:
+            self.save()
+        return self
+
+    def get(self, level, toughness, armed):
+        key = (level, toughness, armed)
+        table = self.tables.get(key)
+        if table == None:
+            table = self.tables[key] = self.build(level, toughness, armed)
+        return table
+
+    def build(self, level, toughness, armed):
+        """Plays out the sample fights for one case with the same
+        Player.fightRound real fights use, an equal number against each
+        value the monster can have, lowest first. Returns arrays of
+        where each fight's rounds start, and the damage taken, item
+        points spent and monster hit points after each round; the last
+        three as short integers if they fit, which halves the file."""
+        endless = 2**30
+        rng = StandardRandom(getBlockSeed(COMBAT_TABLE_SEED, '%d %d %d' % (
+            level, toughness, armed)))
+        fighter = Player(None, roleMap['p'], NEUTRAL, None, rng=rng)
+        fighter.balance = self.balance
+        fighter.setLevel(level)
+        starts = array.array('i', [0])
+        damage = array.array('i')
+        spent = array.array('i')
+        monsterHPs = array.array('i')
+        values = range(toughness,
+                       toughness*self.balance.monsterToughnessConstant + 1)
+        fights = max(1, self.samples // len(values))
+        for value in values:
+            for i in xrange(fights):
+                fighter.hp = endless
+                fighter.itemPoints = armed and endless
+                monsterHP = max(1, value)
+                while monsterHP > 0:
+                    monsterHP = fighter.fightRound(toughness, monsterHP)
+                    damage.append(endless - fighter.hp)
+                    spent.append(armed and endless - fighter.itemPoints)
+                    monsterHPs.append(max(0, monsterHP))
+                starts.append(len(damage))
+        rounds = (damage, spent, monsterHPs)
+        if max([max(x) for x in rounds]) < 2**15:
+            rounds = tuple([array.array('h', x) for x in rounds])
+        return (starts,) + rounds
+
+    def fight(self, player, toughness):
+        """Takes the player through as much of a fight as the tables
+        can. Returns the monster's value and its remaining hit points,
+        which are zero if the fight is over. The player must have at
+        least 5 hit points, and either no item points or more than
+        MAX_ROUND_COST."""
+        armed = player.itemPoints > 0
+        starts, damage, spent, monsterHPs = self.get(
+            player.dungeonLevel, toughness, armed)
+        most = toughness*self.balance.monsterToughnessConstant
+        value = player.rng.randint(toughness, most)
+        fights = (len(starts) - 1) // (most - toughness + 1)
+        i = (value - toughness) * fights + player.rng.randrange(fights)
+        hp = player.hp
+        itemPoints = player.itemPoints
+        end = starts[i+1]
+        last = end - 1
+        rounds = start = starts[i]
+        while rounds < end:
+            #Whether to play a round can't depend on how it went, or
+            #the fights that get cut short would be the costly ones.
+            if armed and itemPoints - (rounds > start and spent[rounds-1]) <= MAX_ROUND_COST:
+                break
+            rounds = rounds + 1
+            if rounds <= last and hp - damage[rounds-1] < 5:
+                break
+        if rounds == start:
+            return value, max(1, value)
+        player.hp = hp - damage[rounds-1]
+        if armed:
+            player.itemPoints = itemPoints - spent[rounds-1]
+        if player.discovery and player.hp <= 0:
+            player.hp = player.maxHP
+        return value, monsterHPs[rounds-1]
+
+_combatTables = {}
+
+def getCombatTables(path=COMBAT_TABLE_FILE, balance=None):
+    """Returns the combat tables kept in path, building them if need be.
+    Tables for a monster toughness constant other than the default are
+    kept beside it. Each process loads them once; worker processes
+    inherit them."""
+    balance = balance or Game.balance
+    toughness = balance.monsterToughnessConstant
+    if toughness != MONSTER_TOUGHNESS_CONSTANT:
+        path = '%s-%s' % (path, toughness)
+    if path not in _combatTables:
+        _combatTables[path] = CombatTables(path, balance=balance).prepare()
+    return _combatTables[path]
+
+### The vectorized engine
+
+VECTOR_CHUNK = 50000 #Champions advanced together by the vector engine
+
+class Population:
+    """Plays out many champions of a single deity at once with NumPy.
+
+    This is the same game as Player, rewritten so that the whole
+    population plays in lockstep: each piece of champion state lives
+    in an array, random numbers are drawn in batches, and Player's
+    conditionals become masks. Prayers are answered by the policy's
+    vector methods.
+
+    Each step plays one round of every fight. Champions between
+    fights first take a new turn, which may start a fight, so that
+    long fights never hold up the rest of the population. At most
+    width champions play at once; those who die, quit or win are
+    retired as they go, their results kept by game number, and new
+    champions take their places until all the games are played.
+
+    The engine must stay faithful to Player, quirks and all; see
+    checkVectorEngine."""
+
+    #Arrays holding the state of the champions now playing. A fight
+    #is going on wherever monsterHP is positive.
+    STATE = ('ids', 'hp', 'maxHP', 'drained', 'itemPoints', 'dungeonLevel',
+             'deepestLevel', 'turnsOnLevel', 'prayerTimeout', 'score',
+             'turns', 'nearAltar', 'amulet', 'stackedMonsters', 'quit', 'won',
+             'monsterHP', 'toughness', 'monsterValue')
+
+    TYPES = { 'hp' : float, 'maxHP' : float, 'drained' : bool,
+              'itemPoints' : float, 'prayerTimeout' : float,
+              'score' : 'int64', 'nearAltar' : bool, 'amulet' : bool,
+              'quit' : bool, 'won' : bool }
+
+    #How a new champion starts out; see Player.__init__. Player.maxHP
+    #stays an integer until drained, hence the drained flag. Player.
+    #setLevel hands back the count it was given, so the turns spent
+    #on each level never need to be stored.
+    START = { 'hp' : 15, 'maxHP' : 15, 'itemPoints' : 50, 'dungeonLevel' : 1,
+              'deepestLevel' : 1, 'prayerTimeout' : 300 }
+
+    def __init__(self, games, role, alignment, policy, discovery=0, rng=None,
+                 width=VECTOR_CHUNK, balance=None):
+        if isinstance(policy, InteractivePolicy):
+            raise ValueError('a population cannot ask the player')
+        if rng == None:
+            rng = numpy.random.Generator(numpy.random.PCG64())
+        self.rng = rng
+        self.balance = balance or Game.balance
+        self.games = games
+        self.role = role
+        self.alignment = alignment
+        self.name = gods[role.key][alignment]
+        self.policy = policy
+        self.discovery = discovery
+        if discovery:
+            self.quitChance = 20
+        else:
+            self.quitChance = 4
+
+        #Results, by game number
+        self.ends = numpy.zeros(games, int)
+        self.finalScores = numpy.zeros(games, numpy.int64)
+        self.finalDeepestLevels = numpy.zeros(games, int)
+        self.finalTurns = numpy.zeros(games, int)
+
+        for name in self.STATE:
+            setattr(self, name, numpy.zeros(0, self.TYPES.get(name, int)))
+        self.started = 0
+        self.admit(min(games, width))
+
+    def admit(self, count):
+        "Brings count new champions into play."
+        if not count:
+            return
+        for name in self.STATE:
+            fresh = numpy.zeros(count, self.TYPES.get(name, int))
+            fresh[:] = self.START.get(name, 0)
+            setattr(self, name, numpy.concatenate((getattr(self, name), fresh)))
+        self.ids[-count:] = numpy.arange(self.started, self.started + count)
+        self.started = self.started + count
+
+    ## Random numbers
+
+    def randint(self, low, high, size):
+        "Like random.randint, for arrays of bounds."
+        return low + (self.rng.random(size) * (high - low + 1)).astype(int)
+
+    def oneIn(self, chance, size):
+        "True where random.randint(0, chance) would have come up 0."
+        return self.rng.random(size) * (chance + 1) < 1
+
+    def expovariate(self, lambd, size):
+        return self.rng.exponential(1.0 / lambd, size)
+
+    def bits(self, shape):
+        """Random 32-bit integers, rows by n. The inner loops carve
+        several draws out of each of these, which is much cheaper than
+        drawing floats. They are the generator's raw 64-bit output cut
+        in two, which takes a third of the time integers() would."""
+        rows, n = shape
+        raw = self.rng.bit_generator.random_raw((rows, (n + 1) // 2))
+        return raw.view(numpy.uint32)[:, :n]
+
+    def below(self, bits, n, width=32):
+        "Turns width random bits into integers from 0 to n-1."
+        return (bits * (n * 2.0 ** -width)).astype(int)
+
+    ## Playing
+
+    def run(self):
+        while len(self.ids):
+            self.step()
+
+    def alive(self, who):
+        return (self.hp[who] > 0) & ~self.quit[who] & ~self.won[who]
+
+    def step(self):
+        alive = self.alive(slice(None))
+        idle = numpy.flatnonzero(alive & (self.monsterHP <= 0))
+        if len(idle):
+            self.turn(idle)
+            alive = self.alive(slice(None))
+        alive = self.fightRound(alive)
+        #Finished champions just sit out until there are enough of
+        #them to be worth retiring.
+        finished = len(alive) - numpy.count_nonzero(alive)
+        if finished and (finished * 32 >= len(alive) or finished == len(alive)):
+            self.retire()
+
+    def turn(self, who):
+        "See Player.turn."
+        self.turns[who] += 1
+        self.turnsOnLevel[who] += 1
+        self.prayerTimeout[who] = numpy.maximum(0, self.prayerTimeout[who] - 1)
+        self.hp[who] = numpy.minimum(self.hp[who] + int(self.balance.healingPerTurn),
+                                     self.maxHP[who])
+        self.handleEvents(who)
+
+    def retire(self):
+        """Records the results of finished champions, drops them and
+        brings in replacements."""
+        over = ~self.alive(slice(None))
+        if not over.any():
+            return
+        ids = self.ids[over]
+        ends = numpy.zeros(len(ids), int) + 3
+        ends[self.quit[over]] = 2
+        ends[self.won[over]] = 1
+        scores = self.score[over]
+        died = ends == 3
+        scores[died] = (scores[died] * .9).astype(numpy.int64)
+        self.ends[ids] = ends
+        self.finalScores[ids] = scores
+        self.finalDeepestLevels[ids] = self.deepestLevel[over]
+        self.finalTurns[ids] = self.turns[over]
+        keep = ~over
+        for name in self.STATE:
+            setattr(self, name, getattr(self, name)[keep])
+        self.admit(min(len(ids), self.games - self.started))
+
+    def handleEvents(self, who):
+        stacked = self.stackedMonsters[who] > 0
+        self.stackedMonsters[who[stacked]] -= 1
+        undecided = ~stacked
+        #Events that don't happen change nothing, so every chance can
+        #be rolled up front.
+        r = self.bits((len(self.EVENTS), len(who)))
+        for i in range(len(self.EVENTS)):
+            chance, event = self.EVENTS[i]
+            firing = undecided & (self.below(r[i], chance(self, who) + 1) == 0)
+            if firing.any():
+                happened = event(self, who[firing])
+                undecided[numpy.flatnonzero(firing)[happened]] = 0
+        self.startFights(who[undecided | stacked])
+
+    def ascendLevelChance(self, who):
+        return 100
+
+    def ascendLevel(self, who):
+        levels = self.dungeonLevel[who]
+        happened = (levels != 1) & (levels < self.balance.maxDungeonLevel - 1)
+        self.dungeonLevel[who[happened]] -= 1
+        return happened
+
+    def descendLevelChance(self, who):
+        return numpy.maximum(5, 100 - self.turnsOnLevel[who])
+
+    def descendLevel(self, who):
+        self.dungeonLevel[who] += 1
+        self.deepestLevel[who] = numpy.maximum(self.deepestLevel[who],
+                                               self.dungeonLevel[who])
+        self.nearAltar[who[self.oneIn(3, len(who))]] = 0
+        levels = self.dungeonLevel[who]
+        self.amulet[who[levels == 50]] = 1
+        finished = (levels == self.balance.maxDungeonLevel) & self.amulet[who]
+        self.won[who[finished]] = 1
+        return numpy.ones(len(who), bool)
+
+    def findAltarChance(self, who):
+        return numpy.maximum(300, 150 + self.turnsOnLevel[who])
+
+    def findAltar(self, who):
+        self.nearAltar[who] = 1
+        self.prayForBlessing(who[self.oneIn(3, len(who))])
+        return numpy.ones(len(who), bool)
+
+    def loseAltarChance(self, who):
+        return 100
+
+    def loseAltar(self, who):
+        happened = self.nearAltar[who].copy()
+        self.nearAltar[who] = 0
+        return happened
+
+    def getGoodieChance(self, who):
+        return 20 + self.turnsOnLevel[who] // 5
+
+    def getGoodies(self, who):
+        levels = self.dungeonLevel[who]
+        n = len(who)
+        value = self.randint(0, numpy.maximum(levels, (1.5 * levels).astype(int)
+                                              - self.turnsOnLevel[who]), n)
+        gold = self.oneIn(3, n)
+        useful = ~gold & (self.randint(0, 5, n) != 0)
+        self.score[who[gold]] += value[gold] * self.balance.goldConstant
+        self.itemPoints[who[useful]] += (value[useful] * self.balance.itemConstant).astype(int)
+        useful = who[useful]
+        self.prayForBlessing(useful[self.nearAltar[useful] &
+                                    self.oneIn(20, len(useful))])
+        return numpy.ones(n, bool)
+
+    EVENTS = [ (getGoodieChance, getGoodies),
+               (descendLevelChance, descendLevel),
+               (findAltarChance, findAltar),
+               (ascendLevelChance, ascendLevel),
+               (loseAltarChance, loseAltar) ]
+
+    ## Fighting; see Player.fightMonster
+
+    def startFights(self, who):
+        n = len(who)
+        toughness = self.randint(0, 6, n) - 3 + self.dungeonLevel[who] // 2
+        toughness[toughness < 0] = 1
+        monsterHP = self.randint(toughness,
+                                 toughness * self.balance.monsterToughnessConstant, n)
+        self.toughness[who] = toughness
+        self.monsterValue[who] = monsterHP
+        self.monsterHP[who] = numpy.maximum(1, monsterHP)
+
+    def fightRound(self, alive):
+        """Plays a round of every fight and returns who is still alive
+        afterwards."""
+        fighting = alive & (self.monsterHP > 0)
+        low = fighting & (self.hp < 5)
+        praying = low.any()
+        if praying:
+            praying = numpy.flatnonzero(low)
+            gaveUp = self.oneIn(self.quitChance, len(praying))
+            self.quit[praying[gaveUp]] = 1
+            praying = praying[~gaveUp]
+            self.prayForHelp(praying, self.randint(1, 3, len(praying)))
+            praying = 1
+
+        r = self.bits((4, len(self.ids)))
+        itemPoints = self.itemPoints
+
+        #You attack. A quarter of the time you miss. Otherwise, if you
+        #have item points, three times in four you do up to nine
+        #times the damage for one to four times that many of them.
+        #r[0] picks all that: two bits each for the miss, the power-up
+        #and the cost, the rest for the multiplier.
+        multiplier = (fighting & ~low & (r[0] & 3 != 0)).astype(int)
+        powered = numpy.flatnonzero((multiplier == 1) & (r[0] & 12 != 0) &
+                                    (itemPoints > 0))
+        multiplier[powered] = (r[0][powered] >> 6) * 10 >> 26
+        big = powered[multiplier[powered] > 1]
+        #Only champions with item points power up, so they always pay.
+        itemPoints[big] = numpy.maximum(0, itemPoints[big] - multiplier[big] *
+                                        (1 + (r[0][big] >> 4 & 3)))
+        monsterHP = self.monsterHP - multiplier * \
+                    (3 + self.below(r[1], self.dungeonLevel + 1))
+
+        #The monster attacks, missing a quarter of the time. A third
+        #of the time you give up 2-10 item points, divided by 1-4, to
+        #absorb the damage, which Player doubles instead (damage *
+        #(float(m)/m+1)). r[2] has the miss, the divisor and the
+        #damage; r[3] picks absorbing and m together.
+        hit = fighting & (monsterHP > 0)
+        damage = self.below(r[2] >> 4, self.toughness + 1, 28)
+        damage[r[2] & 3 == 0] = 0
+        absorbing = numpy.flatnonzero(hit & (r[3] < 2 ** 32 / 3.0))
+        m = self.below(r[3][absorbing], 27)
+        paid = itemPoints[absorbing] > 0
+        itemPoints[absorbing] = numpy.maximum(0, itemPoints[absorbing] - (2 + m) //
+                                              (1 + (r[2][absorbing] >> 2 & 3))) * paid
+        damage[absorbing[paid]] *= 2
+        hp = numpy.where(hit, self.hp - damage, self.hp)
+        if self.discovery:
+            hp = numpy.where(hit & (hp <= 0), self.maxHP, hp)
+        self.hp = hp
+
+        alive = alive & (hp > 0)
+        if praying:
+            alive = alive & ~self.quit
+        self.monsterHP = numpy.where(alive, monsterHP, 0)
+        self.endFights(numpy.flatnonzero(fighting & alive & (monsterHP <= 0)))
+        return alive
+
+    def endFights(self, winners):
+        levels = self.dungeonLevel[winners]
+        value = self.monsterValue[winners]
+        self.score[winners] += (value * (levels * (levels * .04) *
+                                         self.balance.scoreMultiplier)).astype(numpy.int64)
+        self.hp[winners] += 1
+        self.maxHP[winners] += 1
+        k = len(winners)
+        sacrificing = self.nearAltar[winners] & self.oneIn(3, k)
+        self.prayForSacrifice(winners[sacrificing], value[sacrificing])
+        self.getGoodies(winners[self.oneIn(4, k)])
+
+    def costItemPoints(self, who, cost):
+        "Returns which champions could pay."
+        paid = self.itemPoints[who] > 0
+        self.itemPoints[who] = numpy.where(paid, numpy.maximum(
+            0, self.itemPoints[who] - cost), 0)
+        return paid
+
+    def resetPrayerTimeout(self, who):
+        reset = numpy.where(self.amulet[who], 450, 350)
+        self.prayerTimeout[who] = self.expovariate(reset, len(who))
+
+    def getMoods(self, who, troubleLevels):
+        cutoff = numpy.where(troubleLevels == 1, 200, 100)
+        timeouts = self.prayerTimeout[who]
+        moods = numpy.ones(len(who), int)
+        moods[timeouts > cutoff * .5] = 0
+        moods[timeouts > cutoff] = -1
+        return moods
+
+    ## Prayers; see God
+
+    def prayForHelp(self, who, troubleLevels):
+        if not len(who):
+            return
+        keys = self.policy.handlePrayerHelpVector(
+            self, who, troubleLevels, self.getMoods(who, troubleLevels))
+        helped = who[keys == 'h']
+        self.hp[helped] = self.maxHP[helped]
+        self.resetPrayerTimeout(helped)
+        self.hp[helped[self.oneIn(30, len(helped))]] = 0
+        ignored = who[keys == 'i']
+        self.hp[ignored] = numpy.where(self.drained[ignored],
+                                       self.maxHP[ignored] / 2,
+                                       self.maxHP[ignored] // 2)
+        self.punish(who[keys == 's'])
+
+    def prayForSacrifice(self, who, sacValues):
+        if not len(who):
+            return
+        maxHP = self.maxHP[who]
+        values = numpy.zeros(len(who), int) - 1
+        values[sacValues >= maxHP * .20] = 0
+        values[sacValues >= maxHP * .40] = 1
+        if self.alignment == CHAOTIC:
+            multiplier = 500
+        else:
+            multiplier = 300
+        self.prayerTimeout[who] = numpy.maximum(
+            0, self.prayerTimeout[who] - (sacValues * multiplier))
+        favor = (self.prayerTimeout[who] == 0) & \
+                ((values == 1) | ((values == 0) & self.oneIn(10, len(who))))
+        who = who[favor]
+        if len(who):
+            grant = self.policy.handlePrayerSacrificeVector(self, who,
+                                                            values[favor])
+            self.grantBoons(who[grant])
+
+    def prayForBlessing(self, who):
+        if not len(who):
+            return
+        keys = self.policy.handlePrayerBlessingVector(
+            self, who, self.getMoods(who, numpy.zeros(len(who), int)))
+        granted = who[keys == 'g']
+        self.grantBoons(granted)
+        self.resetPrayerTimeout(granted)
+        self.punish(who[keys == 's'])
+
+    def grantBoons(self, who):
+        n = len(who)
+        junk = (self.prayerTimeout[who] < 50) & self.oneIn(3, n)
+        points = numpy.where(junk, self.randint(100, 500, n),
+                             self.randint(10, 100, n))
+        self.itemPoints[who] += points
+
+    def punish(self, who):
+        if not len(who):
+            return
+        punishments = self.randint(0, 4, len(who))
+        #zap
+        zapped = who[punishments == 0]
+        self.costItemPoints(zapped, self.expovariate(50, len(zapped)))
+        #Player.costHitPoints only ever takes hit points from the dead.
+        self.hp[zapped] = numpy.where(self.hp[zapped] > 0, self.hp[zapped], 0)
+        resisted = zapped[(self.itemPoints[zapped] > 0) & self.alive(zapped)]
+        self.stackedMonsters[resisted] = 5
+        #drain
+        drained = who[punishments == 1]
+        self.maxHP[drained] *= .9
+        self.drained[drained] = 1
+        self.hp[drained] = numpy.minimum(self.hp[drained], self.maxHP[drained])
+        #ball
+        balled = who[punishments == 2]
+        self.costItemPoints(balled, self.randint(10, 15, len(balled)))
+        #curse
+        cursed = who[punishments == 3]
+        self.costItemPoints(cursed, self.randint(20, 50, len(cursed)))
+        #minion
+        self.stackedMonsters[who[punishments == 4]] = 5
+
+    ## Results
+
+    def getResults(self):
+        """Generates a game result (see getSummary) for each champion.
+        Roles, races and genders don't affect play, so they are drawn
+        here the way Player would have drawn them."""
+        possibleRaces, possibleRacesModuloClass = raceOptions[(self.role.key,
+                                                               self.alignment)]
+        n = self.games
+        if self.role.key == 'v':
+            genders = numpy.ones(n, int)
+        else:
+            genders = self.rng.integers(0, 2, n)
+        if possibleRaces:
+            own = numpy.take(ROLE_KEYS, self.rng.integers(0, len(ROLE_KEYS), n)) != 'p'
+            races = self.rng.integers(0, len(possibleRaces), n)
+        else:
+            own = numpy.zeros(n, bool)
+            races = numpy.zeros(n, int)
+        others = self.rng.integers(0, len(possibleRacesModuloClass), n)
+        for i in xrange(n):
+            if own[i]:
+                role = self.role.key
+                race = possibleRaces[races[i]]
+            else:
+                role = 'p'
+                race = possibleRacesModuloClass[others[i]]
+            yield (self.role.key, role, self.alignment, race,
+                   ('male', 'female')[genders[i]],
+                   int(self.ends[i]), int(self.finalScores[i]),
+                   int(self.finalDeepestLevels[i]), int(self.finalTurns[i]))
+
+engines = ('scalar', 'vector')
+
+#Games per seeded block in a batch; see BatchGame.playAll
+BLOCK_GAMES = { 'scalar' : 1000,
+                'vector' : VECTOR_CHUNK }
+
+### Self-checks
+
+def _ksTest(a, b):
+    """Two-sample Kolmogorov-Smirnov test. Returns the statistic and
+    its asymptotic p-value."""
+    a = numpy.sort(a)
+    b = numpy.sort(b)
+    both = numpy.concatenate((a, b))
+    d = numpy.abs(numpy.searchsorted(a, both, 'right') / float(len(a)) -
+                  numpy.searchsorted(b, both, 'right') / float(len(b))).max()
+    n = math.sqrt(len(a) * len(b) / float(len(a) + len(b)))
+    l = (n + .12 + .11 / n) * d
+    p = 0
+    for k in range(1, 101):
+        p = p + 2 * (-1) ** (k - 1) * math.exp(-2 * k * k * l * l)
+    return d, min(1, max(0, p))
+
+def _proportionTest(hitsA, nA, hitsB, nB):
+    "Two-sided two-proportion z-test; returns the p-value."
+    pooled = float(hitsA + hitsB) / (nA + nB)
+    se = math.sqrt(pooled * (1 - pooled) * (1.0 / nA + 1.0 / nB))
+    if not se:
+        return 1
+    z = abs(float(hitsA) / nA - float(hitsB) / nB) / se
+    return math.erfc(z / math.sqrt(2))
+
+def compareSummaries(a, b, alpha=.001, out=None):
+    """Tests whether two lists of game summaries come from the same
+    distribution: KS tests on score, deepest level and turns, and
+    proportion tests on how the games ended. Returns true if nothing
+    was significant at alpha, Bonferroni-corrected."""
+    out = out or sys.stdout
+    tests = []
+    for (name, column) in (('score', 6), ('deepest level', 8), ('turns', 9)):
+        d, p = _ksTest(numpy.array([x[column] for x in a], float),
+                       numpy.array([x[column] for x in b], float))
+        tests.append(('%s (KS D=%.4f)' % (name, d), p))
+    for end in (END_WON, END_QUIT, END_DIED):
+        hitsA = len([x for x in a if x[5] == end])
+        hitsB = len([x for x in b if x[5] == end])
+        tests.append(('%s (%.4f vs. %.4f)' % (end, float(hitsA) / len(a),
+                                              float(hitsB) / len(b)),
+                      _proportionTest(hitsA, len(a), hitsB, len(b))))
+    return _reportTests(tests, alpha, out)
+
+def _reportTests(tests, alpha, out):
+    "Prints (name, p-value) pairs; returns true if none is significant."
+    ok = 1
+    for (name, p) in tests:
+        verdict = 'ok'
+        if p < alpha / len(tests):
+            verdict = 'DIFFERENT'
+            ok = 0
+        out.write('  %-40s p=%.4f %s\n' % (name, p, verdict))
+    return ok
+
+def checkVectorEngine(games=2000, seed=0):
+    """Plays the same deities with the scalar and vector engines and
+    compares the outcome distributions and the speed."""
+    ok = 1
+    for discovery in (0, 1):
+        for policy in (MoodPolicy, RandomPolicy):
+            role, alignment = roleMap['w'], CHAOTIC
+            scalar = BatchGame(games, role, alignment, discovery, policy, seed)
+            started = time.time()
+            a = list(map(getSummary, scalar.playAll()))
+            scalarTime = time.time() - started
+            vector = BatchGame(games * 25, role, alignment, discovery, policy,
+                               seed, 'vector')
+            started = time.time()
+            b = list(map(getSummary, vector.playAll()))
+            vectorTime = time.time() - started
+            scalarRate = sum([x[9] for x in a]) / scalarTime
+            vectorRate = sum([x[9] for x in b]) / vectorTime
+            print('%s, discovery=%s: %d vs. %d champion-turns/sec (%.1fx)' % (
+                policy.__name__, discovery, scalarRate, vectorRate,
+                vectorRate / scalarRate))
+            ok = compareSummaries(a, b) and ok
+    return ok
+
+def _sampleFights(template, fights):
+    """Fights fights monsters, each with a fresh copy of template.
+    Returns what each cost: hit points, item points, score, whether
+    the champion prayed, quit or died."""
+    samples = []
+    for i in xrange(fights):
+        pc = copy.copy(template)
+        pc.turnsOnLevels = template.turnsOnLevels[:]
+        #Any prayers come on this turn; pray counts them.
+        pc.prayerTurn = pc.turns
+        pc.turnPrayers = 0
+        pc.fightMonster()
+        samples.append((template.hp - pc.hp,
+                        template.itemPoints - pc.itemPoints,
+                        pc.score - template.score,
+                        pc.turnPrayers > 0, pc.quit, pc.hp <= 0))
+    return samples
+
+def checkCombatTables(fights=5000, games=2000, seed=0):
+    """Fights the same monsters with and without the combat tables and
+    compares what the fights cost, then does the same for whole games."""
+    ok = 1
+    tables = getCombatTables()
+    random.seed(seed)
+    for (level, hp, maxHP, itemPoints, discovery) in ((3, 15, 15, 50, 0),
+                                                      (12, 9, 40, 6, 0),
+                                                      (30, 60, 120, 0, 0),
+                                                      (45, 90, 200, 300, 1),
+                                                      (60, 150, 250, 20, 0)):
+        game = BatchGame(1, discovery=discovery)
+        game.rng = StandardRandom(seed + level)
+        game.god = God(game, roleMap['w'], CHAOTIC, game.policy)
+        template = game.god.getWorshipper()
+        template.setLevel(level)
+        template.hp, template.maxHP = hp, maxHP
+        template.itemPoints = itemPoints
+        started = time.time()
+        a = _sampleFights(template, fights)
+        exactTime = time.time() - started
+        game.combatTables = tables
+        started = time.time()
+        b = _sampleFights(template, fights)
+        fastTime = time.time() - started
+        print('Level %d, %d/%d hp, %d item points%s: %.1fx as fast' % (
+            level, hp, maxHP, itemPoints, discovery and ', discovery' or '',
+            exactTime / fastTime))
+        tests = []
+        for (name, column) in (('hit points lost', 0),
+                               ('item points spent', 1),
+                               ('score', 2)):
+            d, p = _ksTest(numpy.array([x[column] for x in a], float),
+                           numpy.array([x[column] for x in b], float))
+            tests.append(('%s (KS D=%.4f)' % (name, d), p))
+        for (name, column) in (('prayed', 3), ('quit', 4), ('died', 5)):
+            hitsA = len([x for x in a if x[column]])
+            hitsB = len([x for x in b if x[column]])
+            tests.append(('%s (%.4f vs. %.4f)' % (name, float(hitsA) / fights,
+                                                  float(hitsB) / fights),
+                          _proportionTest(hitsA, fights, hitsB, fights)))
+        ok = _reportTests(tests, .001, sys.stdout) and ok
+    for discovery in (0, 1):
+        role, alignment = roleMap['w'], CHAOTIC
+        started = time.time()
+        a = list(map(getSummary, BatchGame(games, role, alignment, discovery,
+                                           seed=seed).playAll()))
+        exactTime = time.time() - started
+        started = time.time()
+        b = list(map(getSummary, BatchGame(games, role, alignment, discovery,
+                                           seed=seed + 1,
+                                           fastCombat=1).playAll()))
+        fastTime = time.time() - started
+        print('Whole games, discovery=%s: %.1fx as fast' % (
+            discovery, exactTime / fastTime))
+        ok = compareSummaries(a, b) and ok
+    return ok
+
+def checkEventScheduler(games=2000, seed=0):
+    """Plays games rolling for every event every turn, then with
+    Player.scheduleEvent, and compares the outcomes and the speed."""
+    ok = 1
+    for discovery in (0, 1):
+        summaries = []
+        times = []
+        for schedule in (0, 1):
+            Player.scheduleEvents = schedule
+            started = time.time()
+            try:
+                summaries.append(list(map(getSummary, BatchGame(
+                    games, discovery=discovery, seed=seed + schedule).playAll())))
+            finally:
+                Player.scheduleEvents = 1
+            times.append(time.time() - started)
+        print('Discovery=%s: %.2fx as fast' % (discovery, times[0] / times[1]))
+        ok = compareSummaries(summaries[0], summaries[1]) and ok
+    return ok
+
+def checkSnapshots(games=200, seed=0):
+    """Plays games on from every prayer with the answer the god gave
+    the first time, and checks that they end exactly the same way. The
+    policies used don't roll dice, so nothing should change."""
+    ok = 1
+    for policy in (MoodPolicy, KindPolicy):
+        for discovery in (0, 1):
+            prayers = mismatches = size = 0
+            turns = branchTurns = 0
+            started = time.time()
+            for i in xrange(games):
+                role = random.choice([x for x in roles if x.pluralName])
+                result, prayerPoints = takeSnapshots(
+                    role, random.choice(alignments), discovery, policy,
+                    seed + i)
+                for (snapshot, type, key) in prayerPoints:
+                    prayers = prayers + 1
+                    size = size + len(snapshot)
+                    turns = turns + result[-1]
+                    branchTurns = branchTurns + result[-1] - cPickle.loads(snapshot)[6]
+                    if playFromSnapshot(snapshot, key) != result:
+                        mismatches = mismatches + 1
+            print('%s, discovery=%s: %d prayers, %d mismatches,' % (
+                policy.__name__, discovery, prayers, mismatches), end=' ')
+            print('%d-byte snapshots, %.1fx fewer turns than replaying (%.1fs)' % (
+                size // max(1, prayers), float(turns) / max(1, branchTurns),
+                time.time() - started))
+            ok = ok and not mismatches
+    return ok
+
+def checkCongregation(games=300, champions=100, seed=0):
+    """Plays games with one god and many champions, answering every
+    prayer the tick it comes and then only one a tick, and checks that
+    they're the games --batch plays. RandomPolicy rolls dice for its
+    answers, which must come from the right champion's generator; with
+    NumPy, FastRandom is tried too, as its state gets set mid-fight."""
+    ok = 1
+    role, alignment = roleMap['h'], CHAOTIC
+    rngs = [StandardRandom]
+    if numpy != None:
+        rngs.append(FastRandom)
+    for rng in rngs:
+        for policy in (MoodPolicy, RandomPolicy):
+            for discovery in (0, 1):
+                expected = sorted(BatchGame(games, role, alignment, discovery,
+                                            policy, seed, rng=rng).playAll())
+                for answers in (None, 1):
+                    congregation = Congregation(champions, games, answers,
+                                                role, alignment, discovery,
+                                                policy, seed, rng)
+                    results = sorted(congregation.playAll())
+                    print('%s, %s, discovery=%s, answers=%s:' % (
+                        rng.__name__, policy.__name__, discovery, answers),
+                          end=' ')
+                    print('%d of %d games different, %d ticks, %d prayers'
+                          % (len([x for x in zip(results, expected)
+                                  if x[0] != x[1]]), games,
+                             congregation.ticks, congregation.queue.queued))
+                    ok = ok and results == expected
+    return ok
+
+class Wanderer(Player):
+    """A champion who wins every fight without a blow being struck, as
+    in ProgressionModel."""
+
+    __slots__ = ()
+
+    def fightMonster(self):
+        if not self.rng.randint(0, 4):
+            self.getGoodie()
+
+def _meanTest(moments, expected, rate=0):
+    """Two-sided z-test of a sample mean; returns the p-value. For a
+    rate, the spread comes from the expected rate itself, which still
+    works when the sample never (or always) saw the event."""
+    se = moments.getStdDev() / math.sqrt(max(1, moments.count))
+    if rate:
+        se = math.sqrt(expected * (1 - expected) / max(1, moments.count))
+    if not se:
+        return float(abs(moments.mean - expected) < 1e-9)
+    return math.erfc(abs(moments.mean - expected) / se / math.sqrt(2))
+
+def checkProgressionModel(games=2000, seed=0, turns=MODEL_TURNS):
+    """Plays Wanderers for the model's turns and compares what they
+    did with what ProgressionModel says they should, and the speed."""
+    started = time.time()
+    model = ProgressionModel(turns)
+    modelTime = time.time() - started
+    game = BatchGame(1, policy=Policy(), seed=seed)
+    won, gold, items = Moments(), Moments(), Moments()
+    levelTurns = [Moments() for level in model.levelTurns]
+    halfway = turns // 2
+    reached = {halfway : [Moments() for level in model.levelTurns],
+               turns : [Moments() for level in model.levelTurns]}
+    started = time.time()
+    for i in xrange(games):
+        game.rng = StandardRandom(getBlockSeed(seed, i))
+        role, alignment = game.pickDeity()
+        game.god = God(game, role, alignment, game.policy)
+        pc = game.pc = Wanderer(game, role, alignment, game.god)
+        counts = [0] * len(levelTurns)
+        while pc.alive() and pc.turns < turns:
+            counts[pc.dungeonLevel] = counts[pc.dungeonLevel] + 1
+            pc.turn()
+            if pc.turns == halfway:
+                deepest = pc.deepestLevel
+                for level in range(1, len(levelTurns)):
+                    reached[halfway][level].add(deepest >= level)
+        if pc.turns < halfway:
+            for level in range(1, len(levelTurns)):
+                reached[halfway][level].add(pc.deepestLevel >= level)
+        for level in range(1, len(levelTurns)):
+            reached[turns][level].add(pc.deepestLevel >= level)
+        won.add(pc.won)
+        gold.add(pc.score)
+        items.add(pc.itemPoints - 50)
+        for (level, moments) in zip(range(len(counts)), levelTurns):
+            moments.add(counts[level])
+    gameTime = time.time() - started
+    print('%d games in %.2fs; the model in %.3fs' % (games, gameTime,
+                                                      modelTime))
+    tests = [('won (%.4f vs. %.4f)' % (won.mean, model.won),
+              _meanTest(won, model.won, 1)),
+            ('gold (%.1f vs. %.1f)' % (gold.mean, model.gold),
+              _meanTest(gold, model.gold)),
+             ('item points (%.1f vs. %.1f)' % (items.mean, model.items),
+              _meanTest(items, model.items))]
+    for level in range(1, len(levelTurns)):
+        if model.levelTurns[level] >= 1:
+            tests.append(('turns on level %d (%.2f vs. %.2f)' % (
+                level, levelTurns[level].mean, model.levelTurns[level]),
+                          _meanTest(levelTurns[level], model.levelTurns[level])))
+    for turn in (halfway, turns):
+        for level in range(2, len(levelTurns)):
+            chance = model.getReached(level, turn)
+            if .01 <= chance <= .99:
+                tests.append(('level %d by turn %d (%.4f vs. %.4f)' % (
+                    level, turn, reached[turn][level].mean, chance),
+                              _meanTest(reached[turn][level], chance, 1)))
+    return _reportTests(tests, .001, sys.stdout)
+
+### Benchmarks
+
+#The benchmarks time the hot paths of the scalar engine on fixed seeds,
+#so that a change that makes them slower shows up. Each is run
+#BENCH_REPEAT times and the best rate counts, which keeps out most of
+#the noise from whatever else the machine is doing. Rates are only
+#comparable on the same machine and Python.
+
+BENCH_SEED = 0
+BENCH_REPEAT = 3
+BENCH_TOLERANCE = 10.0 #Percent a rate may drop before it's a regression
+
+def benchGames(discovery=0, games=200):
+    "Plays whole games, counting games and champion-turns."
+    suffix = ''
+    if discovery:
+        suffix = ', -D'
+    def run():
+        turns = 0
+        for result in BatchGame(games, discovery=discovery,
+                                seed=BENCH_SEED).playAll():
+            turns = turns + result[-1]
+        return [('games/sec' + suffix, games),
+                ('champion-turns/sec' + suffix, turns)]
+    return run
+
+def benchFights(fights=4000):
+    "Fights monsters with champions on a spread of dungeon levels."
+    game = BatchGame(1)
+    champions = []
+    for level in range(1, MAX_DUNGEON_LEVEL, 8):
+        pc = God(game, roleMap['w'], CHAOTIC, MoodPolicy()).getWorshipper()
+        pc.setLevel(level)
+        pc.maxHP = pc.hp = 15 + level * 2
+        pc.itemPoints = 50 + level * 10
+        champions.append((pc, pc.getState()))
+    def run():
+        for i in xrange(fights):
+            pc, state = champions[i % len(champions)]
+            pc.setState(state)
+            pc.fightMonster()
+        return [('fights/sec', fights)]
+    return run
+
+def benchPrayers(prayers=10000):
+    "Answers every kind of prayer, with the god in every mood."
+    game = BatchGame(1)
+    pc = God(game, roleMap['w'], CHAOTIC, MoodPolicy()).getWorshipper()
+    state = pc.getState()
+    requests = []
+    for i in xrange(prayers):
+        requests.append(((INTERCESSORY_PRAYER, i % 3 + 1),
+                         (SACRIFICIAL_PRAYER, i % 20),
+                         (BLESSING_PRAYER, None))[i % 3] + ((i * 37) % 400,))
+    def run():
+        for (type, arg, prayerTimeout) in requests:
+            pc.setState(state)
+            pc.prayerTimeout = prayerTimeout
+            pc.god.handlePrayer(pc, type, arg)
+        return [('prayers/sec', prayers)]
+    return run
+
+def benchWrap(texts=WRAP_CACHE_SIZE * 4):
+    """Wraps texts the size of the game's messages. There are more of
+    them than wrap remembers, so every one is really wrapped."""
+    game = BatchGame(1)
+    words = ' '.join(GENERIC_HELP_PRAYERS).replace('%s', 'Anhur').split()
+    messages = []
+    for i in xrange(texts):
+        messages.append('%d %s' % (i, ' '.join(words[i % len(words):])))
+    def run():
+        for message in messages:
+            game.wrap(message)
+        return [('wraps/sec', texts)]
+    return run
+
+def benchChampions(champions=4000):
+    "Creates champions for every deity."
+    game = BatchGame(1)
+    gods = []
+    for role in roles:
+        if role.pluralName:
+            for alignment in alignments:
+                gods.append(God(game, role, alignment, MoodPolicy()))
+    def run():
+        for i in xrange(champions):
+            god = gods[i % len(gods)]
+            Player(game, god.role, god.alignment, god)
+        return [('champions/sec', champions)]
+    return run
+
+benchmarks = (benchGames, lambda: benchGames(1), benchFights, benchPrayers,
+              benchWrap, benchChampions)
+
+def runBenchmarks(repeat=BENCH_REPEAT):
+    "Returns a list of (metric, best rate) pairs."
+    rates = []
+    for benchmark in benchmarks:
+        Game.rng.seed(BENCH_SEED)
+        run = benchmark()
+        best = {}
+        for i in xrange(repeat):
+            Game.rng.seed(BENCH_SEED)
+            started = time.time()
+            counts = run()
+            elapsed = max(time.time() - started, 1e-6)
+            for (metric, count) in counts:
+                best[metric] = max(best.get(metric, 0), count / elapsed)
+        for (metric, count) in counts:
+            rates.append((metric, best[metric]))
+    return rates
+
+def readBaseline(path):
+    "Reads a file saved by saveBaseline into a dictionary."
+    baseline = {}
+    for line in open(path):
+        if line[:1] != '#' and line.strip():
+            metric, rate = line.rstrip('\n').split('\t')
+            baseline[metric] = float(rate)
+    return baseline
+
+def saveBaseline(path, rates):
+    file = open(path, 'w')
+    file.write('#WFTM %s benchmark baseline, Python %s\n' % (
+        VERSION, sys.version.split()[0]))
+    for (metric, rate) in rates:
+        file.write('%s\t%.1f\n' % (metric, rate))
+    file.close()
+
+def bench(path, tolerance=BENCH_TOLERANCE, out=None):
+    """Runs the benchmarks and compares them with the baseline in
+    path, or saves them there if there isn't one. Returns false if any
+    rate dropped more than tolerance percent below its baseline."""
+    out = out or sys.stdout
+    rates = runBenchmarks()
+    if not os.path.exists(path):
+        saveBaseline(path, rates)
+        for (metric, rate) in rates:
+            out.write('  %-30s %12.1f\n' % (metric, rate))
+        out.write('Saved as the baseline in %s\n' % path)
+        return 1
+    baseline = readBaseline(path)
+    ok = 1
+    for (metric, rate) in rates:
+        if metric not in baseline:
+            out.write('  %-30s %12.1f %12s\n' % (metric, rate, 'new'))
+            continue
+        change = (rate / baseline[metric] - 1) * 100
+        verdict = 'ok'
+        if change < -tolerance:
+            verdict = 'SLOWER'
+            ok = 0
+        out.write('  %-30s %12.1f %12.1f %+6.1f%% %s\n' % (
+            metric, rate, baseline[metric], change, verdict))
+    return ok
+
+def checkFastRandom(games=2000, seed=0, draws=200000):
+    """Plays the same games with StandardRandom and FastRandom, which
+    should come out exactly the same, and compares the speed of the
+    games and of randint alone."""
+    times = []
+    results = []
+    for rng in (StandardRandom, FastRandom):
+        started = time.time()
+        results.append(list(BatchGame(games, seed=seed, rng=rng).playAll()))
+        times.append(time.time() - started)
+        randint = rng(seed).randint
+        started = time.time()
+        for i in xrange(draws):
+            randint(0, 3)
+        times.append(time.time() - started)
+    print('Whole games: %.2fx as fast' % (times[0] / times[2]))
+    print('randint: %.0f vs. %.0f ns (%.2fx as fast)' % (
+        times[1] / draws * 1e9, times[3] / draws * 1e9, times[1] / times[3]))
+    different = len([1 for (a, b) in zip(results[0], results[1]) if a != b])
+    print('%d of %d games different' % (different, games))
+    return not different
+
+checks = { 'vector' : checkVectorEngine,
+           'combat' : checkCombatTables,
+           'events' : checkEventScheduler,
+           'snapshots' : checkSnapshots,
+           'model' : checkProgressionModel,
+           'congregation' : checkCongregation,
+           'rng' : checkFastRandom }
 
 if __name__ == '__main__':
     Game().run(sys.argv)